@@ -0,0 +1,251 @@
+"""
+Асинхронный (ASGI) вариант API поверх aiosqlite: те же четыре ресурса
+и та же спецификация Swagger, что и в routes.py.
+
+Запуск: uvicorn asgi:app
+Синхронный режим (python routes.py) остаётся доступным для сравнения.
+"""
+import contextlib
+from typing import Any, Dict, Optional, Tuple
+
+from marshmallow import ValidationError
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from werkzeug.http import http_date, parse_date, parse_etags, quote_etag
+
+import models_async as db
+from models import Author, BOOK_SORT_FIELDS, AUTHOR_SORT_FIELDS, BOOKS_TABLE_NAME, AUTHORS_TABLE_NAME
+from pagination import PageArgsError, parse_page_args, next_page_headers
+from schemas import AuthorSchema, BookListSchema, BookBulkSchema, AuthorBulkSchema
+from serializers import dump, dump_many
+
+_spec: Optional[dict] = None
+
+
+def _json(data: Any, status: int = 200, headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    return JSONResponse(data, status_code=status, headers=headers)
+
+
+def _etag_headers(version: Tuple[str, float]) -> Dict[str, str]:
+    tag, modified = version
+    return {'ETag': quote_etag(tag), 'Last-Modified': http_date(modified)}
+
+
+def _not_modified(request: Request, version: Tuple[str, float]) -> Optional[Response]:
+    # как routes._not_modified: If-None-Match, если он есть, иначе If-Modified-Since
+    tag, modified = version
+    header = request.headers.get('if-none-match')
+    if header:
+        not_modified = parse_etags(header).contains_weak(tag)
+    else:
+        since = parse_date(request.headers.get('if-modified-since'))
+        not_modified = since is not None and int(modified) <= since.timestamp()
+    return Response(status_code=304, headers=_etag_headers(version)) if not_modified else None
+
+
+def _precondition_failed(request: Request, version: Tuple[str, float]) -> bool:
+    header = request.headers.get('if-match')
+    return header is not None and not parse_etags(header).contains(version[0])
+
+
+async def _body(request: Request) -> Any:
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def _load_book(data: Any) -> Tuple[Optional[Any], Optional[Dict]]:
+    """
+    Проверка книги без синхронных запросов из BookSchema.pre_load:
+    автор ищется асинхронно, типы полей проверяет BookBulkSchema.
+    """
+    if not isinstance(data, dict):
+        return None, {'_schema': ['Invalid input type.']}
+    author = data.get('author')
+    if isinstance(author, dict):
+        if not author.get('first_name') or not author.get('last_name'):
+            return None, {'author': ['Введите в запросе имя и фамилию автора (first_name, last_name)']}
+        found = await db.get_author_by_name(author)
+        if not found:
+            return None, {'author': ['Нет автора с таким именем и фамилией, '
+                                     'сначала надо добавить его в таблицу авторов!']}
+        data = dict(data, author=found.id)
+    elif isinstance(author, int) and not isinstance(author, bool):
+        if not await db.get_author_by_id(author):
+            return None, {'author': [f'Нет автора с таким id={author}!']}
+    else:
+        return None, {'author': ['Неправильный тип данных автора']}
+    try:
+        book = BookBulkSchema().load({key: value for key, value in data.items() if key != 'id'})
+    except ValidationError as exc:
+        return None, exc.messages
+    return book, None
+
+
+async def books(request: Request) -> Response:
+    if request.method == 'POST':
+        data = await _body(request)
+        # проверка автора и вставка - одна транзакция: автора не удалят между ними
+        async with db.database.write():
+            book, errors = await _load_book(data)
+            if errors:
+                return _json(errors, 400)
+            book = await db.add_book(book)
+            return _json(dump(BookListSchema, book), 201)
+
+    try:
+        page = parse_page_args(BOOK_SORT_FIELDS, request.query_params)
+        author_id = int(request.query_params['author']) if 'author' in request.query_params else None
+    except (PageArgsError, ValueError) as exc:
+        return _json([{"error": str(exc)}], 400)
+    version = await db.get_tables_version(BOOKS_TABLE_NAME, AUTHORS_TABLE_NAME)
+    not_modified = _not_modified(request, version)
+    if not_modified:
+        return not_modified
+    items = await db.get_books_page(author_id=author_id, title_prefix=request.query_params.get('title'), **page)
+    books_data = dump_many(BookListSchema, items)
+    if page['sort'] == 'author':
+        sort_value = lambda item: item['author']['id']
+    else:
+        sort_value = lambda item: item[page['sort']]
+    headers = next_page_headers(books_data, page['limit'], sort_value, str(request.url.replace(query='')),
+                                dict(request.query_params))
+    return _json(books_data, 200, dict(headers, **_etag_headers(version)))
+
+
+async def book_edit(request: Request) -> Response:
+    book_id = request.path_params['book_id']
+    if request.method == 'GET':
+        version = await db.get_book_version(book_id)
+        if version is None:
+            return _json([{"error": f"Книги с таким ID({book_id}) нет"}], 404)
+        not_modified = _not_modified(request, version)
+        if not_modified:
+            return not_modified
+        book = await db.get_book_by_id(book_id)
+        if not book:
+            return _json([{"error": f"Книги с таким ID({book_id}) нет"}], 404)
+        return _json(dump(BookListSchema, book), 200, _etag_headers(version))
+
+    data = await _body(request) if request.method == 'PUT' else None
+    # проверка If-Match и запись - одна транзакция на соединении-писателе
+    async with db.database.write():
+        version = await db.get_book_version(book_id)
+        if version is None:
+            return _json([{"error": f"Книги с таким ID({book_id}) нет"}], 404)
+        if _precondition_failed(request, version):
+            return _json([{"error": "Книга была изменена (ETag не совпадает)"}], 412)
+        if request.method == 'DELETE':
+            await db.delete_book_by_id(book_id)
+            return _json([{"info": "Удаление прошло успешно"}], 200)
+
+        book, errors = await _load_book(data)
+        if errors:
+            return _json(errors, 400)
+        book.id = book_id
+        book = await db.update_book_by_id(book)
+        if book is None:
+            return _json([{"error": f"Книги с таким ID({book_id}) нет"}], 404)
+        return _json(dump(BookListSchema, book), 200, _etag_headers(await db.get_book_version(book_id)))
+
+
+async def authors(request: Request) -> Response:
+    if request.method == 'POST':
+        try:
+            author = AuthorBulkSchema().load(await _body(request))
+        except ValidationError as exc:
+            return _json(exc.messages, 400)
+        if author.id is not None:
+            return _json({"id": ["id назначается базой"]}, 400)
+        async with db.database.write():
+            if await db.get_author_by_name({'first_name': author.first_name, 'last_name': author.last_name}):
+                return _json({"_schema": ['Такой автор уже есть в базе']}, 400)
+            author = await db.add_author(author)
+            return _json(AuthorSchema().dump(author), 201)
+
+    try:
+        page = parse_page_args(AUTHOR_SORT_FIELDS, request.query_params)
+    except PageArgsError as exc:
+        return _json([{"error": str(exc)}], 400)
+    version = await db.get_tables_version(AUTHORS_TABLE_NAME)
+    not_modified = _not_modified(request, version)
+    if not_modified:
+        return not_modified
+    authors_data = dump_many(AuthorSchema, await db.get_authors_page(**page))
+    headers = next_page_headers(authors_data, page['limit'], lambda item: item[page['sort']],
+                                str(request.url.replace(query='')), dict(request.query_params))
+    return _json(authors_data, 200, dict(headers, **_etag_headers(version)))
+
+
+async def author_edit(request: Request) -> Response:
+    author_id = request.path_params['author_id']
+    if request.method == 'GET':
+        version = await db.get_author_version(author_id)
+        if version is None:
+            return _json([{"error": f"Автора с таким ID({author_id}) нет"}], 404)
+        not_modified = _not_modified(request, version)
+        if not_modified:
+            return not_modified
+        author = await db.get_author_by_id(author_id)
+        if not author:
+            return _json([{"error": f"Автора с таким ID({author_id}) нет"}], 404)
+        return _json(dump(AuthorSchema, author), 200, _etag_headers(version))
+
+    data = await _body(request) if request.method == 'PUT' else None
+    async with db.database.write():
+        version = await db.get_author_version(author_id)
+        if version is None:
+            return _json([{"error": f"Автора с таким ID({author_id}) нет"}], 404)
+        if _precondition_failed(request, version):
+            return _json([{"error": "Автор был изменён (ETag не совпадает)"}], 412)
+        if request.method == 'DELETE':
+            await db.delete_author_by_id(author_id)
+            return _json([{"info": "Удаление прошло успешно"}], 200)
+
+        try:
+            loaded: Author = AuthorBulkSchema().load(data)
+        except ValidationError as exc:
+            return _json(exc.messages, 400)
+        loaded.id = author_id
+        await db.update_author_by_id(loaded)
+        return _json(AuthorSchema().dump(await db.get_author_by_id(author_id)), 200,
+                     _etag_headers(await db.get_author_version(author_id)))
+
+
+def _build_spec() -> dict:
+    # та же спецификация, что у routes.py: собранный swagger.json или flasgger из docstring-ов
+    import openapi
+    from routes import app as flask_app
+    return openapi.get_spec(flask_app)
+
+
+async def apispec(request: Request) -> Response:
+    global _spec
+    if _spec is None:
+        _spec = _build_spec()
+    return _json(_spec)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(application: Starlette):
+    await db.migrate()
+    await db.database.open()
+    try:
+        yield
+    finally:
+        await db.database.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/api/books', books, methods=['GET', 'POST']),
+        Route('/api/authors', authors, methods=['GET', 'POST']),
+        Route('/api/books/{book_id:int}', book_edit, methods=['GET', 'PUT', 'DELETE']),
+        Route('/api/authors/{author_id:int}', author_edit, methods=['GET', 'PUT', 'DELETE']),
+        Route('/apispec_1.json', apispec, methods=['GET']),
+    ],
+    lifespan=lifespan,
+)
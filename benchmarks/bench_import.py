@@ -0,0 +1,68 @@
+"""
+Время холодного старта: импорт routes.py (то, что делает каждый воркер и
+каждый перезапуск) и первый запрос /apispec_1.json.
+
+    BOOKS_DB_PATH=bench.db python -m benchmarks.bench_import [--repeat 7] [--json out.json]
+
+Каждый замер - в отдельном процессе python, чтобы модули не брались из
+sys.modules; в отчёте лучшее и медианное время из --repeat прогонов.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORT = """
+import time
+start = time.perf_counter()
+import routes
+print(time.perf_counter() - start)
+"""
+
+_FIRST_SPEC = """
+import time
+import routes
+client = routes.app.test_client()
+start = time.perf_counter()
+response = client.get('/apispec_1.json')
+assert response.status_code == 200, response.status_code
+print(time.perf_counter() - start)
+"""
+
+
+def _run(code: str, repeat: int) -> Dict[str, float]:
+    env = dict(os.environ, BOOKS_METRICS=os.environ.get('BOOKS_METRICS', '0'))
+    timings: List[float] = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', code], cwd=BASE_DIR, env=env,
+                             check=True, capture_output=True, text=True)
+        timings.append(float(out.stdout.strip().splitlines()[-1]))
+    return {
+        'best_ms': round(min(timings) * 1000, 1),
+        'median_ms': round(statistics.median(timings) * 1000, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Cold import and first spec request time')
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--json', help='save the report to this file')
+    args = parser.parse_args()
+    report = {
+        'import_routes': _run(_IMPORT, args.repeat),
+        'first_apispec': _run(_FIRST_SPEC, args.repeat),
+    }
+    for name, result in report.items():
+        print(f'{name:15} ' + '  '.join(f'{key}={value}' for key, value in result.items()))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as out:
+            json.dump(report, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
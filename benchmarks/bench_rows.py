@@ -0,0 +1,85 @@
+"""
+Память и число аллокаций на строку для больших списков книг.
+
+База берётся из BOOKS_DB_PATH (заполняется benchmarks.seed), например:
+    BOOKS_DB_PATH=bench.db python -m benchmarks.seed --books 1000000
+    BOOKS_DB_PATH=bench.db BOOKS_METRICS=0 python -m benchmarks.bench_rows
+
+Замеры:
+- objects: get_all_books() - список моделей Book / Author целиком в памяти,
+  байт и блоков памяти (tracemalloc) на строку;
+- export_objects / export_rows: потоковая сериализация всего каталога через
+  объекты моделей и напрямую из строк курсора; время - отдельным прогоном без tracemalloc.
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Tuple
+
+from models import BOOK_ROW_COLUMNS, get_all_books, iter_book_rows, iter_books
+from schemas import BookListSchema
+from serializers import get_dumper, get_row_dumper
+
+
+def _measure(func: Callable[[], Tuple[int, Any]]) -> Dict[str, float]:
+    # func возвращает число строк и то, что должно остаться в памяти к моменту замера
+    gc.collect()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    tracemalloc.start()
+    rows, kept = func()
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sum(stat.count for stat in snapshot.statistics('filename'))
+    return {
+        'rows': rows,
+        'seconds': round(elapsed, 3),
+        'bytes_per_row': round(current / rows, 1) if rows else 0.0,
+        'blocks_per_row': round(blocks / rows, 2) if rows else 0.0,
+        'peak_mb': round(peak / 2 ** 20, 1),
+    }
+
+
+def objects():
+    books = get_all_books()
+    return len(books), books
+
+
+def export_objects():
+    dump_book = get_dumper(BookListSchema)
+    count = 0
+    for book in iter_books():
+        json.dumps(dump_book(book))
+        count += 1
+    return count, None
+
+
+def export_rows():
+    dump_book = get_row_dumper(BookListSchema, BOOK_ROW_COLUMNS)
+    count = 0
+    for row in iter_book_rows():
+        json.dumps(dump_book(row))
+        count += 1
+    return count, None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Per-row memory of book listings')
+    parser.add_argument('--json', help='save the report to this file')
+    args = parser.parse_args()
+    report = {name: _measure(func) for name, func in
+              (('objects', objects), ('export_objects', export_objects), ('export_rows', export_rows))}
+    for name, result in report.items():
+        print(f'{name:15} ' + '  '.join(f'{key}={value}' for key, value in result.items()))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as out:
+            json.dump(report, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Сравнение marshmallow Schema.dump и сгенерированных функций из serializers.py.
+
+Запуск из корня проекта: python -m benchmarks.bench_serializers [10000 100000 ...]
+"""
+import json
+import sys
+import time
+from typing import Callable, List
+
+from models import Author, Book
+from schemas import AuthorSchema, BookListSchema
+from serializers import dump_many, get_dumper
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def make_books(count: int, authors: int = 1000) -> List[Book]:
+    author_objs = [Author(id=i, first_name=f'Имя {i}', last_name=f'Фамилия {i}', middle_name='Отчество')
+                   for i in range(1, authors + 1)]
+    return [Book(id=i, title=f'Книга номер {i}', author=author_objs[i % authors]) for i in range(1, count + 1)]
+
+
+def best_of(func: Callable[[], object], repeat: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(count: int) -> dict:
+    books = make_books(count)
+    get_dumper(BookListSchema)
+
+    marshmallow_time = best_of(lambda: BookListSchema().dump(books, many=True))
+    compiled_time = best_of(lambda: dump_many(BookListSchema, books))
+    identical = json.dumps(BookListSchema().dump(books, many=True)) == json.dumps(dump_many(BookListSchema, books))
+    result = {
+        'rows': count,
+        'marshmallow_s': round(marshmallow_time, 4),
+        'compiled_s': round(compiled_time, 4),
+        'speedup': round(marshmallow_time / compiled_time, 1),
+        'identical_json': identical,
+    }
+    data = dump_many(BookListSchema, books)
+    result['json_dumps_s'] = round(best_of(lambda: json.dumps(data)), 4)
+    if orjson is not None:
+        result['orjson_dumps_s'] = round(best_of(lambda: orjson.dumps(data)), 4)
+    return result
+
+
+def main(argv: List[str]) -> None:
+    sizes = [int(arg) for arg in argv] or [10000, 100000]
+    # AuthorSchema собирается один раз, как и при старте приложения
+    get_dumper(AuthorSchema)
+    for count in sizes:
+        print(json.dumps(run(count)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
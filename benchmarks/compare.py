@@ -0,0 +1,56 @@
+"""
+Сравнение двух отчётов benchmarks.load.
+
+    python -m benchmarks.compare old.json new.json [--threshold 0.10]
+
+Код возврата 1, если пропускная способность упала или p95/p99 выросли
+больше чем на threshold (по умолчанию 10%) хотя бы для одного транспорта.
+"""
+import argparse
+import json
+import sys
+from typing import List, Optional
+
+
+def _change(old: float, new: float) -> float:
+    return (new - old) / old if old else 0.0
+
+
+def compare(old: dict, new: dict, threshold: float) -> List[str]:
+    regressions = []
+    for transport, new_run in new['runs'].items():
+        old_run = old['runs'].get(transport)
+        if old_run is None:
+            continue
+        rows = [('throughput_rps', old_run['throughput_rps'], new_run['throughput_rps'], -1)]
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            rows.append((key, old_run['latency'][key], new_run['latency'][key], 1))
+        for metric, old_value, new_value, direction in rows:
+            change = _change(old_value, new_value)
+            marker = ''
+            if metric != 'p50_ms' and change * direction > threshold:
+                marker = '  <-- regression'
+                regressions.append(f'{transport} {metric}')
+            print(f'{transport:10} {metric:15} {old_value:>10} -> {new_value:>10} ({change:+.1%}){marker}')
+    old_rss, new_rss = old.get('peak_rss_mb'), new.get('peak_rss_mb')
+    if old_rss and new_rss:
+        print(f"{'':10} {'peak_rss_mb':15} {old_rss:>10} -> {new_rss:>10} ({_change(old_rss, new_rss):+.1%})")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Compare two load test reports')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0.10)
+    args = parser.parse_args(argv)
+    with open(args.old, encoding='utf-8') as old_file, open(args.new, encoding='utf-8') as new_file:
+        regressions = compare(json.load(old_file), json.load(new_file), args.threshold)
+    if regressions:
+        print('Regressions: ' + ', '.join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
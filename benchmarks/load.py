@@ -0,0 +1,372 @@
+"""
+Нагрузочный тест API: смешанная нагрузка чтение/запись по всем маршрутам routes.py
+через Flask test client и через настоящий локальный сокет. Кроме списков и карточек -
+поиск, /api/changes, сводка авторов, пакетные записи, условные GET, сжатие и
+Idempotency-Key; поток SSE бесконечен и в смесь не входит, выгрузка замеряется отдельно.
+
+Запуск из корня проекта:
+    python -m benchmarks.load --books 100000 --requests 20000 --concurrency 8 --out benchmark_results.json
+
+Результат (пропускная способность, p50/p95/p99 по маршрутам, пиковый RSS) пишется
+в JSON; два таких файла сравнивает python -m benchmarks.compare old.json new.json.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import resource
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+Request = Tuple[str, str, Any, Dict[str, str]]
+
+
+class Workload:
+    """
+    Состояние нагрузки: диапазоны существующих id и id, созданные самим тестом
+    (удаляются только они, чтобы не опустошить каталог).
+    """
+
+    def __init__(self, books: int, authors: int):
+        self.max_book_id = books
+        self.max_author_id = authors
+        self.created_books: List[int] = []
+        self.created_authors: List[int] = []
+        self._lock = threading.Lock()
+        self._counter = 0
+
+    def unique(self) -> int:
+        with self._lock:
+            self._counter += 1
+            return self._counter
+
+    def remember(self, kind: str, ids: List[int]) -> None:
+        with self._lock:
+            getattr(self, f'created_{kind}').extend(ids)
+
+    def take(self, kind: str, count: int = 1) -> List[int]:
+        with self._lock:
+            created = getattr(self, f'created_{kind}')
+            taken = created[-count:]
+            del created[-count:]
+            return taken
+
+
+def _created_ids(body: bytes) -> List[int]:
+    data = json.loads(body)
+    if isinstance(data, dict) and 'results' in data:
+        return [item['data']['id'] for item in data['results'] if item['status'] == 201]
+    return [data['id']]
+
+
+def _operations(state: Workload) -> List[Tuple[str, int, Callable[[random.Random], Optional[Request]],
+                                             Optional[Callable[[bytes], None]]]]:
+    def book_id(rnd): return rnd.randint(1, state.max_book_id)
+    def author_id(rnd): return rnd.randint(1, state.max_author_id)
+
+    def list_books(rnd):
+        params = [f'limit={rnd.choice((20, 50, 100))}']
+        roll = rnd.random()
+        if roll < 0.2:
+            params.append('sort=title')
+        elif roll < 0.3:
+            params.append(f'author={author_id(rnd)}')
+        elif roll < 0.4:
+            params.append('title=' + quote(rnd.choice(('Война', 'Сад', 'Мир', 'Дом'))))
+        return 'GET', '/api/books?' + '&'.join(params), None, {}
+
+    def deep_page(rnd):
+        from pagination import encode_cursor
+        return 'GET', f'/api/books?limit=50&after={encode_cursor(None, book_id(rnd))}', None, {}
+
+    def new_book(rnd):
+        return {'title': f'Нагрузка {state.unique()}', 'author': author_id(rnd)}
+
+    def new_author(rnd):
+        return {'first_name': 'Тест', 'last_name': f'Нагрузка-{state.unique()}', 'middle_name': ''}
+
+    def search(rnd):
+        query = quote(rnd.choice(('война', 'мир', 'сад', 'герой ночь', 'Толст', 'Булгаков', 'Чех')))
+        return 'GET', f"/api/search?q={query}&type={rnd.choice(('all', 'books', 'authors'))}&limit=20", None, {}
+
+    def changes(rnd):
+        # сидированный каталог уже в журнале вставками: since - где-то внутри него
+        since = rnd.randint(0, state.max_book_id + state.max_author_id)
+        return 'GET', f'/api/changes?since={since}&limit=100', None, {}
+
+    def idempotent_book(rnd):
+        return 'POST', '/api/books', new_book(rnd), {'Idempotency-Key': f'load-{state.unique()}'}
+
+    def delete_one(kind, path):
+        def build(rnd):
+            ids = state.take(kind)
+            return ('DELETE', f'{path}/{ids[0]}', None, {}) if ids else None
+        return build
+
+    def delete_bulk(kind, path):
+        def build(rnd):
+            ids = state.take(kind, 20)
+            return ('DELETE', f'{path}/bulk', ids, {}) if ids else None
+        return build
+
+    return [
+        ('GET /api/books', 30, list_books, None),
+        ('GET /api/books?after', 5, deep_page, None),
+        ('GET /api/books/<id>', 25, lambda rnd: ('GET', f'/api/books/{book_id(rnd)}', None, {}), None),
+        ('GET /api/authors', 5, lambda rnd: ('GET', '/api/authors?limit=50&sort=last_name', None, {}), None),
+        ('GET /api/authors/<id>', 10, lambda rnd: ('GET', f'/api/authors/{author_id(rnd)}', None, {}), None),
+        ('POST /api/books', 5, lambda rnd: ('POST', '/api/books', new_book(rnd), {}),
+         lambda body: state.remember('books', _created_ids(body))),
+        ('PUT /api/books/<id>', 4, lambda rnd: ('PUT', f'/api/books/{book_id(rnd)}', new_book(rnd), {}), None),
+        ('DELETE /api/books/<id>', 2, delete_one('books', '/api/books'), None),
+        ('POST /api/authors', 2, lambda rnd: ('POST', '/api/authors', new_author(rnd), {}),
+         lambda body: state.remember('authors', _created_ids(body))),
+        ('PUT /api/authors/<id>', 1, lambda rnd: ('PUT', f'/api/authors/{author_id(rnd)}', new_author(rnd), {}),
+         None),
+        ('DELETE /api/authors/<id>', 1, delete_one('authors', '/api/authors'), None),
+        ('POST /api/books/bulk', 1, lambda rnd: ('POST', '/api/books/bulk', [new_book(rnd) for _ in range(50)], {}),
+         lambda body: state.remember('books', _created_ids(body))),
+        ('PUT /api/books/bulk', 1, lambda rnd: ('PUT', '/api/books/bulk',
+                                                [dict(new_book(rnd), id=book_id(rnd)) for _ in range(50)], {}), None),
+        ('DELETE /api/books/bulk', 1, delete_bulk('books', '/api/books'), None),
+        ('POST /api/authors/bulk', 1, lambda rnd: ('POST', '/api/authors/bulk',
+                                                   [new_author(rnd) for _ in range(20)], {}),
+         lambda body: state.remember('authors', _created_ids(body))),
+        ('PUT /api/authors/bulk', 1, lambda rnd: ('PUT', '/api/authors/bulk',
+                                                  [dict(new_author(rnd), id=author_id(rnd)) for _ in range(20)], {}),
+         None),
+        ('DELETE /api/authors/bulk', 1, delete_bulk('authors', '/api/authors'), None),
+        ('GET /api/books?fields', 3, lambda rnd: ('GET', '/api/books?limit=100&fields=id,title&expand=', None, {}),
+         None),
+        ('GET /api/books gzip', 3, lambda rnd: ('GET', '/api/books?limit=100', None, {'Accept-Encoding': 'gzip'}),
+         None),
+        ('GET /api/books/<id> If-None-Match', 3,
+         lambda rnd: ('GET', f'/api/books/{book_id(rnd)}', None, {'If-None-Match': '*'}), None),
+        ('GET /api/authors?include=books', 2,
+         lambda rnd: ('GET', '/api/authors?limit=20&include=books', None, {}), None),
+        ('GET /api/authors/<id>/books', 2, lambda rnd: ('GET', f'/api/authors/{author_id(rnd)}/books', None, {}),
+         None),
+        ('GET /api/search', 3, search, None),
+        ('GET /api/changes', 2, changes, None),
+        ('GET /api/stats/authors', 1, lambda rnd: ('GET', '/api/stats/authors?limit=20', None, {}), None),
+        ('POST /api/books Idempotency-Key', 1, idempotent_book,
+         lambda body: state.remember('books', _created_ids(body))),
+        ('GET /api/stats/pool', 1, lambda rnd: ('GET', '/api/stats/pool', None, {}), None),
+        ('GET /api/stats/cache', 1, lambda rnd: ('GET', '/api/stats/cache', None, {}), None),
+    ]
+
+
+class TestClientTransport:
+    name = 'testclient'
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method: str, path: str, body: Any, headers: Dict[str, str]) -> Tuple[int, bytes]:
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.get_data()
+
+    def close(self) -> None:
+        pass
+
+
+class SocketTransport:
+    """
+    Настоящий HTTP через локальный сокет: многопоточный werkzeug-сервер
+    и keep-alive соединение на каждый поток нагрузки.
+    """
+    name = 'socket'
+
+    def __init__(self, app):
+        from werkzeug.serving import make_server
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.port = self.server.server_port
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        self._local = threading.local()
+
+    def request(self, method: str, path: str, body: Any, headers: Dict[str, str]) -> Tuple[int, bytes]:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        payload = None if body is None else json.dumps(body).encode()
+        headers = dict(headers, **({'Content-Type': 'application/json'} if payload is not None else {}))
+        try:
+            conn.request(method, path, body=payload, headers=headers)
+            response = conn.getresponse()
+        except Exception:
+            conn.close()
+            self._local.conn = None
+            raise
+        data = response.read()
+        if response.getheader('Connection', '').lower() == 'close':
+            conn.close()
+            self._local.conn = None
+        return response.status, data
+
+    def close(self) -> None:
+        self.server.shutdown()
+
+
+def percentiles(latencies: List[float]) -> Dict[str, float]:
+    if not latencies:
+        return {}
+    ordered = sorted(latencies)
+
+    def nearest_rank(q: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+    return {
+        'p50_ms': round(nearest_rank(0.50) * 1000, 3),
+        'p95_ms': round(nearest_rank(0.95) * 1000, 3),
+        'p99_ms': round(nearest_rank(0.99) * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+def run_workload(transport, state: Workload, requests: int, concurrency: int, seed: int) -> dict:
+    operations = _operations(state)
+    names = [op[0] for op in operations]
+    weights = [op[1] for op in operations]
+    latencies: Dict[str, List[float]] = {name: [] for name in names}
+    errors: Dict[str, int] = {name: 0 for name in names}
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def worker(worker_seed: int) -> None:
+        rnd = random.Random(worker_seed)
+        local_latencies: Dict[str, List[float]] = {name: [] for name in names}
+        local_errors: Dict[str, int] = {name: 0 for name in names}
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            name, _, build, on_response = operations[rnd.choices(range(len(operations)), weights=weights)[0]]
+            built = build(rnd)
+            if built is None:
+                # удалять пока нечего - вместо этого создаём
+                name, _, build, on_response = operations[names.index('POST /api/books')]
+                built = build(rnd)
+            method, path, body, headers = built
+            start = time.perf_counter()
+            try:
+                status, data = transport.request(method, path, body, headers)
+            except Exception:
+                status, data = 599, b''
+            local_latencies[name].append(time.perf_counter() - start)
+            if status >= 500:
+                local_errors[name] += 1
+            elif on_response is not None and status in (200, 201):
+                on_response(data)
+        with lock:
+            for name in names:
+                latencies[name].extend(local_latencies[name])
+                errors[name] += local_errors[name]
+
+    threads = [threading.Thread(target=worker, args=(seed + index,)) for index in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+
+    everything = [value for values in latencies.values() for value in values]
+    return {
+        'requests': len(everything),
+        'errors': sum(errors.values()),
+        'concurrency': concurrency,
+        'duration_s': round(duration, 3),
+        'throughput_rps': round(len(everything) / duration, 1) if duration else 0.0,
+        'latency': percentiles(everything),
+        'routes': {
+            name: dict(count=len(latencies[name]), errors=errors[name], **percentiles(latencies[name]))
+            for name in names if latencies[name]
+        },
+    }
+
+
+def measure_export(transport) -> dict:
+    start = time.perf_counter()
+    status, data = transport.request('GET', '/api/books/export?format=ndjson', None, {})
+    return {'status': status, 'bytes': len(data), 'rows': data.count(b'\n'),
+            'duration_s': round(time.perf_counter() - start, 3)}
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss в Linux - килобайты, в macOS - байты
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def main(argv: Optional[List[str]] = None) -> dict:
+    parser = argparse.ArgumentParser(description='Load test for the books API')
+    parser.add_argument('--db', default='benchmark_books.db', help='database file (recreated)')
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--authors', type=int, default=0, help='default: books / 10')
+    parser.add_argument('--requests', type=int, default=5000, help='requests per transport')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--transport', choices=('testclient', 'socket', 'both'), default='both')
+    parser.add_argument('--no-cache', action='store_true', help='disable the response cache')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='benchmark_results.json')
+    args = parser.parse_args(argv)
+
+    # путь к базе читается модулем db при импорте
+    os.environ['BOOKS_DB_PATH'] = args.db
+    from benchmarks.seed import reset_db, seed_catalog
+    from routes import app
+    from cache import NullCache, configure_cache
+
+    if args.no_cache:
+        configure_cache(NullCache())
+    reset_db()
+    seeded = seed_catalog(args.books, args.authors, seed=args.seed)
+
+    transports = {'testclient': [TestClientTransport], 'socket': [SocketTransport],
+                  'both': [TestClientTransport, SocketTransport]}[args.transport]
+    runs, export = {}, {}
+    for transport_cls in transports:
+        transport = transport_cls(app)
+        try:
+            state = Workload(seeded['books'], seeded['authors'])
+            runs[transport.name] = run_workload(transport, state, args.requests, args.concurrency, args.seed)
+            export[transport.name] = measure_export(transport)
+        finally:
+            transport.close()
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'args': vars(args),
+        },
+        'seed': seeded,
+        'runs': runs,
+        'export': export,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    with open(args.out, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    for name, run in runs.items():
+        print(f"{name}: {run['throughput_rps']} req/s, p50 {run['latency']['p50_ms']} ms, "
+              f"p99 {run['latency']['p99_ms']} ms, errors {run['errors']}")
+    print(f"peak RSS {report['peak_rss_mb']} MB -> {args.out}")
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Генерация тестового каталога заданного размера.
+
+База берётся из BOOKS_DB_PATH (как и в приложении), поэтому переменную
+нужно выставить до импорта: BOOKS_DB_PATH=bench.db python -m benchmarks.seed --books 100000
+"""
+import argparse
+import os
+import random
+import time
+from typing import Iterator, List
+
+from db import DB_PATH, pool
+from migrations import migrate
+from models import Author, Book, add_authors, add_books
+
+FIRST_NAMES = ['Лев', 'Михаил', 'Анна', 'Фёдор', 'Иван', 'Марина', 'Антон', 'Борис', 'Ольга', 'Николай']
+LAST_NAMES = ['Толстой', 'Булгаков', 'Ахматова', 'Достоевский', 'Бунин', 'Цветаева', 'Чехов', 'Пастернак',
+              'Берггольц', 'Гоголь']
+TITLE_WORDS = ['война', 'мир', 'сердце', 'время', 'герой', 'мастер', 'дом', 'дорога', 'ночь', 'сад', 'река',
+               'город', 'письмо', 'остров', 'снег']
+
+
+def _author_weights(authors: int, skew: float) -> List[float]:
+    # несколько авторов пишут много книг, большинство - по одной-две (распределение Ципфа)
+    weights, total = [], 0.0
+    for rank in range(1, authors + 1):
+        total += 1.0 / rank ** skew
+        weights.append(total)
+    return weights
+
+
+def _chunks(count: int, size: int) -> Iterator[range]:
+    for start in range(0, count, size):
+        yield range(start, min(start + size, count))
+
+
+def seed_catalog(books: int, authors: int = 0, skew: float = 1.1, seed: int = 0, batch: int = 10000) -> dict:
+    """
+    Заполняет базу каталогом из books книг; авторов по умолчанию в 10 раз меньше.
+    Возвращает итоговые размеры и время заполнения.
+    """
+    rnd = random.Random(seed)
+    authors = authors or max(1, books // 10)
+    start = time.perf_counter()
+    migrate()
+
+    author_ids: List[int] = []
+    for chunk in _chunks(authors, batch):
+        created = add_authors([
+            Author(first_name=rnd.choice(FIRST_NAMES), last_name=f'{rnd.choice(LAST_NAMES)}-{index}',
+                   middle_name='')
+            for index in chunk
+        ])
+        author_ids.extend(author.id for author in created)
+
+    cum_weights = _author_weights(len(author_ids), skew)
+    for chunk in _chunks(books, batch):
+        picked = rnd.choices(author_ids, cum_weights=cum_weights, k=len(chunk))
+        add_books([
+            Book(title=' '.join(rnd.choices(TITLE_WORDS, k=3)).capitalize() + f' {index}', author=author_id)
+            for index, author_id in zip(chunk, picked)
+        ])
+
+    return {'books': books, 'authors': len(author_ids), 'seed_s': round(time.perf_counter() - start, 3)}
+
+
+def reset_db() -> None:
+    pool.close_all()
+    for path in (DB_PATH, f'{DB_PATH}-wal', f'{DB_PATH}-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--authors', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    reset_db()
+    print(seed_catalog(args.books, args.authors, seed=args.seed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional
+
+MISS = object()
+
+# теги, которыми помечаются закэшированные ответы
+BOOK_LISTS_TAG = 'books'
+AUTHOR_LISTS_TAG = 'authors'
+
+
+def book_tag(book_id: int) -> str:
+    return f'book:{book_id}'
+
+
+def author_tag(author_id: int) -> str:
+    return f'author:{author_id}'
+
+
+def _size(value: Any) -> int:
+    # готовое тело ответа (bytes, content-encoding) - по длине байт, остальное - по длине JSON
+    if isinstance(value, tuple) and value and isinstance(value[0], bytes):
+        return len(value[0])
+    return len(json.dumps(value, ensure_ascii=False, default=str).encode())
+
+
+class NullCache:
+    """
+    Кэш, который ничего не хранит. Подключается через configure_cache(NullCache()).
+    """
+
+    def get(self, key: Hashable) -> Any:
+        return MISS
+
+    def generation(self) -> int:
+        return 0
+
+    def set(self, key: Hashable, value: Any, tags: Iterable[str] = (), since: Optional[int] = None) -> None:
+        pass
+
+    def invalidate(self, *tags: str) -> None:
+        pass
+
+    def clear(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, int]:
+        return {}
+
+
+class ResponseCache(NullCache):
+    """
+    Кэш сериализованных ответов в памяти процесса: LRU с TTL и ограничением
+    суммарного размера. Записи помечаются тегами (book:1, author:3, books...),
+    запись сбрасывает все ответы с нужным тегом.
+
+    Чтобы не закэшировать данные, прочитанные до конкурентной записи,
+    set принимает поколение, полученное до чтения из базы: если любой из
+    тегов был сброшен позже, значение не сохраняется.
+    """
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 32 * 1024 * 1024, ttl: float = 60.0,
+                 max_tracked_tags: int = 100000):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_tracked_tags = max_tracked_tags
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._tags: Dict[str, set] = {}
+        self._tag_generation: Dict[str, int] = {}
+        self._generation = 0
+        self._floor = 0
+        self._bytes = 0
+        self._counters = dict.fromkeys(('hits', 'misses', 'evictions', 'expirations', 'invalidations', 'stale_sets'), 0)
+
+    def _remove(self, key: Hashable) -> None:
+        value, size, expires, tags = self._entries.pop(key)
+        self._bytes -= size
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters['misses'] += 1
+                return MISS
+            if entry[2] < time.monotonic():
+                self._remove(key)
+                self._counters['expirations'] += 1
+                self._counters['misses'] += 1
+                return MISS
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return entry[0]
+
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def _is_stale(self, tags: tuple, since: int) -> bool:
+        if since < self._floor:
+            return True
+        return any(self._tag_generation.get(tag, 0) > since for tag in tags)
+
+    def set(self, key: Hashable, value: Any, tags: Iterable[str] = (), since: Optional[int] = None) -> None:
+        tags = tuple(tags)
+        size = _size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if since is not None and self._is_stale(tags, since):
+                self._counters['stale_sets'] += 1
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic() + self.ttl, tags)
+            self._bytes += size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._counters['evictions'] += 1
+
+    def invalidate(self, *tags: str) -> None:
+        with self._lock:
+            self._generation += 1
+            if len(self._tag_generation) + len(tags) > self.max_tracked_tags:
+                # забываем историю сбросов, но запрещаем сохранять всё прочитанное до этого момента
+                self._tag_generation.clear()
+                self._floor = self._generation
+            for tag in tags:
+                self._tag_generation[tag] = self._generation
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    self._counters['invalidations'] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+            self._generation += 1
+            self._floor = self._generation
+            self._tag_generation.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters, entries=len(self._entries), bytes=self._bytes,
+                        max_entries=self.max_entries, max_bytes=self.max_bytes)
+
+
+_cache: NullCache = ResponseCache()
+
+
+def get_cache() -> NullCache:
+    return _cache
+
+
+def configure_cache(backend: NullCache) -> None:
+    global _cache
+    _cache = backend
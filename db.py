@@ -0,0 +1,560 @@
+import itertools
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Type
+
+from metrics import InstrumentedConnection
+
+DB_PATH = os.environ.get('BOOKS_DB_PATH', 'table_books.db')
+# файлы реплик только для чтения через запятую; пусто - всё читается из основной базы
+REPLICA_PATHS = [path for path in os.environ.get('BOOKS_REPLICAS', '').split(',') if path]
+# период обновления реплик копией основной базы (sqlite3 backup), 0 - реплики обновляет кто-то другой
+REPLICA_REFRESH = float(os.environ.get('BOOKS_REPLICA_REFRESH', '0'))
+# групповая фиксация записей одним потоком-писателем (см. GroupCommitWriter)
+GROUP_COMMIT = os.environ.get('BOOKS_GROUP_COMMIT') == '1'
+# сколько миллисекунд писатель добирает записи в пакет; 0 - берёт только уже ждущие в очереди
+GROUP_COMMIT_WINDOW = float(os.environ.get('BOOKS_GROUP_COMMIT_WINDOW', '0')) / 1000
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get('BOOKS_GROUP_COMMIT_MAX_BATCH', '256'))
+# сколько секунд запрос ждёт, пока писатель возьмёт его запись в пакет
+GROUP_COMMIT_TIMEOUT = float(os.environ.get('BOOKS_GROUP_COMMIT_TIMEOUT', '30'))
+
+# общий счётчик записей из таблицы версий (см. migrations._versions_schema_sql):
+# по нему видно, насколько реплика отстаёт от основной базы
+WRITE_VERSION_SQL = "SELECT version FROM row_versions WHERE tbl = '*' AND row_id = 0"
+
+# применяются один раз при открытии соединения
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA busy_timeout = 5000',
+    # каскадное удаление книг вместе с автором; действует только вне транзакции,
+    # поэтому включается на каждом соединении, а не один раз при создании схемы
+    'PRAGMA foreign_keys = ON',
+)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Пул переиспользуемых соединений sqlite.
+
+    Поток, уже держащий соединение, получает его же при вложенном вызове,
+    поэтому несколько функций models.py внутри одного запроса работают
+    в одной транзакции. Фиксация происходит при выходе из внешнего блока.
+    """
+
+    def __init__(self, path: str = DB_PATH, max_size: int = 8, timeout: float = 5.0,
+                 factory: Type[sqlite3.Connection] = sqlite3.Connection, read_only: bool = False):
+        self.path = path
+        self.factory = factory
+        self.read_only = read_only
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._acquired = 0
+        self._waits = 0
+        self._wait_time = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, factory=self.factory)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        if self.read_only:
+            conn.execute('PRAGMA query_only = ON')
+        return conn
+
+    def _checkout(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.max_size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeout(f'Нет свободного соединения за {self.timeout} c')
+        finally:
+            with self._lock:
+                self._waits += 1
+                self._wait_time += time.perf_counter() - start
+        return conn
+
+    def holds_connection(self) -> bool:
+        return getattr(self._local, 'conn', None) is not None
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn: Optional[sqlite3.Connection] = getattr(self._local, 'conn', None)
+        if conn is not None:
+            # вложенный вызов: транзакцией управляет внешний блок
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn = self._checkout()
+        with self._lock:
+            self._acquired += 1
+        self._local.conn = conn
+        self._local.depth = 0
+        self._local.after_commit = []
+        try:
+            with conn:
+                yield conn
+            callbacks = self._local.after_commit
+        finally:
+            self._local.conn = None
+            self._local.after_commit = []
+            self._idle.put(conn)
+        for callback in callbacks:
+            callback()
+
+    @contextmanager
+    def savepoint(self) -> Iterator[sqlite3.Connection]:
+        """
+        Вложенная транзакция внутри уже открытого соединения потока:
+        при исключении откатывается только то, что сделано в блоке.
+        """
+        with self.connection() as conn:
+            name = f'sp{self._local.depth}'
+            callbacks = len(self._local.after_commit)
+            if not conn.in_transaction:
+                # иначе RELEASE внешней точки сохранения сразу фиксирует транзакцию
+                conn.execute('BEGIN')
+            conn.execute(f'SAVEPOINT {name}')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute(f'ROLLBACK TO {name}')
+                conn.execute(f'RELEASE {name}')
+                del self._local.after_commit[callbacks:]
+                raise
+            conn.execute(f'RELEASE {name}')
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Транзакция записи с первого оператора (BEGIN IMMEDIATE): чтения внутри
+        блока (проверки версии, существования) и запись видят одно состояние базы,
+        другой писатель не зафиксирует ничего между ними. Внутри уже открытой
+        транзакции потока - её продолжение.
+        """
+        with self.connection() as conn:
+            if not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE')
+            yield conn
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        """
+        Вызвать callback после фиксации текущей транзакции потока
+        (или сразу, если поток не держит соединение). При откате не вызывается.
+        """
+        if getattr(self._local, 'conn', None) is None:
+            callback()
+        else:
+            self._local.after_commit.append(callback)
+
+    def close_all(self) -> None:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def reset_after_fork(self) -> None:
+        """
+        В дочернем процессе: пул начинается с нуля. Унаследованные соединения
+        не закрываются (закрытие могло бы сделать checkpoint и удалить WAL,
+        которым пользуется родитель), а только остаются без использования.
+        """
+        inherited = getattr(self, '_inherited', [])
+        while True:
+            try:
+                inherited.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        self._inherited = inherited
+        self._idle = queue.LifoQueue()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._created = self._acquired = self._waits = 0
+        self._wait_time = 0.0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                'max_size': self.max_size,
+                'size': self._created,
+                'idle': self._idle.qsize(),
+                'in_use': self._created - self._idle.qsize(),
+                'acquired': self._acquired,
+                'waits': self._waits,
+                'wait_time_total': round(self._wait_time, 6),
+                'wait_time_avg': round(self._wait_time / self._waits, 6) if self._waits else 0.0,
+            }
+
+
+class Replica:
+    """
+    Файл-копия основной базы и пул соединений только для чтения к нему.
+    version - значение счётчика записей, до которого реплика догнала основную базу.
+    """
+    # как часто перечитывать версию реплики, которую обновляют извне
+    VERSION_TTL = 1.0
+
+    def __init__(self, path: str, factory: Type[sqlite3.Connection] = sqlite3.Connection):
+        self.path = path
+        self.pool = ConnectionPool(path, factory=factory, read_only=True)
+        self.version: Optional[int] = None
+        self._version_read = 0.0
+
+    def current_version(self) -> Optional[int]:
+        if time.monotonic() - self._version_read > self.VERSION_TTL:
+            try:
+                with self.pool.connection() as conn:
+                    row = conn.execute(WRITE_VERSION_SQL).fetchone()
+                self.version = row[0] if row else None
+            except sqlite3.Error:
+                # файла ещё нет или схема не создана: реплика не используется
+                self.version = None
+            self._version_read = time.monotonic()
+        return self.version
+
+    def refresh_from(self, source: sqlite3.Connection) -> None:
+        # backup пишет в реплику одной транзакцией: читатели в WAL видят старый снимок до её конца
+        target = sqlite3.connect(self.path)
+        try:
+            source.backup(target)
+            self.version = target.execute(WRITE_VERSION_SQL).fetchone()[0]
+            self._version_read = time.monotonic()
+        finally:
+            target.close()
+
+    def stats(self) -> Dict[str, object]:
+        return dict(self.pool.stats(), path=self.path, version=self.version)
+
+
+class GroupCommitWriter:
+    """
+    Один поток-писатель для записей из многих запросов.
+
+    Пока пишется текущий пакет, новые записи копятся в очереди; следующий пакет
+    выполняется одной транзакцией (один COMMIT и один fsync WAL на всех), каждая
+    запись - в своей точке сохранения. Ошибка одной записи откатывает только её
+    и возвращается вызывающему через Future; остальные записи пакета фиксируются.
+    """
+
+    def __init__(self, pool: ConnectionPool, window: float = GROUP_COMMIT_WINDOW,
+                 max_batch: int = GROUP_COMMIT_MAX_BATCH):
+        self.pool = pool
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._writes = 0
+        self._max_seen = 0
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+                self._thread.start()
+
+    def stop(self) -> None:
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def submit(self, fn: Callable[[], Any]) -> Future:
+        future: Future = Future()
+        self.start()
+        self._queue.put((fn, future))
+        return future
+
+    def run(self, fn: Callable[[], Any], timeout: float = GROUP_COMMIT_TIMEOUT) -> Any:
+        future = self.submit(fn)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            # ещё в очереди - отменяется, и писатель её пропустит
+            if future.cancel():
+                raise PoolTimeout(f'Запись не попала в пакет за {timeout} c') from None
+            # уже выполняется: исход известен только после фиксации пакета
+            return future.result()
+
+    def _collect(self, first) -> Tuple[list, bool]:
+        batch, stop = [first], False
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                timeout = deadline - time.monotonic()
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+        return batch, stop
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch, stop = self._collect(item)
+            self._commit(batch)
+
+    def _commit(self, batch: list) -> None:
+        done = []
+        try:
+            with self.pool.connection() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                for fn, future in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with self.pool.savepoint():
+                            done.append((future, fn()))
+                    except Exception as exc:
+                        future.set_exception(exc)
+        except Exception as exc:
+            # не удалось начать или зафиксировать пакет: ни одна из записей не сохранена,
+            # и ждущие запросы получают ошибку, а не висят на PENDING
+            for _, future in batch:
+                try:
+                    future.set_exception(exc)
+                except InvalidStateError:
+                    # уже завершена своей ошибкой или отменена по таймауту в run()
+                    pass
+            return
+        finally:
+            with self._lock:
+                self._batches += 1
+                self._writes += len(batch)
+                self._max_seen = max(self._max_seen, len(batch))
+        for future, result in done:
+            future.set_result(result)
+
+    def reset_after_fork(self) -> None:
+        # поток-писатель не переживает fork: в дочернем процессе он запустится заново
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                'batches': self._batches,
+                'writes': self._writes,
+                'queued': self._queue.qsize(),
+                'batch_avg': round(self._writes / self._batches, 2) if self._batches else 0.0,
+                'batch_max': self._max_seen,
+            }
+
+
+# минимальная версия данных, которую должен увидеть текущий запрос (read-your-writes)
+_min_version: ContextVar[Optional[int]] = ContextVar('min_version', default=None)
+
+
+class DatabaseRouter:
+    """
+    Записи и всё внутри открытой транзакции - в основную базу; отдельные чтения -
+    по кругу в реплики, которые уже догнали требуемую версию (иначе в основную).
+    """
+
+    def __init__(self, primary: ConnectionPool, replicas: List[Replica]):
+        self.primary = primary
+        self.replicas = replicas
+        self._turn = itertools.count()
+        self._refresh_callbacks: List[Callable[[], None]] = []
+        self._refresh_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _choose(self) -> ConnectionPool:
+        min_version = _min_version.get()
+        start = next(self._turn)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            version = replica.current_version()
+            if version is not None and (min_version is None or version >= min_version):
+                return replica.pool
+        return self.primary
+
+    def read_pool(self) -> ConnectionPool:
+        # вложенное чтение идёт туда же, где уже открыто соединение потока
+        if not self.replicas or self.primary.holds_connection():
+            return self.primary
+        for replica in self.replicas:
+            if replica.pool.holds_connection():
+                return replica.pool
+        return self._choose()
+
+    def write_version(self) -> int:
+        with self.primary.connection() as conn:
+            return conn.execute(WRITE_VERSION_SQL).fetchone()[0]
+
+    def on_refresh(self, callback: Callable[[], None]) -> None:
+        self._refresh_callbacks.append(callback)
+
+    def refresh_replicas(self) -> None:
+        """
+        Копирует основную базу во все реплики (работает и без сети: обычный файл).
+        """
+        source = sqlite3.connect(self.primary.path)
+        try:
+            for replica in self.replicas:
+                replica.refresh_from(source)
+        finally:
+            source.close()
+        for callback in self._refresh_callbacks:
+            callback()
+
+    def start_refresh(self, interval: float) -> None:
+        if not self.replicas or self._refresh_thread is not None:
+            return
+
+        def run() -> None:
+            while not self._stop.wait(interval):
+                self.refresh_replicas()
+
+        self.refresh_replicas()
+        self._refresh_thread = threading.Thread(target=run, name='replica-refresh', daemon=True)
+        self._refresh_thread.start()
+
+    def stop_refresh(self) -> None:
+        self._stop.set()
+        if self._refresh_thread is not None:
+            self._refresh_thread.join()
+            self._refresh_thread = None
+        self._stop.clear()
+
+    def reset_after_fork(self) -> None:
+        self._refresh_thread = None
+        self._stop = threading.Event()
+        for replica in self.replicas:
+            replica.pool.reset_after_fork()
+
+    def stats(self) -> List[Dict[str, object]]:
+        return [replica.stats() for replica in self.replicas]
+
+
+# соединения с замером времени запросов для /metrics
+pool = ConnectionPool(factory=InstrumentedConnection)
+router = DatabaseRouter(pool, [Replica(path, factory=InstrumentedConnection) for path in REPLICA_PATHS])
+writer: Optional[GroupCommitWriter] = GroupCommitWriter(pool) if GROUP_COMMIT else None
+
+
+def close_connections() -> None:
+    """
+    Закрыть свободные соединения всех пулов (родитель server.py - перед fork).
+    """
+    pool.close_all()
+    for replica in router.replicas:
+        replica.pool.close_all()
+
+
+def _reset_after_fork() -> None:
+    # соединение sqlite нельзя использовать из двух процессов
+    pool.reset_after_fork()
+    router.reset_after_fork()
+    if writer is not None:
+        writer.reset_after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_connection():
+    return pool.connection()
+
+
+def write_transaction():
+    """
+    Транзакция BEGIN IMMEDIATE на основной базе (см. ConnectionPool.transaction).
+    """
+    return pool.transaction()
+
+
+def group_commit_enabled() -> bool:
+    return writer is not None
+
+
+def run_write(fn: Callable[[], Any]) -> Any:
+    """
+    Выполнить fn в транзакции и вернуть её результат (исключение fn пробрасывается).
+    Транзакция начинается до fn (BEGIN IMMEDIATE), поэтому проверки внутри fn
+    и запись видят одно состояние базы.
+
+    С BOOKS_GROUP_COMMIT=1 fn выполняется в потоке-писателе вместе с записями
+    других запросов; внутри уже открытой транзакции потока - сразу в ней.
+    """
+    if writer is None or pool.holds_connection():
+        with pool.transaction():
+            return fn()
+    return writer.run(fn)
+
+
+def get_read_connection():
+    """
+    Соединение для чтения: реплика или основная база (см. DatabaseRouter).
+    """
+    return router.read_pool().connection()
+
+
+def required_version() -> Optional[int]:
+    return _min_version.get()
+
+
+@contextmanager
+def read_your_writes(version: Optional[int]) -> Iterator[None]:
+    """
+    Чтения внутри блока видят как минимум запись с этой версией
+    (версию клиент получил в X-Write-Version ответа на свою запись).
+    """
+    token = _min_version.set(version)
+    try:
+        yield
+    finally:
+        _min_version.reset(token)
+
+
+def after_commit(callback: Callable[[], None]) -> None:
+    pool.after_commit(callback)
@@ -0,0 +1,94 @@
+"""
+Кодирование тел ответов: JSON в UTF-8 (кириллица без \\uXXXX), необязательный
+MessagePack и сжатие gzip / brotli по Accept-Encoding.
+
+orjson, msgpack и brotli необязательны: без них используются стандартный json
+и gzip, а application/msgpack не предлагается.
+"""
+import json
+import os
+import zlib
+from typing import Any, Iterable, Iterator, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+# тела меньше этого размера не сжимаются: выигрыш меньше накладных расходов
+COMPRESS_MIN_SIZE = int(os.environ.get('BOOKS_COMPRESS_MIN_SIZE', '1024'))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# mimetype, которые имеет смысл сжимать (картинки и т.п. уже сжаты)
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'application/msgpack', 'text/')
+
+
+def encode_json(data: Any, fast: bool = False) -> bytes:
+    if fast and orjson is not None:
+        return orjson.dumps(data) + b'\n'
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def encode_msgpack(data: Any) -> bytes:
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def available_encodings() -> tuple:
+    # порядок - по предпочтению сервера: brotli сжимает JSON заметно плотнее gzip
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accept_encodings) -> Optional[str]:
+    """
+    accept_encodings - werkzeug Accept из request.accept_encodings.
+    Клиент выбирает допустимые (q > 0), сервер - лучшее из них.
+    """
+    for encoding in available_encodings():
+        if accept_encodings[encoding] > 0:
+            return encoding
+    return None
+
+
+def is_compressible(mimetype: Optional[str]) -> bool:
+    return bool(mimetype) and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        return compressor.compress(body) + compressor.flush()
+    raise ValueError(f'Неизвестное сжатие: {encoding}')
+
+
+def compress_stream(chunks: Iterable[str], encoding: str) -> Iterator[bytes]:
+    """
+    Потоковое сжатие: на выход идут только заполненные блоки компрессора,
+    остаток - в конце, так что весь ответ в памяти не собирается.
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        process, finish = compressor.process, compressor.finish
+    elif encoding == 'gzip':
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        process, finish = compressor.compress, compressor.flush
+    else:
+        raise ValueError(f'Неизвестное сжатие: {encoding}')
+    for chunk in chunks:
+        data = process(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield finish()
@@ -0,0 +1,257 @@
+"""
+Ключи идемпотентности для POST: клиент, повторяющий запрос после таймаута,
+передаёт тот же заголовок Idempotency-Key и получает сохранённый ответ
+первого выполнения, а запись не повторяется.
+
+- Ответ хранится BOOKS_IDEMPOTENCY_TTL секунд (по умолчанию сутки) в LRU
+  в памяти процесса на BOOKS_IDEMPOTENCY_MAX_KEYS ключей.
+- BOOKS_IDEMPOTENCY_STORE=sqlite - ещё и в таблице основной базы (миграция 7),
+  общей для воркеров server.py. Ответ пишется в той же транзакции, что и сама
+  запись: либо есть и книга, и ответ, либо ни того, ни другого.
+- Одновременные повторы не выполняются параллельно: в процессе они ждут
+  первый запрос, в другом воркере - до BOOKS_IDEMPOTENCY_WAIT секунд опрашивают
+  таблицу, потом получают 409 с Retry-After.
+- Тот же ключ с другим телом запроса - 422. Ответы 5xx и исключения не
+  сохраняются: повтор выполнится заново.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from db import after_commit, get_connection
+from models import claim_idempotency_key, delete_expired_idempotency_keys, get_idempotency_record, \
+    release_idempotency_key, save_idempotency_response
+
+IDEMPOTENCY_TTL = float(os.environ.get('BOOKS_IDEMPOTENCY_TTL', '86400'))
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get('BOOKS_IDEMPOTENCY_MAX_KEYS', '10000'))
+IDEMPOTENCY_STORE = os.environ.get('BOOKS_IDEMPOTENCY_STORE', 'memory')
+IDEMPOTENCY_WAIT = float(os.environ.get('BOOKS_IDEMPOTENCY_WAIT', '10'))
+# захват ключа старше этого считается брошенным (воркер упал посреди запроса)
+CLAIM_TIMEOUT = 60.0
+POLL_INTERVAL = 0.05
+# раз в столько захватов из таблицы удаляются истёкшие ключи
+PRUNE_EVERY = 1000
+MAX_KEY_LENGTH = 255
+
+if IDEMPOTENCY_STORE not in ('memory', 'sqlite'):
+    raise ValueError(f'BOOKS_IDEMPOTENCY_STORE: memory или sqlite, а не {IDEMPOTENCY_STORE}')
+
+
+@dataclass(slots=True)
+class StoredResponse:
+    fingerprint: str
+    status: int
+    headers: Dict[str, str]
+    # тело - JSON данных ресурса до кодирования в представление (json / msgpack)
+    body: str
+
+
+class IdempotencyError(Exception):
+
+    def __init__(self, status: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def request_fingerprint(method: str, path: str, body: bytes) -> str:
+    digest = hashlib.sha256(f'{method} {path}\n'.encode())
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class MemoryResponseStore:
+    """
+    LRU с TTL: запись живёт ttl секунд, сверх max_keys вытесняются самые старые.
+    """
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, max_keys: int = IDEMPOTENCY_MAX_KEYS):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._items: 'OrderedDict[str, Tuple[float, StoredResponse]]' = OrderedDict()
+
+    def get(self, key: str) -> Optional[StoredResponse]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def put(self, key: str, response: StoredResponse) -> None:
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, response)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_keys:
+                self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class Attempt:
+    """
+    Первое выполнение запроса с ключом: recording() оборачивает запись так,
+    чтобы ответ сохранился в её же транзакции.
+    """
+
+    def __init__(self, idempotency: 'Idempotency', key: str, fingerprint: str):
+        self.idempotency = idempotency
+        self.key = key
+        self.fingerprint = fingerprint
+        self.saved = False
+
+    def save(self, result: Any) -> None:
+        if self.saved or not isinstance(result, tuple):
+            return
+        data, status, *headers = result
+        if status >= 500:
+            return
+        headers = headers[0] if headers else None
+        response = StoredResponse(self.fingerprint, status, dict(headers or {}),
+                                  json.dumps(data, ensure_ascii=False))
+        if self.idempotency.shared:
+            save_idempotency_response(self.key, response.status, json.dumps(response.headers), response.body)
+
+        def stored():
+            self.idempotency.memory.put(self.key, response)
+            self.saved = True
+
+        # только после фиксации: ответ откаченной записи не должен отдаваться повторам
+        after_commit(stored)
+
+    def recording(self, fn: Callable[[], Any]) -> Callable[[], Any]:
+        def run():
+            with get_connection():
+                result = fn()
+                self.save(result)
+            return result
+        return run
+
+
+class Idempotency:
+
+    def __init__(self, memory: MemoryResponseStore, shared: bool, wait: float = IDEMPOTENCY_WAIT):
+        self.memory = memory
+        self.shared = shared
+        self.wait = wait
+        self._lock = threading.Lock()
+        # ключ -> событие завершения первого выполнения в этом процессе
+        self._in_flight: Dict[str, threading.Event] = {}
+        self._claims = 0
+        self.replayed = 0
+        self.coalesced = 0
+        self.conflicts = 0
+
+    def _lookup(self, key: str) -> Tuple[Optional[StoredResponse], bool]:
+        """
+        Сохранённый ответ и признак "ключ занят запросом в другом процессе".
+        """
+        response = self.memory.get(key)
+        if response is not None or not self.shared:
+            return response, False
+        row = get_idempotency_record(key)
+        if row is None or row[4] < time.time() - IDEMPOTENCY_TTL:
+            return None, False
+        fingerprint, status, headers, body, created = row
+        if status is None:
+            return None, created >= time.time() - CLAIM_TIMEOUT
+        response = StoredResponse(fingerprint, status, json.loads(headers), body)
+        self.memory.put(key, response)
+        return response, False
+
+    def _claim(self, key: str, fingerprint: str) -> bool:
+        now = time.time()
+        with self._lock:
+            self._claims += 1
+            prune = self._claims % PRUNE_EVERY == 0
+        if prune:
+            delete_expired_idempotency_keys(now - IDEMPOTENCY_TTL)
+        return claim_idempotency_key(key, fingerprint, now, now - CLAIM_TIMEOUT, now - IDEMPOTENCY_TTL)
+
+    def _replay(self, response: StoredResponse, fingerprint: str) -> StoredResponse:
+        if response.fingerprint != fingerprint:
+            with self._lock:
+                self.conflicts += 1
+            raise IdempotencyError(422, 'Idempotency-Key уже использован с другим запросом')
+        with self._lock:
+            self.replayed += 1
+        return response
+
+    @contextmanager
+    def begin(self, key: str, fingerprint: str) -> Iterator[Tuple[Optional[StoredResponse], Optional[Attempt]]]:
+        """
+        (сохранённый ответ, None) для повтора или (None, Attempt) для первого выполнения.
+        Бросает IdempotencyError: 422 - ключ с другим телом, 409 - ключ всё ещё
+        выполняется в другом процессе.
+        """
+        deadline = time.monotonic() + self.wait
+        while True:
+            with self._lock:
+                event = self._in_flight.get(key)
+                if event is None:
+                    event = self._in_flight[key] = threading.Event()
+                    owner = True
+                else:
+                    owner = False
+            if not owner:
+                # тот же ключ уже выполняется в этом процессе: ждём его ответ
+                with self._lock:
+                    self.coalesced += 1
+                event.wait(max(deadline - time.monotonic(), 0))
+                response, _ = self._lookup(key)
+                if response is not None:
+                    yield self._replay(response, fingerprint), None
+                    return
+                if time.monotonic() >= deadline:
+                    raise IdempotencyError(409, 'Запрос с этим Idempotency-Key ещё выполняется', 1)
+                # первый запрос завершился без сохранённого ответа - выполняем сами
+                continue
+            try:
+                response, busy = self._lookup(key)
+                while response is None and self.shared:
+                    if not busy and self._claim(key, fingerprint):
+                        break
+                    if time.monotonic() >= deadline:
+                        with self._lock:
+                            self.conflicts += 1
+                        raise IdempotencyError(409, 'Запрос с этим Idempotency-Key ещё выполняется', 1)
+                    # ключ занят другим воркером: ждём его ответ в таблице
+                    time.sleep(POLL_INTERVAL)
+                    response, busy = self._lookup(key)
+                if response is not None:
+                    yield self._replay(response, fingerprint), None
+                    return
+                attempt = Attempt(self, key, fingerprint)
+                try:
+                    yield None, attempt
+                finally:
+                    if self.shared and not attempt.saved:
+                        release_idempotency_key(key)
+                return
+            finally:
+                with self._lock:
+                    del self._in_flight[key]
+                event.set()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'keys': len(self.memory),
+            'in_flight': len(self._in_flight),
+            'replayed': self.replayed,
+            'coalesced': self.coalesced,
+            'conflicts': self.conflicts,
+        }
+
+
+idempotency = Idempotency(MemoryResponseStore(), IDEMPOTENCY_STORE == 'sqlite')
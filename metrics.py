@@ -0,0 +1,253 @@
+"""
+Метрики в текстовом формате Prometheus (/metrics) и профилирование одного запроса.
+
+Гистограммы длительности собираются:
+- по маршрутам Flask (весь запрос) и по методам ресурсов;
+- по каждому SQL-запросу models.py (текст нормализуется: литералы -> ?);
+- по load / dump схем marshmallow и сгенерированных сериализаторов.
+
+Без внешних зависимостей; BOOKS_METRICS=0 отключает сбор.
+"""
+import cProfile
+import io
+import os
+import pstats
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+ENABLED = os.environ.get('BOOKS_METRICS', '1') != '0'
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# сверх этого числа разных наборов меток значения пишутся в метку 'other'
+MAX_LABEL_SETS = 1000
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # метки -> [счётчики по корзинам..., сумма, количество]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                if len(self._series) >= MAX_LABEL_SETS:
+                    labels = ('other',) * len(self.label_names)
+                series = self._series.setdefault(labels, [0] * (len(self.buckets) + 2))
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def collect(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                bucket_labels = _format_labels(self.label_names, labels, 'le="%s"' % bound)
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            bucket_labels = _format_labels(self.label_names, labels, 'le="+Inf"')
+            lines.append(f'{self.name}_bucket{bucket_labels} {values[-1]}')
+            series_labels = _format_labels(self.label_names, labels)
+            lines.append(f'{self.name}_sum{series_labels} {_format_value(values[-2])}')
+            lines.append(f'{self.name}_count{series_labels} {values[-1]}')
+        return lines
+
+    def clear(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+
+class GaugeFunc:
+    """
+    Значения, которые считаются в момент выдачи (размер пула, счётчики кэша).
+    """
+
+    def __init__(self, name: str, help_text: str, read: Callable[[], Dict[str, float]], label_name: str):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+        self.label_name = label_name
+
+    def collect(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge']
+        for key, value in sorted(self.read().items()):
+            lines.append(f'{self.name}{_format_labels((self.label_name,), (key,))} {_format_value(value)}')
+        return lines
+
+
+_registry: List = []
+
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+
+REQUEST_SECONDS = register(Histogram(
+    'books_http_request_duration_seconds', 'HTTP request duration by route', ('route', 'method', 'status')))
+RESOURCE_SECONDS = register(Histogram(
+    'books_resource_duration_seconds', 'Resource method duration', ('resource', 'method')))
+QUERY_SECONDS = register(Histogram(
+    'books_db_query_duration_seconds', 'SQL execute duration by normalized query', ('query',)))
+FETCH_SECONDS = register(Histogram(
+    'books_db_fetch_duration_seconds', 'SQL fetch duration by normalized query', ('query',)))
+SCHEMA_SECONDS = register(Histogram(
+    'books_schema_duration_seconds', 'Schema load / dump duration', ('schema', 'operation')))
+
+
+@contextmanager
+def timer(histogram: Histogram, *labels: str) -> Iterator[None]:
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(labels, time.perf_counter() - start)
+
+
+def timed_method(method: Callable) -> Callable:
+    """
+    Декоратор для Resource.method_decorators: время метода ресурса.
+    """
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        owner = getattr(method, '__self__', None)
+        with timer(RESOURCE_SECONDS, type(owner).__name__, method.__name__):
+            return method(*args, **kwargs)
+    return wrapper
+
+
+# ---- SQL ----
+
+_SQL_SPACES = re.compile(r'\s+')
+_SQL_COMMENTS = re.compile(r'--[^\n]*')
+# строки и числа после операторов сравнения (подстановки "%s" в f-строках models.py);
+# пробел перед оператором отличает сравнение от '<b>' внутри строковой константы
+_SQL_LITERALS = re.compile(r"""(\s(?:=|<>|!=|<=|>=|<|>|like))\s*('(?:[^']|'')*'|"(?:[^"]|"")*"|-?\d+(?:\.\d+)?)""",
+                           re.IGNORECASE)
+_SQL_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_normalized: Dict[str, str] = {}
+
+
+def normalize_sql(sql: str) -> str:
+    normalized = _normalized.get(sql)
+    if normalized is None:
+        normalized = _SQL_SPACES.sub(' ', _SQL_COMMENTS.sub('', sql)).strip()
+        normalized = _SQL_LITERALS.sub(r'\1 ?', normalized)
+        normalized = _SQL_IN_LIST.sub('(?, ...)', normalized)
+        if len(_normalized) < MAX_LABEL_SETS:
+            _normalized[sql] = normalized
+    return normalized
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Курсор, замеряющий execute и fetch* каждого запроса.
+    """
+    _query: Optional[str] = None
+
+    def _timed(self, histogram: Histogram, call: Callable, *args):
+        if not ENABLED:
+            return call(*args)
+        start = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            histogram.observe((self._query or '',), time.perf_counter() - start)
+
+    def execute(self, sql, parameters=()):
+        self._query = normalize_sql(sql)
+        return self._timed(QUERY_SECONDS, super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._query = normalize_sql(sql)
+        return self._timed(QUERY_SECONDS, super().executemany, sql, seq_of_parameters)
+
+    def fetchone(self):
+        return self._timed(FETCH_SECONDS, super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed(FETCH_SECONDS, super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._timed(FETCH_SECONDS, super().fetchall)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    Соединение, у которого cursor() и execute() отдают InstrumentedCursor
+    (передаётся в sqlite3.connect(factory=...)).
+    """
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# ---- профилирование одного запроса ----
+
+PROFILE_TOP = 40
+
+
+class RequestProfile:
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+
+    def start(self) -> None:
+        self.profiler.enable()
+
+    def report(self) -> str:
+        self.profiler.disable()
+        out = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=out)
+        stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+        return out.getvalue()
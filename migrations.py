@@ -0,0 +1,391 @@
+"""
+Версионные миграции схемы базы.
+
+Номер применённой миграции хранится в PRAGMA user_version. При старте
+migrate() читает его одним запросом и, если схема уже последней версии,
+больше ничего не делает. Иначе недостающие миграции применяются по порядку
+в одной транзакции (BEGIN IMMEDIATE - параллельно запущенные процессы
+дождутся первого и увидят уже обновлённую схему).
+
+Миграции только добавляют: база, созданная старым init_db (user_version = 0),
+обновляется на месте без потери данных.
+
+Запуск вручную: python migrations.py
+"""
+import sqlite3
+from typing import Callable, Iterator, List, Tuple
+
+from db import get_connection
+from models import BOOKS_TABLE_NAME, AUTHORS_TABLE_NAME, VERSIONS_TABLE_NAME, BOOKS_SEARCH_TABLE_NAME, \
+    AUTHORS_SEARCH_TABLE_NAME, CHANGES_TABLE_NAME, AUTHOR_STATS_TABLE_NAME, \
+    IDEMPOTENCY_TABLE_NAME, CHANGES_PRUNED_TABLE_NAME
+
+DATA_BOOKS = [
+    {'title': 'Война и мир', 'author': 1},
+    {'title': 'Мастер и Маргарита', 'author': 2},
+    {'title': 'Собачье сердце', 'author': 2},
+    {'title': 'Герой нашего времени', 'author': 3},
+]
+
+DATA_AUTHORS = [
+    {'first_name': 'Лев', 'last_name': 'Толстой', 'middle_name': 'Николавевич'},
+    {'first_name': 'Михаил', 'last_name': 'Булгаков', 'middle_name': ''},
+    {'first_name': 'Михаил', 'last_name': 'Лермонтов', 'middle_name': 'Юрьевич'},
+]
+
+
+# текущее время в секундах unix для триггеров
+_SQL_NOW = "((julianday('now') - 2440587.5) * 86400.0)"
+
+
+def _versions_schema_sql() -> str:
+    """
+    Таблица версий: строка ('*', 0) - общий счётчик записей, (таблица, 0) - версия
+    таблицы, (таблица, id) - версия строки. Поддерживается триггерами.
+    """
+    script = f"""
+        CREATE TABLE '{VERSIONS_TABLE_NAME}'(
+            tbl TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            modified REAL NOT NULL,
+            PRIMARY KEY (tbl, row_id)
+        ) WITHOUT ROWID;
+        INSERT INTO '{VERSIONS_TABLE_NAME}' VALUES ('*', 0, 1, {_SQL_NOW});
+        """
+    for table in (BOOKS_TABLE_NAME, AUTHORS_TABLE_NAME):
+        script += f"""
+            INSERT INTO '{VERSIONS_TABLE_NAME}' VALUES ('{table}', 0, 1, {_SQL_NOW});
+            INSERT INTO '{VERSIONS_TABLE_NAME}' SELECT '{table}', id, 1, {_SQL_NOW} FROM '{table}';
+            """
+        bump = f"""
+            UPDATE '{VERSIONS_TABLE_NAME}' SET version = version + 1, modified = {_SQL_NOW}
+            WHERE tbl = '*' AND row_id = 0;
+            INSERT OR REPLACE INTO '{VERSIONS_TABLE_NAME}'
+            SELECT '{table}', 0, version, modified FROM '{VERSIONS_TABLE_NAME}' WHERE tbl = '*' AND row_id = 0;
+            """
+        set_row = f"""
+            INSERT OR REPLACE INTO '{VERSIONS_TABLE_NAME}'
+            SELECT '{table}', NEW.id, version, modified FROM '{VERSIONS_TABLE_NAME}' WHERE tbl = '*' AND row_id = 0;
+            """
+        script += f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_version_insert AFTER INSERT ON '{table}'
+            BEGIN {bump} {set_row} END;
+            CREATE TRIGGER IF NOT EXISTS {table}_version_update AFTER UPDATE ON '{table}'
+            BEGIN {bump} {set_row} END;
+            CREATE TRIGGER IF NOT EXISTS {table}_version_delete AFTER DELETE ON '{table}'
+            BEGIN {bump}
+                DELETE FROM '{VERSIONS_TABLE_NAME}' WHERE tbl = '{table}' AND row_id = OLD.id;
+            END;
+            """
+    return script
+
+
+def _author_name_sql(alias: str) -> str:
+    return (f"{alias}.first_name || ' ' || ifnull(nullif({alias}.middle_name, '') || ' ', '') "
+            f"|| {alias}.last_name")
+
+
+def _search_schema_sql() -> str:
+    """
+    FTS5-индексы: books_search (rowid = id книги; название и имя автора)
+    и authors_search (rowid = id автора). unicode61 приводит регистр и для
+    кириллицы, remove_diacritics склеивает ё и е; prefix-индексы ускоряют
+    поиск по началу слова. Заполняются из текущих строк, дальше - триггерами.
+    """
+    tokenize = "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'"
+    author_by_id = f"(SELECT {_author_name_sql('a')} FROM '{AUTHORS_TABLE_NAME}' a WHERE a.id = NEW.author)"
+    return f"""
+        CREATE VIRTUAL TABLE {BOOKS_SEARCH_TABLE_NAME} USING fts5(title, author, {tokenize});
+        CREATE VIRTUAL TABLE {AUTHORS_SEARCH_TABLE_NAME} USING fts5(name, {tokenize});
+        -- совпадение в названии весит больше, чем в имени автора
+        INSERT INTO {BOOKS_SEARCH_TABLE_NAME}({BOOKS_SEARCH_TABLE_NAME}, rank) VALUES ('rank', 'bm25(10.0, 1.0)');
+
+        INSERT INTO {BOOKS_SEARCH_TABLE_NAME}(rowid, title, author)
+        SELECT b.id, b.title, {_author_name_sql('a')}
+        FROM '{BOOKS_TABLE_NAME}' b JOIN '{AUTHORS_TABLE_NAME}' a ON b.author = a.id;
+        INSERT INTO {AUTHORS_SEARCH_TABLE_NAME}(rowid, name)
+        SELECT a.id, {_author_name_sql('a')} FROM '{AUTHORS_TABLE_NAME}' a;
+
+        CREATE TRIGGER IF NOT EXISTS {BOOKS_TABLE_NAME}_search_insert AFTER INSERT ON '{BOOKS_TABLE_NAME}'
+        BEGIN
+            INSERT INTO {BOOKS_SEARCH_TABLE_NAME}(rowid, title, author) VALUES (NEW.id, NEW.title, {author_by_id});
+        END;
+        CREATE TRIGGER IF NOT EXISTS {BOOKS_TABLE_NAME}_search_update AFTER UPDATE OF title, author
+        ON '{BOOKS_TABLE_NAME}'
+        BEGIN
+            UPDATE {BOOKS_SEARCH_TABLE_NAME} SET title = NEW.title, author = {author_by_id} WHERE rowid = OLD.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS {BOOKS_TABLE_NAME}_search_delete AFTER DELETE ON '{BOOKS_TABLE_NAME}'
+        BEGIN
+            DELETE FROM {BOOKS_SEARCH_TABLE_NAME} WHERE rowid = OLD.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS {AUTHORS_TABLE_NAME}_search_insert AFTER INSERT ON '{AUTHORS_TABLE_NAME}'
+        BEGIN
+            INSERT INTO {AUTHORS_SEARCH_TABLE_NAME}(rowid, name) VALUES (NEW.id, {_author_name_sql('NEW')});
+        END;
+        CREATE TRIGGER IF NOT EXISTS {AUTHORS_TABLE_NAME}_search_update
+        AFTER UPDATE OF first_name, last_name, middle_name ON '{AUTHORS_TABLE_NAME}'
+        BEGIN
+            UPDATE {AUTHORS_SEARCH_TABLE_NAME} SET name = {_author_name_sql('NEW')} WHERE rowid = OLD.id;
+            -- имя автора денормализовано в индекс книг
+            UPDATE {BOOKS_SEARCH_TABLE_NAME} SET author = {_author_name_sql('NEW')}
+            WHERE rowid IN (SELECT id FROM '{BOOKS_TABLE_NAME}' WHERE author = NEW.id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS {AUTHORS_TABLE_NAME}_search_delete AFTER DELETE ON '{AUTHORS_TABLE_NAME}'
+        BEGIN
+            DELETE FROM {AUTHORS_SEARCH_TABLE_NAME} WHERE rowid = OLD.id;
+        END;
+        """
+
+
+def _changes_schema_sql() -> str:
+    """
+    Журнал изменений для /api/changes: строка на каждую вставку, изменение
+    и удаление книги или автора (каскадные удаления книг тоже попадают сюда).
+    AUTOINCREMENT не даёт повторно выдать номер seq после очистки старых записей.
+    Уже существующие строки записываются как вставки, чтобы since=0 отдавал весь каталог.
+    """
+    script = f"""
+        CREATE TABLE '{CHANGES_TABLE_NAME}'(
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tbl TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            changed REAL NOT NULL
+        );
+        """
+    for table in (AUTHORS_TABLE_NAME, BOOKS_TABLE_NAME):
+        script += f"""
+            INSERT INTO '{CHANGES_TABLE_NAME}'(tbl, row_id, op, changed)
+            SELECT '{table}', id, 'insert', {_SQL_NOW} FROM '{table}' ORDER BY id;
+            """
+        for op, row in (('insert', 'NEW'), ('update', 'NEW'), ('delete', 'OLD')):
+            script += f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_changes_{op} AFTER {op.upper()} ON '{table}'
+                BEGIN
+                    INSERT INTO '{CHANGES_TABLE_NAME}'(tbl, row_id, op, changed)
+                    VALUES ('{table}', {row}.id, '{op}', {_SQL_NOW});
+                END;
+                """
+    return script
+
+
+def _author_stats_schema_sql() -> str:
+    """
+    Сводная таблица: число книг каждого автора. Триггеры меняют счётчик на 1
+    при вставке, удалении и смене автора книги (каскадное удаление книг вместе
+    с автором запускает те же триггеры), так что запись не пересчитывает всё заново.
+    Индекс (books_count, author_id) - для выдачи самых плодовитых авторов по страницам.
+    """
+    # автора могло не быть в таблице (внешние ключи выключены) - тогда строка создаётся
+    increment = f"""
+        INSERT INTO '{AUTHOR_STATS_TABLE_NAME}'(author_id, books_count) VALUES (NEW.author, 1)
+        ON CONFLICT(author_id) DO UPDATE SET books_count = books_count + 1;
+        """
+
+    return f"""
+        CREATE TABLE '{AUTHOR_STATS_TABLE_NAME}'(
+            author_id INTEGER PRIMARY KEY,
+            books_count INTEGER NOT NULL DEFAULT 0
+        );
+        INSERT INTO '{AUTHOR_STATS_TABLE_NAME}'(author_id, books_count)
+        SELECT a.id, (SELECT count(*) FROM '{BOOKS_TABLE_NAME}' b WHERE b.author = a.id) FROM '{AUTHORS_TABLE_NAME}' a;
+        CREATE INDEX IF NOT EXISTS idx_author_stats_books ON '{AUTHOR_STATS_TABLE_NAME}'(books_count, author_id);
+
+        CREATE TRIGGER IF NOT EXISTS {AUTHORS_TABLE_NAME}_stats_insert AFTER INSERT ON '{AUTHORS_TABLE_NAME}'
+        BEGIN
+            INSERT OR IGNORE INTO '{AUTHOR_STATS_TABLE_NAME}'(author_id, books_count) VALUES (NEW.id, 0);
+        END;
+        CREATE TRIGGER IF NOT EXISTS {AUTHORS_TABLE_NAME}_stats_delete AFTER DELETE ON '{AUTHORS_TABLE_NAME}'
+        BEGIN
+            DELETE FROM '{AUTHOR_STATS_TABLE_NAME}' WHERE author_id = OLD.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS {BOOKS_TABLE_NAME}_stats_insert AFTER INSERT ON '{BOOKS_TABLE_NAME}'
+        BEGIN
+            {increment}
+        END;
+        CREATE TRIGGER IF NOT EXISTS {BOOKS_TABLE_NAME}_stats_delete AFTER DELETE ON '{BOOKS_TABLE_NAME}'
+        BEGIN
+            UPDATE '{AUTHOR_STATS_TABLE_NAME}' SET books_count = books_count - 1 WHERE author_id = OLD.author;
+        END;
+        CREATE TRIGGER IF NOT EXISTS {BOOKS_TABLE_NAME}_stats_update AFTER UPDATE OF author ON '{BOOKS_TABLE_NAME}'
+        WHEN OLD.author IS NOT NEW.author
+        BEGIN
+            UPDATE '{AUTHOR_STATS_TABLE_NAME}' SET books_count = books_count - 1 WHERE author_id = OLD.author;
+            {increment}
+        END;
+        """
+
+
+class MigrationError(Exception):
+    pass
+
+
+def _table_exists(cursor: sqlite3.Cursor, name: str) -> bool:
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name = ?", (name,))
+    return cursor.fetchone() is not None
+
+
+def _statements(script: str) -> Iterator[str]:
+    """
+    Скрипт -> отдельные выражения. executescript не подходит: он фиксирует
+    открытую транзакцию, а миграции должны применяться атомарно.
+    Точки с запятой внутри тела триггера не разрывают выражение.
+    """
+    statement = ''
+    for part in script.split(';'):
+        statement += part + ';'
+        if sqlite3.complete_statement(statement):
+            if statement.strip(' \n;'):
+                yield statement
+            statement = ''
+
+
+def _execute_script(cursor: sqlite3.Cursor, script: str) -> None:
+    for statement in _statements(script):
+        cursor.execute(statement)
+
+
+def _create_tables(cursor: sqlite3.Cursor) -> None:
+    # таблицы и начальные данные; в старой базе они уже есть
+    if not _table_exists(cursor, AUTHORS_TABLE_NAME):
+        _execute_script(cursor, f"""
+            CREATE TABLE '{AUTHORS_TABLE_NAME}'(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                first_name TEXT NOT NULL,
+                last_name TEXT NOT NULL,
+                middle_name TEXT NOT NULL DEFAULT ''
+            );
+            """)
+        cursor.executemany(
+            f"INSERT INTO '{AUTHORS_TABLE_NAME}'"
+            "(first_name, last_name, middle_name) VALUES(?, ?, ?)",
+            [(item['first_name'], item['last_name'], item['middle_name']) for item in DATA_AUTHORS]
+        )
+    if not _table_exists(cursor, BOOKS_TABLE_NAME):
+        _execute_script(cursor, f"""
+            CREATE TABLE '{BOOKS_TABLE_NAME}'(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL,
+                author INTEGER NOT NULL,
+                FOREIGN KEY (author) REFERENCES {AUTHORS_TABLE_NAME}(id) ON DELETE CASCADE
+            );
+            """)
+        cursor.executemany(
+            f"INSERT INTO '{BOOKS_TABLE_NAME}' (title, author) VALUES(?, ?)",
+            [(item['title'], item['author']) for item in DATA_BOOKS]
+        )
+
+
+def _create_indexes(cursor: sqlite3.Cursor) -> None:
+    """
+    books.author - JOIN, фильтр по автору и ON DELETE CASCADE (без индекса
+    удаление автора просматривает все книги); books.title - сортировка и префикс;
+    authors(first_name, last_name, middle_name) - покрывающий индекс для поиска
+    автора по имени; одиночные индексы имён - для постраничной сортировки (имя, id).
+    """
+    _execute_script(cursor, f"""
+        CREATE INDEX IF NOT EXISTS idx_books_author ON '{BOOKS_TABLE_NAME}'(author);
+        CREATE INDEX IF NOT EXISTS idx_books_title ON '{BOOKS_TABLE_NAME}'(title);
+        CREATE INDEX IF NOT EXISTS idx_authors_name ON '{AUTHORS_TABLE_NAME}'(first_name, last_name, middle_name);
+        CREATE INDEX IF NOT EXISTS idx_authors_last_name ON '{AUTHORS_TABLE_NAME}'(last_name);
+        CREATE INDEX IF NOT EXISTS idx_authors_first_name ON '{AUTHORS_TABLE_NAME}'(first_name);
+        """)
+
+
+def _create_versions(cursor: sqlite3.Cursor) -> None:
+    if not _table_exists(cursor, VERSIONS_TABLE_NAME):
+        _execute_script(cursor, _versions_schema_sql())
+
+
+def _create_search(cursor: sqlite3.Cursor) -> None:
+    if not _table_exists(cursor, BOOKS_SEARCH_TABLE_NAME):
+        _execute_script(cursor, _search_schema_sql())
+
+
+def _create_changes(cursor: sqlite3.Cursor) -> None:
+    if not _table_exists(cursor, CHANGES_TABLE_NAME):
+        _execute_script(cursor, _changes_schema_sql())
+
+
+def _create_author_stats(cursor: sqlite3.Cursor) -> None:
+    if not _table_exists(cursor, AUTHOR_STATS_TABLE_NAME):
+        _execute_script(cursor, _author_stats_schema_sql())
+
+
+def _create_idempotency_keys(cursor: sqlite3.Cursor) -> None:
+    # ответы на POST с Idempotency-Key, общие для воркеров; status NULL - запрос ещё выполняется
+    _execute_script(cursor, f"""
+        CREATE TABLE IF NOT EXISTS '{IDEMPOTENCY_TABLE_NAME}'(
+            key TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            status INTEGER,
+            headers TEXT,
+            body TEXT,
+            created REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_idempotency_created ON '{IDEMPOTENCY_TABLE_NAME}'(created);
+        """)
+
+
+def _create_changes_retention(cursor: sqlite3.Cursor) -> None:
+    # поиск более новых изменений той же строки для models.prune_changes;
+    # changes_pruned - номер последнего очищенного удаления (одна строка)
+    _execute_script(cursor, f"""
+        CREATE INDEX IF NOT EXISTS idx_changes_row ON '{CHANGES_TABLE_NAME}'(tbl, row_id, seq);
+        CREATE TABLE IF NOT EXISTS '{CHANGES_PRUNED_TABLE_NAME}'(
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            seq INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO '{CHANGES_PRUNED_TABLE_NAME}' VALUES (0, 0);
+        """)
+
+
+# (версия, описание, функция); новые миграции - только в конец списка
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Cursor], None]]] = [
+    (1, 'books and authors tables', _create_tables),
+    (2, 'indexes for joins, filters and name lookups', _create_indexes),
+    (3, 'row versions for ETag / Last-Modified', _create_versions),
+    (4, 'full-text search', _create_search),
+    (5, 'change log for incremental sync', _create_changes),
+    (6, 'author book counts', _create_author_stats),
+    (7, 'idempotency keys', _create_idempotency_keys),
+    (8, 'change log retention', _create_changes_retention),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _user_version(cursor: sqlite3.Cursor) -> int:
+    cursor.execute('PRAGMA user_version')
+    return cursor.fetchone()[0]
+
+
+def migrate() -> int:
+    """
+    Приводит базу к последней версии схемы, возвращает номер версии.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        version = _user_version(cursor)
+        if version == LATEST_VERSION:
+            return version
+        if version > LATEST_VERSION:
+            raise MigrationError(f'Версия схемы базы ({version}) новее приложения ({LATEST_VERSION})')
+
+        cursor.execute('BEGIN IMMEDIATE')
+        # пока ждали блокировку, базу мог обновить другой процесс
+        version = _user_version(cursor)
+        for number, description, apply in MIGRATIONS:
+            if number > version:
+                apply(cursor)
+        cursor.execute(f'PRAGMA user_version = {LATEST_VERSION}')
+    with get_connection() as conn:
+        # статистика для планировщика по новым индексам
+        conn.execute('PRAGMA optimize')
+    return LATEST_VERSION
+
+
+if __name__ == '__main__':
+    print(f'schema version {migrate()}')
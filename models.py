@@ -1,35 +1,49 @@
-import sqlite3
+import html
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from cache import get_cache, book_tag, author_tag, BOOK_LISTS_TAG, AUTHOR_LISTS_TAG
+from db import get_connection, get_read_connection, after_commit, write_transaction
 from dataclasses import dataclass
-from typing import List, Optional, Union
-
-DATA_BOOKS = [
-    {'title': 'Война и мир', 'author': 1},
-    {'title': 'Мастер и Маргарита', 'author': 2},
-    {'title': 'Собачье сердце', 'author': 2},
-    {'title': 'Герой нашего времени', 'author': 3},
-]
-
-DATA_AUTHORS = [
-    {'first_name': 'Лев', 'last_name': 'Толстой', 'middle_name': 'Николавевич'},
-    {'first_name': 'Михаил', 'last_name': 'Булгаков', 'middle_name': ''},
-    {'first_name': 'Михаил', 'last_name': 'Лермонтов', 'middle_name': 'Юрьевич'},
-]
+from typing import AbstractSet, Any, Dict, Iterator, List, Optional, Set, Tuple, Union
 
 BOOKS_TABLE_NAME = 'books'
 AUTHORS_TABLE_NAME = 'authors'
+VERSIONS_TABLE_NAME = 'row_versions'
+BOOKS_SEARCH_TABLE_NAME = 'books_search'
+AUTHORS_SEARCH_TABLE_NAME = 'authors_search'
+CHANGES_TABLE_NAME = 'changes'
+AUTHOR_STATS_TABLE_NAME = 'author_stats'
+IDEMPOTENCY_TABLE_NAME = 'idempotency_keys'
+CHANGES_PRUNED_TABLE_NAME = 'changes_pruned'
+
+# книга без автора (вложенные списки книг автора)
+BOOK_TITLE_FIELDS = frozenset(('id', 'title'))
 
+# допустимые поля сортировки списков -> колонка в SQL
+BOOK_SORT_FIELDS = {'id': 'b.id', 'title': 'b.title', 'author': 'b.author'}
+AUTHOR_SORT_FIELDS = {'id': 'id', 'first_name': 'first_name', 'last_name': 'last_name'}
+AUTHOR_STATS_SORT_FIELDS = {'id': 's.author_id', 'books_count': 's.books_count'}
 
-@dataclass
+
+# slots: без __dict__ у каждого экземпляра (в списках на миллион строк это основная память);
+# не frozen - id и books заполняются после создания
+@dataclass(slots=True)
 class Author:
     first_name: str
     last_name: str
     middle_name: Optional[str] = None
     id: Optional[int] = None
+    # книги автора, если их запросили (?include=books, /api/authors/<id>/books)
+    books: Optional[List['Book']] = None
 
     def __getitem__(self, item):
         return getattr(self, item)
 
-@dataclass
+@dataclass(slots=True)
 class Book:
     title: str
     author: Union[int, Author] = None
@@ -38,66 +52,72 @@ class Book:
     def __getitem__(self, item):
         return getattr(self, item)
 
-def init_db():
-    with sqlite3.connect('table_books.db') as conn:
-        cursor = conn.cursor()
+@dataclass(slots=True)
+class AuthorStats:
+    id: int
+    first_name: str
+    last_name: str
+    middle_name: Optional[str]
+    books_count: int
 
-        # таблица авторов
-        cursor.execute(
-            "SELECT name FROM sqlite_master "
-            f"WHERE type='table' AND name='{AUTHORS_TABLE_NAME}';"
-        )
-        exist = cursor.fetchone()
-        if not exist:
-            cursor.executescript(
-                f"""
-                CREATE TABLE '{AUTHORS_TABLE_NAME}'(
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    first_name TEXT NOT NULL,
-                    last_name TEXT NOT NULL,
-                    middle_name TEXT NOT NULL DEFAULT ''
-                );
-                """
-            )
-            cursor.executemany(
-                f"INSERT INTO '{AUTHORS_TABLE_NAME}'"
-                "(first_name, last_name, middle_name) VALUES(?, ?, ?)",
-                [(item['first_name'], item['last_name'], item['middle_name']) for item in DATA_AUTHORS]
-            )
-
-        # таблица книг
-        cursor.execute(
-            "SELECT name FROM sqlite_master "
-            f"WHERE type='table' AND name='{BOOKS_TABLE_NAME}';"
-        )
-        exist = cursor.fetchone()
-        if not exist:
-            cursor.executescript('PRAGMA foreign_keys = ON;')
-            cursor.executescript(
-                f"""
-                CREATE TABLE '{BOOKS_TABLE_NAME}'(
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    title TEXT NOT NULL,
-                    author INTEGER NOT NULL,
-                    FOREIGN KEY (author) REFERENCES {AUTHORS_TABLE_NAME}(id) ON DELETE CASCADE
-                );
-                """)
-            cursor.executemany(
-                f"INSERT INTO '{BOOKS_TABLE_NAME}' (title, author) "
-                f"VALUES(?, ?)",
-                # f"VALUES(?, (SELECT id FROM {AUTHORS_TABLE_NAME} WHERE id = ?))",
-                [(item['title'], item['author']) for item in DATA_BOOKS])
-
-def _get_book_obj_from_row(row) -> Book:
-    return Book(id=row[0], title=row[1], author=Author(id=row[2], first_name=row[3], last_name=row[4],
-                middle_name=row[5]))
+    def __getitem__(self, item):
+        return getattr(self, item)
+
+@dataclass(slots=True)
+class Change:
+    seq: int
+    table: str
+    id: int
+    op: str
+    # текущее состояние строки; None - строка уже удалена
+    item: Optional[Union[Book, Author]] = None
+
+# будит ожидающих в wait_for_changes после записей этого процесса;
+# счётчик не даёт пропустить сигнал между проверкой базы и ожиданием
+_changes_condition = threading.Condition()
+_changes_signals = 0
+
+def _notify_changes() -> None:
+    global _changes_signals
+    with _changes_condition:
+        _changes_signals += 1
+        _changes_condition.notify_all()
+
+# сколько секунд журнал изменений хранит удаления и перезаписанные изменения строк
+CHANGES_RETENTION = float(os.environ.get('BOOKS_CHANGES_RETENTION', str(7 * 86400)))
+# раз в столько записей процесса журнал чистится (prune_changes)
+CHANGES_PRUNE_EVERY = 1000
+_changes_writes = itertools.count(1)
+
+def _invalidate(*tags: str) -> None:
+    # сброс кэша ответов и сигнал ожидающим /api/changes после фиксации транзакции
+    after_commit(lambda: get_cache().invalidate(*tags))
+    after_commit(_notify_changes)
+    if next(_changes_writes) % CHANGES_PRUNE_EVERY == 0:
+        after_commit(lambda: prune_changes(time.time() - CHANGES_RETENTION))
+
+# колонки строки книги с автором: SELECT b.id, b.title, a.id, a.first_name, a.last_name, a.middle_name
+BOOK_ROW_COLUMNS = ('id', 'title', 'author.id', 'author.first_name', 'author.last_name', 'author.middle_name')
+
+def _get_book_obj_from_row(row, authors: Optional[Dict[int, Author]] = None) -> Book:
+    """
+    authors - общий для одного результата словарь: книги одного автора
+    получают один и тот же объект Author вместо копии на каждую строку.
+    """
+    if authors is None:
+        author = Author(id=row[2], first_name=row[3], last_name=row[4], middle_name=row[5])
+    else:
+        author = authors.get(row[2])
+        if author is None:
+            author = authors[row[2]] = Author(id=row[2], first_name=row[3], last_name=row[4], middle_name=row[5])
+    return Book(id=row[0], title=row[1], author=author)
     # return Book(id=row[0], title=row[1], author=Author(first_name=row[2], last_name=row[3], middle_name=row[3]))
 
 def _get_author_obj_from_row(row) -> Author:
     return Author(id=row[0], first_name=row[1], last_name=row[2], middle_name=row[3])
 
 def get_all_books() -> List[Book]:
-    with sqlite3.connect('table_books.db') as conn:
+    with get_read_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(f"""
                         SELECT b.id, b.title, a.id, a.first_name, a.last_name, a.middle_name
@@ -105,31 +125,360 @@ def get_all_books() -> List[Book]:
                         JOIN '{AUTHORS_TABLE_NAME}' a
                         ON b.author = a.id 
                         """)
-        all_items = cursor.fetchall()
-        return [_get_book_obj_from_row(row) for row in all_items]
+        authors: Dict[int, Author] = {}
+        return [_get_book_obj_from_row(row, authors) for row in cursor]
+
+def _keyset_condition(column: str, id_column: str, after: Optional[Tuple[Any, int]], desc: bool,
+                      params: list) -> Optional[str]:
+    """
+    Условие "строки после курсора" для сортировки по (column, id).
+    Сравнение кортежей использует индекс, поэтому глубина страницы не важна.
+    """
+    if after is None:
+        return None
+    op = '<' if desc else '>'
+    value, last_id = after
+    if column == id_column:
+        params.append(last_id)
+        return f'{id_column} {op} ?'
+    params.extend((value, last_id))
+    return f'({column}, {id_column}) {op} (?, ?)'
+
+def _prefix_upper_bound(prefix: str) -> str:
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def _book_projection(fields: Optional[AbstractSet[str]], expand: bool, sort: str = 'id') -> Tuple[str, str]:
+    """
+    Колонки и JOIN под запрошенные поля книги. Строка всегда одной ширины
+    (id, title, author, first_name, last_name, middle_name): ненужные колонки
+    заменяются на NULL, JOIN с авторами - только для развёрнутого автора.
+    Колонка сортировки нужна курсору, поэтому выбирается всегда.
+    """
+    def wanted(field: str) -> bool:
+        return fields is None or field in fields or field == sort
+
+    title = 'b.title' if wanted('title') else 'NULL'
+    if fields is not None and 'author' not in fields:
+        author = 'b.author, NULL, NULL, NULL' if sort == 'author' else 'NULL, NULL, NULL, NULL'
+        return f'b.id, {title}, {author}', ''
+    if not expand:
+        return f'b.id, {title}, b.author, NULL, NULL, NULL', ''
+    return (f'b.id, {title}, a.id, a.first_name, a.last_name, a.middle_name',
+            f"JOIN '{AUTHORS_TABLE_NAME}' a ON b.author = a.id")
+
+def _get_book_from_projection(row, expand: bool, authors: Optional[Dict[int, Author]] = None) -> Book:
+    if expand and row[3] is not None:
+        return _get_book_obj_from_row(row, authors)
+    # автор - только ссылка по id (или не запрошен)
+    return Book(id=row[0], title=row[1], author=row[2])
+
+def books_page_query(limit: int, after: Optional[Tuple[Any, int]] = None, author_id: Optional[int] = None,
+                     title_prefix: Optional[str] = None, sort: str = 'id', desc: bool = False,
+                     fields: Optional[AbstractSet[str]] = None, expand: bool = True) -> Tuple[str, list]:
+    """
+    SQL и параметры страницы книг (общие для sync и async слоя данных).
+    fields / expand сужают выборку: без автора или с автором-ссылкой JOIN не делается.
+    """
+    column = BOOK_SORT_FIELDS[sort]
+    columns, join = _book_projection(fields, expand, sort)
+    where, params = [], []
+    if author_id is not None:
+        where.append('b.author = ?')
+        params.append(author_id)
+    if title_prefix:
+        where.append('b.title >= ? AND b.title < ?')
+        params.extend((title_prefix, _prefix_upper_bound(title_prefix)))
+    keyset = _keyset_condition(column, 'b.id', after, desc, params)
+    if keyset:
+        where.append(keyset)
+    direction = 'DESC' if desc else 'ASC'
+    order = f'b.id {direction}' if column == 'b.id' else f'{column} {direction}, b.id {direction}'
+    params.append(limit)
+    return f"""
+            SELECT {columns}
+            FROM '{BOOKS_TABLE_NAME}' b
+            {join}
+            {'WHERE ' + ' AND '.join(where) if where else ''}
+            ORDER BY {order}
+            LIMIT ?
+            """, params
+
+def get_books_page(limit: int, after: Optional[Tuple[Any, int]] = None, author_id: Optional[int] = None,
+                   title_prefix: Optional[str] = None, sort: str = 'id', desc: bool = False,
+                   fields: Optional[AbstractSet[str]] = None, expand: bool = True) -> List[Book]:
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(*books_page_query(limit, after, author_id, title_prefix, sort, desc, fields, expand))
+        authors: Dict[int, Author] = {}
+        return [_get_book_from_projection(row, expand, authors) for row in cursor.fetchall()]
+
+def iter_book_rows(batch_size: int = 500) -> Iterator[tuple]:
+    """
+    Ленивый обход всех книг без объектов моделей: кортежи в порядке BOOK_ROW_COLUMNS
+    (для serializers.get_row_dumper). Строки читаются из курсора порциями по batch_size,
+    так что в памяти никогда не лежит весь каталог.
+    """
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+                        SELECT b.id, b.title, a.id, a.first_name, a.last_name, a.middle_name
+                        FROM '{BOOKS_TABLE_NAME}' b
+                        JOIN '{AUTHORS_TABLE_NAME}' a
+                        ON b.author = a.id
+                        ORDER BY b.id
+                        """)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+
+def iter_books(batch_size: int = 500) -> Iterator[Book]:
+    # авторы не кэшируются между строками: словарь на весь каталог рос бы вместе с ним
+    for row in iter_book_rows(batch_size):
+        yield _get_book_obj_from_row(row)
+
+def get_changes(since: int, limit: int) -> List[Change]:
+    """
+    Изменения с номером больше since по порядку, вместе с текущим состоянием
+    книги (с автором) или автора. Журнал читается из основной базы: с отстающей
+    реплики ожидание изменений просыпалось бы к пустому ответу.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+                        SELECT c.seq, c.tbl, c.row_id, c.op,
+                               b.id, b.title, a.id, a.first_name, a.last_name, a.middle_name
+                        FROM '{CHANGES_TABLE_NAME}' c
+                        LEFT JOIN '{BOOKS_TABLE_NAME}' b ON c.tbl = '{BOOKS_TABLE_NAME}' AND b.id = c.row_id
+                        LEFT JOIN '{AUTHORS_TABLE_NAME}' a
+                        ON a.id = CASE WHEN c.tbl = '{BOOKS_TABLE_NAME}' THEN b.author ELSE c.row_id END
+                        WHERE c.seq > ?
+                        ORDER BY c.seq
+                        LIMIT ?
+                        """, (since, limit))
+        changes = []
+        authors: Dict[int, Author] = {}
+        for row in cursor.fetchall():
+            item = None
+            if row[1] == BOOKS_TABLE_NAME and row[4] is not None:
+                item = _get_book_obj_from_row(row[4:], authors)
+            elif row[1] == AUTHORS_TABLE_NAME and row[6] is not None:
+                item = _get_author_obj_from_row(row[6:])
+            changes.append(Change(seq=row[0], table=row[1], id=row[2], op=row[3], item=item))
+        return changes
+
+def prune_changes(before: float) -> int:
+    """
+    Ограничивает журнал изменений: из записей старше before удаляются изменения,
+    после которых у той же строки есть более новые (клиент всё равно получит
+    последнее с текущим состоянием), и удаления. Журнал не растёт больше каталога
+    плюс удалений за BOOKS_CHANGES_RETENTION. Номер последнего выброшенного удаления
+    запоминается: клиент с since меньше него пропустил бы удаление (см. get_changes_horizon).
+    """
+    with write_transaction() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+                        UPDATE '{CHANGES_PRUNED_TABLE_NAME}'
+                        SET seq = max(seq, coalesce((SELECT max(seq) FROM '{CHANGES_TABLE_NAME}'
+                                                     WHERE op = 'delete' AND changed < ?), 0))
+                        """, (before,))
+        cursor.execute(f"""
+                        DELETE FROM '{CHANGES_TABLE_NAME}'
+                        WHERE changed < ?
+                        AND (op = 'delete' OR EXISTS (
+                            SELECT 1 FROM '{CHANGES_TABLE_NAME}' later
+                            WHERE later.tbl = {CHANGES_TABLE_NAME}.tbl
+                            AND later.row_id = {CHANGES_TABLE_NAME}.row_id
+                            AND later.seq > {CHANGES_TABLE_NAME}.seq
+                        ))
+                        """, (before,))
+        return cursor.rowcount
+
+def get_changes_horizon() -> int:
+    """
+    since меньше этого номера (кроме 0 - полной синхронизации) уже не восстановить
+    по журналу: часть удалений после него очищена.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT seq FROM '{CHANGES_PRUNED_TABLE_NAME}'")
+        return cursor.fetchone()[0]
+
+def get_last_change_seq() -> int:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT max(seq) FROM '{CHANGES_TABLE_NAME}'")
+        return cursor.fetchone()[0] or 0
+
+def wait_for_changes(since: int, timeout: float, poll: float = 1.0) -> bool:
+    """
+    Ждёт изменений с номером больше since не дольше timeout секунд.
+    Записи этого процесса будят сразу, других процессов - не позже чем через poll.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        signals = _changes_signals
+        if get_last_change_seq() > since:
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        with _changes_condition:
+            if _changes_signals == signals:
+                _changes_condition.wait(min(poll, remaining))
+
+def get_book_version(book_id: int) -> Optional[Tuple[str, float]]:
+    """
+    Версия книги вместе с версией встроенного автора, без чтения данных книги.
+    """
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+                        SELECT vb.version, vb.modified, va.version, va.modified
+                        FROM '{BOOKS_TABLE_NAME}' b
+                        JOIN '{VERSIONS_TABLE_NAME}' vb ON vb.tbl = '{BOOKS_TABLE_NAME}' AND vb.row_id = b.id
+                        JOIN '{VERSIONS_TABLE_NAME}' va ON va.tbl = '{AUTHORS_TABLE_NAME}' AND va.row_id = b.author
+                        WHERE b.id = ?
+                        """, (book_id,))
+        row = cursor.fetchone()
+        if row:
+            return f'b{row[0]}.{row[2]}', max(row[1], row[3])
+
+def get_author_version(author_id: int) -> Optional[Tuple[str, float]]:
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+                        SELECT version, modified FROM '{VERSIONS_TABLE_NAME}'
+                        WHERE tbl = '{AUTHORS_TABLE_NAME}' AND row_id = ?
+                        """, (author_id,))
+        row = cursor.fetchone()
+        if row:
+            return f'a{row[0]}', row[1]
+
+def get_tables_version(*tables: str) -> Tuple[str, float]:
+    """
+    Версия набора таблиц (для списков): меняется при любой записи в них.
+    """
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+                        SELECT tbl, version, modified FROM '{VERSIONS_TABLE_NAME}'
+                        WHERE tbl IN (SELECT value FROM json_each(?)) AND row_id = 0
+                        """, (json.dumps(tables),))
+        versions = {row[0]: row[1:] for row in cursor.fetchall()}
+        tag = '.'.join(str(versions.get(table, (0,))[0]) for table in tables)
+        modified = max((version[1] for version in versions.values()), default=0.0)
+        return f't{tag}', modified
 
 def get_all_authors() -> List[Author]:
-    with sqlite3.connect('table_books.db') as conn:
+    with get_read_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(f'SELECT * from "{AUTHORS_TABLE_NAME}"')
         all_items = cursor.fetchall()
         return [_get_author_obj_from_row(row) for row in all_items]
 
+def authors_page_query(limit: int, after: Optional[Tuple[Any, int]] = None, sort: str = 'id',
+                       desc: bool = False) -> Tuple[str, list]:
+    column = AUTHOR_SORT_FIELDS[sort]
+    params = []
+    keyset = _keyset_condition(column, 'id', after, desc, params)
+    direction = 'DESC' if desc else 'ASC'
+    order = f'id {direction}' if column == 'id' else f'{column} {direction}, id {direction}'
+    params.append(limit)
+    return f"""
+            SELECT id, first_name, last_name, middle_name
+            FROM '{AUTHORS_TABLE_NAME}'
+            {'WHERE ' + keyset if keyset else ''}
+            ORDER BY {order}
+            LIMIT ?
+            """, params
+
+def get_authors_page(limit: int, after: Optional[Tuple[Any, int]] = None, sort: str = 'id',
+                     desc: bool = False) -> List[Author]:
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(*authors_page_query(limit, after, sort, desc))
+        return [_get_author_obj_from_row(row) for row in cursor.fetchall()]
+
+def get_author_stats_page(limit: int, after: Optional[Tuple[Any, int]] = None, sort: str = 'books_count',
+                          desc: bool = True) -> List[AuthorStats]:
+    """
+    Число книг авторов из сводной таблицы (её ведут триггеры, см. migrations._author_stats_schema_sql):
+    страница читается по индексу (books_count, author_id), без подсчёта по книгам.
+    """
+    column = AUTHOR_STATS_SORT_FIELDS[sort]
+    params = []
+    keyset = _keyset_condition(column, 's.author_id', after, desc, params)
+    direction = 'DESC' if desc else 'ASC'
+    order = f's.author_id {direction}' if sort == 'id' else f'{column} {direction}, s.author_id {direction}'
+    params.append(limit)
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+                        SELECT s.author_id, a.first_name, a.last_name, a.middle_name, s.books_count
+                        FROM '{AUTHOR_STATS_TABLE_NAME}' s
+                        JOIN '{AUTHORS_TABLE_NAME}' a ON a.id = s.author_id
+                        {'WHERE ' + keyset if keyset else ''}
+                        ORDER BY {order}
+                        LIMIT ?
+                        """, params)
+        return [AuthorStats(*row) for row in cursor.fetchall()]
+
+def get_author_books_page(author_id: int, limit: int, after: Optional[Tuple[Any, int]] = None,
+                          desc: bool = False) -> List[Book]:
+    # книги одного автора по id: индекс (author, id), без JOIN
+    return get_books_page(limit, after, author_id=author_id, desc=desc, fields=BOOK_TITLE_FIELDS, expand=False)
+
+def get_books_by_authors(author_ids, limit: int) -> Dict[int, List[Book]]:
+    """
+    Первые limit книг (по id) каждого из авторов - одним запросом на всю страницу
+    авторов вместо запроса на автора: для каждого id из json_each подзапрос
+    с LIMIT идёт по индексу (author, id), книги собираются json_group_array.
+    """
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+                        SELECT j.value, (
+                            SELECT json_group_array(json_array(id, title)) FROM (
+                                SELECT id, title FROM '{BOOKS_TABLE_NAME}'
+                                WHERE author = j.value
+                                ORDER BY id
+                                LIMIT ?
+                            )
+                        )
+                        FROM json_each(?) j
+                        """, (limit, _json_ids(author_ids)))
+        return {
+            author_id: [Book(id=book_id, title=title, author=author_id) for book_id, title in json.loads(books)]
+            for author_id, books in cursor.fetchall()
+        }
+
+# строка книги вместе с автором прямо из INSERT/UPDATE, без повторного чтения
+_BOOK_RETURNING = f"""
+    RETURNING id, title, author,
+        (SELECT first_name FROM '{AUTHORS_TABLE_NAME}' WHERE id = author),
+        (SELECT last_name FROM '{AUTHORS_TABLE_NAME}' WHERE id = author),
+        (SELECT middle_name FROM '{AUTHORS_TABLE_NAME}' WHERE id = author)
+    """
+
 def add_book(book: Book) -> Book:
-    with sqlite3.connect('table_books.db') as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
             f"""
             INSERT INTO '{BOOKS_TABLE_NAME}'
             (title, author) VALUES (?, ?)
+            {_BOOK_RETURNING}
             """,
             (book.title, book.author)
         )
-        book.id = cursor.lastrowid
-        return book
+        created = _get_book_obj_from_row(cursor.fetchone())
+        _invalidate(BOOK_LISTS_TAG)
+        return created
 
 def add_author(author: Author) -> Author:
-    with sqlite3.connect('table_books.db') as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
             f"""
@@ -139,24 +488,25 @@ def add_author(author: Author) -> Author:
             (author.first_name, author.last_name, author.middle_name)
         )
         author.id = cursor.lastrowid
+        _invalidate(AUTHOR_LISTS_TAG)
         return author
 
-def get_book_by_id(book_id: int) -> Optional[Book]:
-    with sqlite3.connect('table_books.db') as conn:
+def get_book_by_id(book_id: int, fields: Optional[AbstractSet[str]] = None, expand: bool = True) -> Optional[Book]:
+    columns, join = _book_projection(fields, expand)
+    with get_read_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(f"""
-                        SELECT b.id, b.title, a.id, a.first_name, a.last_name, a.middle_name
+                        SELECT {columns}
                         FROM '{BOOKS_TABLE_NAME}' b
-                        JOIN '{AUTHORS_TABLE_NAME}' a
-                        ON b.author = a.id 
+                        {join}
                         WHERE b.id = '%s'
                         """ % book_id)
         book_item = cursor.fetchone()
         if book_item:
-            return _get_book_obj_from_row(book_item)
+            return _get_book_from_projection(book_item, expand)
 
-def update_book_by_id(book: Book):
-    with sqlite3.connect('table_books.db') as conn:
+def update_book_by_id(book: Book) -> Optional[Book]:
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
             f"""
@@ -164,12 +514,16 @@ def update_book_by_id(book: Book):
             SET title = ?,
                 author = ?
             WHERE id = ?
+            {_BOOK_RETURNING}
             """, (book.title, book.author, book.id)
         )
-        conn.commit()
+        row = cursor.fetchone()
+        _invalidate(book_tag(book.id), BOOK_LISTS_TAG)
+        if row:
+            return _get_book_obj_from_row(row)
 
 def delete_book_by_id(book_id):
-    with sqlite3.connect('table_books.db') as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
             f"""
@@ -177,10 +531,10 @@ def delete_book_by_id(book_id):
             WHERE id = ?
             """, (book_id,)
         )
-        conn.commit()
+        _invalidate(book_tag(book_id), BOOK_LISTS_TAG)
 
 def get_book_by_title(book_title: str) -> Optional[Book]:
-    with sqlite3.connect('table_books.db') as conn:
+    with get_read_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(f'SELECT * from "{BOOKS_TABLE_NAME}" WHERE title = "%s"' % book_title)
         book = cursor.fetchone()
@@ -188,7 +542,7 @@ def get_book_by_title(book_title: str) -> Optional[Book]:
         # if book:
         #     return _get_book_obj_from_row(book)
 
-    # with sqlite3.connect('table_books.db') as conn:
+    # with get_connection() as conn:
     #     cursor = conn.cursor()
     #     cursor.execute(f"""
     #                     SELECT b.id, b.title, a.id, a.first_name, a.last_name, a.middle_name
@@ -202,7 +556,7 @@ def get_book_by_title(book_title: str) -> Optional[Book]:
     #         return _get_book_obj_from_row(book)
 
 def get_author_by_name(author: dict) -> Optional[Author]:
-    with sqlite3.connect('table_books.db') as conn:
+    with get_read_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(f'SELECT * from "{AUTHORS_TABLE_NAME}" '
                        f'WHERE first_name = ? AND last_name = ?',
@@ -212,7 +566,7 @@ def get_author_by_name(author: dict) -> Optional[Author]:
             return _get_author_obj_from_row(author)
 
 def get_author_by_id(auth_id: int) -> Optional[Author]:
-    with sqlite3.connect('table_books.db') as conn:
+    with get_read_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(f'SELECT * from "{AUTHORS_TABLE_NAME}" WHERE id = "%s"' % auth_id)
         author = cursor.fetchone()
@@ -220,7 +574,7 @@ def get_author_by_id(auth_id: int) -> Optional[Author]:
             return _get_author_obj_from_row(author)
 
 def delete_author_by_id(author_id):
-    with sqlite3.connect('table_books.db') as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
             f"""
@@ -228,10 +582,11 @@ def delete_author_by_id(author_id):
             WHERE id = ?
             """, (author_id,)
         )
-        conn.commit()
+        # вместе с автором каскадно удаляются его книги
+        _invalidate(author_tag(author_id), AUTHOR_LISTS_TAG, BOOK_LISTS_TAG)
 
 def update_author_by_id(author: Author):
-    with sqlite3.connect('table_books.db') as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
             f"""
@@ -242,4 +597,247 @@ def update_author_by_id(author: Author):
             WHERE id = ?
             """, (author.first_name, author.last_name, author.middle_name, author.id)
         )
-        conn.commit()
+        # книги встраивают автора, поэтому сбрасываются и они
+        _invalidate(author_tag(author.id), AUTHOR_LISTS_TAG)
+
+# ---- полнотекстовый поиск ----
+
+SEARCH_SNIPPET_TOKENS = 12
+# snippet() размечает найденные слова управляющими символами, а не тегами: названия
+# и имена - пользовательский текст, он экранируется до замены меток на <b></b>
+_SNIPPET_OPEN, _SNIPPET_CLOSE = '\x02', '\x03'
+# буквы и цифры, как у токенизатора unicode61 ('_' - разделитель)
+_SEARCH_WORD = re.compile(r'[^\W_]+')
+# слова короче ищутся целиком: префикс из одной буквы совпадает с большей частью каталога
+SEARCH_MIN_PREFIX = 2
+
+def search_match_query(query: str) -> Optional[str]:
+    """
+    Строка запроса пользователя -> выражение MATCH: каждое слово (от двух букв) ищется
+    по началу (префиксом), все слова обязательны. Синтаксис FTS5 из запроса
+    не пропускается, поэтому кавычки и операторы в нём безопасны.
+    """
+    words = _SEARCH_WORD.findall(query)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' if len(word) >= SEARCH_MIN_PREFIX else f'"{word}"' for word in words)
+
+def _highlight(snippet: str) -> str:
+    escaped = html.escape(snippet, quote=False)
+    return escaped.replace(_SNIPPET_OPEN, '<b>').replace(_SNIPPET_CLOSE, '</b>')
+
+def search_books(query: str, limit: int) -> List[Tuple[Book, str]]:
+    """
+    Книги по названию и имени автора, по убыванию релевантности (bm25),
+    вместе с фрагментом текста, где найдены слова.
+    """
+    match = search_match_query(query)
+    if match is None:
+        return []
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""
+            SELECT b.id, b.title, a.id, a.first_name, a.last_name, a.middle_name, s.snippet
+            FROM (
+                -- сначала top-N по рангу внутри FTS, потом JOIN только для них
+                SELECT rowid, rank,
+                       snippet({BOOKS_SEARCH_TABLE_NAME}, -1, char(2), char(3), '…', {SEARCH_SNIPPET_TOKENS}) AS snippet
+                FROM {BOOKS_SEARCH_TABLE_NAME}
+                WHERE {BOOKS_SEARCH_TABLE_NAME} MATCH ?
+                ORDER BY rank
+                LIMIT ?
+            ) s
+            JOIN '{BOOKS_TABLE_NAME}' b ON b.id = s.rowid
+            JOIN '{AUTHORS_TABLE_NAME}' a ON a.id = b.author
+            ORDER BY s.rank
+            """, (match, limit)
+        )
+        return [(_get_book_obj_from_row(row), _highlight(row[6])) for row in cursor.fetchall()]
+
+def search_authors(query: str, limit: int) -> List[Tuple[Author, str]]:
+    match = search_match_query(query)
+    if match is None:
+        return []
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""
+            SELECT a.id, a.first_name, a.last_name, a.middle_name, s.snippet
+            FROM (
+                SELECT rowid, rank,
+                       snippet({AUTHORS_SEARCH_TABLE_NAME}, 0, char(2), char(3), '…', {SEARCH_SNIPPET_TOKENS}) AS snippet
+                FROM {AUTHORS_SEARCH_TABLE_NAME}
+                WHERE {AUTHORS_SEARCH_TABLE_NAME} MATCH ?
+                ORDER BY rank
+                LIMIT ?
+            ) s
+            JOIN '{AUTHORS_TABLE_NAME}' a ON a.id = s.rowid
+            ORDER BY s.rank
+            """, (match, limit)
+        )
+        return [(_get_author_obj_from_row(row), _highlight(row[4])) for row in cursor.fetchall()]
+
+# ---- пакетные операции: одна транзакция, executemany и set-based проверки ----
+
+def _json_ids(ids) -> str:
+    return json.dumps(list(ids))
+
+def get_existing_author_ids(author_ids) -> Set[int]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+                        SELECT id FROM '{AUTHORS_TABLE_NAME}'
+                        WHERE id IN (SELECT value FROM json_each(?))
+                        """, (_json_ids(author_ids),))
+        return {row[0] for row in cursor.fetchall()}
+
+def get_existing_book_ids(book_ids) -> Set[int]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+                        SELECT id FROM '{BOOKS_TABLE_NAME}'
+                        WHERE id IN (SELECT value FROM json_each(?))
+                        """, (_json_ids(book_ids),))
+        return {row[0] for row in cursor.fetchall()}
+
+def get_existing_author_names(names) -> Set[Tuple[str, str]]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+                        SELECT first_name, last_name FROM '{AUTHORS_TABLE_NAME}'
+                        WHERE (first_name, last_name) IN (
+                            SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]')
+                            FROM json_each(?)
+                        )
+                        """, (json.dumps([list(name) for name in names]),))
+        return {(row[0], row[1]) for row in cursor.fetchall()}
+
+def _assign_inserted_ids(cursor, items) -> None:
+    # внутри одной транзакции AUTOINCREMENT выдаёт идущие подряд id
+    cursor.execute('SELECT last_insert_rowid()')
+    last_id = cursor.fetchone()[0]
+    for offset, item in enumerate(items):
+        item.id = last_id - len(items) + 1 + offset
+
+def add_books(books: List[Book]) -> List[Book]:
+    if not books:
+        return books
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            f"""
+            INSERT INTO '{BOOKS_TABLE_NAME}'
+            (title, author) VALUES (?, ?)
+            """,
+            [(book.title, book.author) for book in books]
+        )
+        _assign_inserted_ids(cursor, books)
+        _invalidate(BOOK_LISTS_TAG)
+        return books
+
+def add_authors(authors: List[Author]) -> List[Author]:
+    if not authors:
+        return authors
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            f"""
+            INSERT INTO '{AUTHORS_TABLE_NAME}'
+            (first_name, last_name, middle_name) VALUES (?, ?, ?)
+            """,
+            [(author.first_name, author.last_name, author.middle_name or '') for author in authors]
+        )
+        _assign_inserted_ids(cursor, authors)
+        _invalidate(AUTHOR_LISTS_TAG)
+        return authors
+
+def update_books(books: List[Book]) -> None:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            f"""
+            UPDATE {BOOKS_TABLE_NAME}
+            SET title = ?,
+                author = ?
+            WHERE id = ?
+            """, [(book.title, book.author, book.id) for book in books]
+        )
+        _invalidate(BOOK_LISTS_TAG, *(book_tag(book.id) for book in books))
+
+def update_authors(authors: List[Author]) -> None:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            f"""
+            UPDATE {AUTHORS_TABLE_NAME}
+            SET first_name = ?,
+                last_name = ?,
+                middle_name = ?
+            WHERE id = ?
+            """, [(author.first_name, author.last_name, author.middle_name or '', author.id) for author in authors]
+        )
+        _invalidate(AUTHOR_LISTS_TAG, *(author_tag(author.id) for author in authors))
+
+def delete_books(book_ids: List[int]) -> None:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(f'DELETE FROM {BOOKS_TABLE_NAME} WHERE id = ?', [(book_id,) for book_id in book_ids])
+        _invalidate(BOOK_LISTS_TAG, *(book_tag(book_id) for book_id in book_ids))
+
+def delete_authors(author_ids: List[int]) -> None:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(f'DELETE FROM {AUTHORS_TABLE_NAME} WHERE id = ?',
+                           [(author_id,) for author_id in author_ids])
+        _invalidate(AUTHOR_LISTS_TAG, BOOK_LISTS_TAG, *(author_tag(author_id) for author_id in author_ids))
+
+# ---- ключи идемпотентности (idempotency.py) ----
+# только основная база: реплика может ещё не знать о сохранённом ответе или о захвате ключа
+
+def get_idempotency_record(key: str) -> Optional[tuple]:
+    """
+    (fingerprint, status, headers, body, created); status None - запрос ещё выполняется.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+                        SELECT fingerprint, status, headers, body, created FROM '{IDEMPOTENCY_TABLE_NAME}'
+                        WHERE key = ?
+                        """, (key,))
+        return cursor.fetchone()
+
+def claim_idempotency_key(key: str, fingerprint: str, now: float, stale_before: float,
+                          expired_before: float) -> bool:
+    """
+    Занять ключ перед выполнением запроса. Не получится, если ключ уже занят
+    (и захват не старше stale_before) или по нему сохранён ещё не истёкший ответ.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+                        INSERT INTO '{IDEMPOTENCY_TABLE_NAME}'(key, fingerprint, created) VALUES (?, ?, ?)
+                        ON CONFLICT(key) DO UPDATE
+                        SET fingerprint = excluded.fingerprint, status = NULL, headers = NULL, body = NULL,
+                            created = excluded.created
+                        WHERE (status IS NULL AND created < ?) OR created < ?
+                        """, (key, fingerprint, now, stale_before, expired_before))
+        return cursor.rowcount == 1
+
+def save_idempotency_response(key: str, status: int, headers: str, body: str) -> None:
+    # вызывается в транзакции самой записи: ответ сохраняется вместе с ней или не сохраняется вовсе
+    with get_connection() as conn:
+        conn.execute(f"""
+                      UPDATE '{IDEMPOTENCY_TABLE_NAME}' SET status = ?, headers = ?, body = ?
+                      WHERE key = ?
+                      """, (status, headers, body, key))
+
+def release_idempotency_key(key: str) -> None:
+    with get_connection() as conn:
+        conn.execute(f"DELETE FROM '{IDEMPOTENCY_TABLE_NAME}' WHERE key = ? AND status IS NULL", (key,))
+
+def delete_expired_idempotency_keys(before: float) -> int:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"DELETE FROM '{IDEMPOTENCY_TABLE_NAME}' WHERE created < ?", (before,))
+        return cursor.rowcount
@@ -0,0 +1,328 @@
+"""
+Асинхронные аналоги функций models.py для ASGI-режима (asgi.py).
+
+Записи идут через одно соединение-писатель под asyncio.Lock (sqlite всё равно
+допускает одного писателя), чтения - через пул соединений только для чтения,
+которые в режиме WAL не блокируются писателем. Внутри database.write() чтения
+и вложенные записи идут через то же соединение, в той же транзакции.
+"""
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+import aiosqlite
+
+import migrations
+from db import DB_PATH, PRAGMAS
+from models import Author, Book, BOOKS_TABLE_NAME, AUTHORS_TABLE_NAME, VERSIONS_TABLE_NAME, \
+    _get_book_obj_from_row, _get_author_obj_from_row, books_page_query, authors_page_query, _BOOK_RETURNING
+
+
+# соединение-писатель, если текущая задача внутри database.write()
+_write_conn: ContextVar[Optional[aiosqlite.Connection]] = ContextVar('write_conn', default=None)
+
+
+class AsyncDatabase:
+
+    def __init__(self, path: str = DB_PATH, readers: int = 4):
+        self.path = path
+        self.readers = readers
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._readers: 'asyncio.Queue[aiosqlite.Connection]' = asyncio.Queue()
+        self._all_readers: List[aiosqlite.Connection] = []
+
+    async def _connect(self, read_only: bool) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path)
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        if read_only:
+            await conn.execute('PRAGMA query_only = ON')
+        return conn
+
+    async def open(self) -> None:
+        self._writer = await self._connect(read_only=False)
+        for _ in range(self.readers):
+            conn = await self._connect(read_only=True)
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+
+    async def close(self) -> None:
+        for conn in self._all_readers:
+            await conn.close()
+        self._all_readers.clear()
+        self._readers = asyncio.Queue()
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
+
+    @asynccontextmanager
+    async def read(self) -> AsyncIterator[aiosqlite.Connection]:
+        conn = _write_conn.get()
+        if conn is not None:
+            # проверка перед записью должна видеть то же состояние, что и сама запись
+            yield conn
+            return
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        Транзакция BEGIN IMMEDIATE: блокировка записи берётся сразу, поэтому
+        писатели других процессов не вклиниваются между проверкой и записью.
+        Вложенный вызов продолжает внешнюю транзакцию.
+        """
+        if _write_conn.get() is not None:
+            yield _write_conn.get()
+            return
+        async with self._write_lock:
+            await self._writer.execute('BEGIN IMMEDIATE')
+            token = _write_conn.set(self._writer)
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            else:
+                await self._writer.commit()
+            finally:
+                _write_conn.reset(token)
+
+
+database = AsyncDatabase()
+
+
+async def migrate() -> None:
+    await asyncio.to_thread(migrations.migrate)
+
+
+async def _fetchall(sql: str, params=()) -> List[tuple]:
+    async with database.read() as conn:
+        async with conn.execute(sql, params) as cursor:
+            return list(await cursor.fetchall())
+
+
+async def _fetchone(sql: str, params=()) -> Optional[tuple]:
+    async with database.read() as conn:
+        async with conn.execute(sql, params) as cursor:
+            return await cursor.fetchone()
+
+
+_BOOKS_SELECT = f"""
+    SELECT b.id, b.title, a.id, a.first_name, a.last_name, a.middle_name
+    FROM '{BOOKS_TABLE_NAME}' b
+    JOIN '{AUTHORS_TABLE_NAME}' a
+    ON b.author = a.id
+    """
+
+
+async def get_all_books() -> List[Book]:
+    authors: Dict[int, Author] = {}
+    return [_get_book_obj_from_row(row, authors) for row in await _fetchall(_BOOKS_SELECT)]
+
+
+async def get_books_page(limit: int, after: Optional[Tuple[Any, int]] = None, author_id: Optional[int] = None,
+                         title_prefix: Optional[str] = None, sort: str = 'id', desc: bool = False) -> List[Book]:
+    rows = await _fetchall(*books_page_query(limit, after, author_id, title_prefix, sort, desc))
+    authors: Dict[int, Author] = {}
+    return [_get_book_obj_from_row(row, authors) for row in rows]
+
+
+async def iter_books(batch_size: int = 500) -> AsyncIterator[Book]:
+    async with database.read() as conn:
+        async with conn.execute(_BOOKS_SELECT + 'ORDER BY b.id') as cursor:
+            while True:
+                rows = await cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield _get_book_obj_from_row(row)
+
+
+async def get_all_authors() -> List[Author]:
+    rows = await _fetchall(f'SELECT * from "{AUTHORS_TABLE_NAME}"')
+    return [_get_author_obj_from_row(row) for row in rows]
+
+
+async def get_authors_page(limit: int, after: Optional[Tuple[Any, int]] = None, sort: str = 'id',
+                           desc: bool = False) -> List[Author]:
+    rows = await _fetchall(*authors_page_query(limit, after, sort, desc))
+    return [_get_author_obj_from_row(row) for row in rows]
+
+
+async def get_book_by_id(book_id: int) -> Optional[Book]:
+    row = await _fetchone(_BOOKS_SELECT + 'WHERE b.id = ?', (book_id,))
+    if row:
+        return _get_book_obj_from_row(row)
+
+
+async def get_book_by_title(book_title: str) -> Optional[tuple]:
+    return await _fetchone(f'SELECT * from "{BOOKS_TABLE_NAME}" WHERE title = ?', (book_title,))
+
+
+async def get_author_by_name(author: dict) -> Optional[Author]:
+    row = await _fetchone(f'SELECT * from "{AUTHORS_TABLE_NAME}" WHERE first_name = ? AND last_name = ?',
+                          (author['first_name'], author['last_name']))
+    if row:
+        return _get_author_obj_from_row(row)
+
+
+async def get_author_by_id(auth_id: int) -> Optional[Author]:
+    row = await _fetchone(f'SELECT * from "{AUTHORS_TABLE_NAME}" WHERE id = ?', (auth_id,))
+    if row:
+        return _get_author_obj_from_row(row)
+
+
+async def get_book_version(book_id: int) -> Optional[Tuple[str, float]]:
+    row = await _fetchone(f"""
+                          SELECT vb.version, vb.modified, va.version, va.modified
+                          FROM '{BOOKS_TABLE_NAME}' b
+                          JOIN '{VERSIONS_TABLE_NAME}' vb ON vb.tbl = '{BOOKS_TABLE_NAME}' AND vb.row_id = b.id
+                          JOIN '{VERSIONS_TABLE_NAME}' va ON va.tbl = '{AUTHORS_TABLE_NAME}' AND va.row_id = b.author
+                          WHERE b.id = ?
+                          """, (book_id,))
+    if row:
+        return f'b{row[0]}.{row[2]}', max(row[1], row[3])
+
+
+async def get_author_version(author_id: int) -> Optional[Tuple[str, float]]:
+    row = await _fetchone(f"""
+                          SELECT version, modified FROM '{VERSIONS_TABLE_NAME}'
+                          WHERE tbl = '{AUTHORS_TABLE_NAME}' AND row_id = ?
+                          """, (author_id,))
+    if row:
+        return f'a{row[0]}', row[1]
+
+
+async def get_tables_version(*tables: str) -> Tuple[str, float]:
+    rows = await _fetchall(f"""
+                           SELECT tbl, version, modified FROM '{VERSIONS_TABLE_NAME}'
+                           WHERE tbl IN (SELECT value FROM json_each(?)) AND row_id = 0
+                           """, (json.dumps(tables),))
+    versions = {row[0]: row[1:] for row in rows}
+    tag = '.'.join(str(versions.get(table, (0,))[0]) for table in tables)
+    modified = max((version[1] for version in versions.values()), default=0.0)
+    return f't{tag}', modified
+
+
+async def get_existing_author_ids(author_ids) -> Set[int]:
+    rows = await _fetchall(f"""
+                           SELECT id FROM '{AUTHORS_TABLE_NAME}'
+                           WHERE id IN (SELECT value FROM json_each(?))
+                           """, (json.dumps(list(author_ids)),))
+    return {row[0] for row in rows}
+
+
+async def get_existing_book_ids(book_ids) -> Set[int]:
+    rows = await _fetchall(f"""
+                           SELECT id FROM '{BOOKS_TABLE_NAME}'
+                           WHERE id IN (SELECT value FROM json_each(?))
+                           """, (json.dumps(list(book_ids)),))
+    return {row[0] for row in rows}
+
+
+async def add_book(book: Book) -> Book:
+    async with database.write() as conn:
+        async with conn.execute(
+            f"INSERT INTO '{BOOKS_TABLE_NAME}' (title, author) VALUES (?, ?) {_BOOK_RETURNING}",
+            (book.title, book.author)
+        ) as cursor:
+            return _get_book_obj_from_row(await cursor.fetchone())
+
+
+async def add_author(author: Author) -> Author:
+    async with database.write() as conn:
+        cursor = await conn.execute(
+            f"INSERT INTO '{AUTHORS_TABLE_NAME}' (first_name, last_name, middle_name) VALUES (?, ?, ?)",
+            (author.first_name, author.last_name, author.middle_name or '')
+        )
+        author.id = cursor.lastrowid
+        return author
+
+
+async def update_book_by_id(book: Book) -> Optional[Book]:
+    async with database.write() as conn:
+        async with conn.execute(
+            f'UPDATE {BOOKS_TABLE_NAME} SET title = ?, author = ? WHERE id = ? {_BOOK_RETURNING}',
+            (book.title, book.author, book.id)
+        ) as cursor:
+            row = await cursor.fetchone()
+    if row:
+        return _get_book_obj_from_row(row)
+
+
+async def delete_book_by_id(book_id: int) -> None:
+    async with database.write() as conn:
+        await conn.execute(f'DELETE FROM {BOOKS_TABLE_NAME} WHERE id = ?', (book_id,))
+
+
+async def update_author_by_id(author: Author) -> None:
+    async with database.write() as conn:
+        await conn.execute(
+            f'UPDATE {AUTHORS_TABLE_NAME} SET first_name = ?, last_name = ?, middle_name = ? WHERE id = ?',
+            (author.first_name, author.last_name, author.middle_name or '', author.id)
+        )
+
+
+async def delete_author_by_id(author_id: int) -> None:
+    async with database.write() as conn:
+        await conn.execute(f'DELETE FROM {AUTHORS_TABLE_NAME} WHERE id = ?', (author_id,))
+
+
+async def add_books(books: List[Book]) -> List[Book]:
+    if not books:
+        return books
+    async with database.write() as conn:
+        await conn.executemany(f"INSERT INTO '{BOOKS_TABLE_NAME}' (title, author) VALUES (?, ?)",
+                               [(book.title, book.author) for book in books])
+        async with conn.execute('SELECT last_insert_rowid()') as cursor:
+            last_id = (await cursor.fetchone())[0]
+    for offset, book in enumerate(books):
+        book.id = last_id - len(books) + 1 + offset
+    return books
+
+
+async def add_authors(authors: List[Author]) -> List[Author]:
+    if not authors:
+        return authors
+    async with database.write() as conn:
+        await conn.executemany(
+            f"INSERT INTO '{AUTHORS_TABLE_NAME}' (first_name, last_name, middle_name) VALUES (?, ?, ?)",
+            [(author.first_name, author.last_name, author.middle_name or '') for author in authors]
+        )
+        async with conn.execute('SELECT last_insert_rowid()') as cursor:
+            last_id = (await cursor.fetchone())[0]
+    for offset, author in enumerate(authors):
+        author.id = last_id - len(authors) + 1 + offset
+    return authors
+
+
+async def update_books(books: List[Book]) -> None:
+    async with database.write() as conn:
+        await conn.executemany(f'UPDATE {BOOKS_TABLE_NAME} SET title = ?, author = ? WHERE id = ?',
+                               [(book.title, book.author, book.id) for book in books])
+
+
+async def update_authors(authors: List[Author]) -> None:
+    async with database.write() as conn:
+        await conn.executemany(
+            f'UPDATE {AUTHORS_TABLE_NAME} SET first_name = ?, last_name = ?, middle_name = ? WHERE id = ?',
+            [(author.first_name, author.last_name, author.middle_name or '', author.id) for author in authors]
+        )
+
+
+async def delete_books(book_ids: List[int]) -> None:
+    async with database.write() as conn:
+        await conn.executemany(f'DELETE FROM {BOOKS_TABLE_NAME} WHERE id = ?', [(book_id,) for book_id in book_ids])
+
+
+async def delete_authors(author_ids: List[int]) -> None:
+    async with database.write() as conn:
+        await conn.executemany(f'DELETE FROM {AUTHORS_TABLE_NAME} WHERE id = ?',
+                               [(author_id,) for author_id in author_ids])
@@ -0,0 +1,171 @@
+"""
+Спецификация Swagger (OpenAPI 2.0) для routes.py без затрат при импорте.
+
+flasgger и apispec не импортируются вместе с приложением:
+- /apispec_1.json отдаёт собранный заранее swagger.json, если записанный в нём
+  хэш исходников (x-source-hash) совпадает с текущими routes.py и schemas.py;
+- иначе спецификация строится flasgger-ом из docstring-ов при первом запросе
+  и дальше отдаётся из памяти;
+- страница /apidocs/ (Swagger UI) берёт шаблоны и статику из пакета flasgger,
+  сам пакет импортируется при первом её открытии.
+
+Сборка артефакта:  python openapi.py
+Проверка (CI):     python openapi.py --check  - код 1, если swagger.json устарел
+"""
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import threading
+from typing import List, Optional
+
+from flask import Blueprint, Flask, jsonify
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SPEC_PATH = os.path.join(BASE_DIR, 'swagger.json')
+# файлы, из которых строится спецификация (docstring-и ресурсов и схемы marshmallow)
+SPEC_SOURCES = ('routes.py', 'schemas.py')
+HASH_FIELD = 'x-source-hash'
+
+SPEC_ENDPOINT = 'apispec_1'
+SPEC_ROUTE = '/apispec_1.json'
+# имена blueprint и маршрутов - как у flasgger: на них ссылаются его шаблоны
+BLUEPRINT_NAME = 'flasgger'
+STATIC_URL_PATH = '/flasgger_static'
+DOCS_ROUTE = '/apidocs/'
+OAUTH_REDIRECT_ROUTE = '/oauth2-redirect.html'
+
+_lock = threading.Lock()
+_spec: Optional[dict] = None
+_swagger = None
+_docs_view = None
+
+
+def source_hash() -> str:
+    digest = hashlib.sha256()
+    for name in SPEC_SOURCES:
+        with open(os.path.join(BASE_DIR, name), 'rb') as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+
+def load_prebuilt(path: str = SPEC_PATH) -> Optional[dict]:
+    """
+    Спецификация из файла, если он собран из текущих исходников, иначе None.
+    """
+    try:
+        with open(path, encoding='utf-8') as spec_file:
+            spec = json.load(spec_file)
+    except (OSError, ValueError):
+        return None
+    if spec.get(HASH_FIELD) != source_hash():
+        return None
+    return spec
+
+
+def _get_swagger(app: Flask):
+    """
+    Объект flasgger.Swagger без init_app: свои маршруты он не регистрирует
+    (это делает register), нужен только для сборки спецификации и конфигурации UI.
+    """
+    global _swagger
+    if _swagger is None:
+        from apispec.ext.marshmallow import MarshmallowPlugin
+        from apispec_webframeworks.flask import FlaskPlugin
+        from flasgger import APISpec, Swagger
+        from schemas import AuthorSchema, BookListSchema, BookSchema
+
+        spec = APISpec(
+            title='BooksList',
+            version='1.0.0',
+            openapi_version='2.0',
+            plugins=[
+                FlaskPlugin(),
+                MarshmallowPlugin(),
+            ],
+        )
+        template = spec.to_flasgger(
+            app,
+            definitions=[AuthorSchema, BookListSchema, BookSchema],
+        )
+        swagger = Swagger(template=template)
+        swagger.app = app
+        swagger.load_config(app)
+        _swagger = swagger
+    return _swagger
+
+
+def build_spec(app: Flask) -> dict:
+    with app.test_request_context():
+        return _get_swagger(app).get_apispecs(SPEC_ENDPOINT)
+
+
+def get_spec(app: Flask) -> dict:
+    global _spec
+    if _spec is None:
+        with _lock:
+            if _spec is None:
+                _spec = load_prebuilt() or build_spec(app)
+    return _spec
+
+
+def register(app: Flask) -> None:
+    """
+    Маршруты спецификации и Swagger UI; пакет flasgger только находится, не импортируется.
+    """
+    flasgger_dir = os.path.dirname(importlib.util.find_spec('flasgger').origin)
+    blueprint = Blueprint(
+        BLUEPRINT_NAME,
+        __name__,
+        template_folder=os.path.join(flasgger_dir, 'ui3', 'templates'),
+        static_folder=os.path.join(flasgger_dir, 'ui3', 'static'),
+        static_url_path=STATIC_URL_PATH,
+    )
+
+    def apispec():
+        return jsonify(get_spec(app))
+
+    def apidocs():
+        global _docs_view
+        if _docs_view is None:
+            from flasgger.base import APIDocsView
+            _docs_view = APIDocsView.as_view('apidocs', view_args=dict(config=_get_swagger(app).config))
+        return _docs_view()
+
+    def oauth_redirect():
+        from flask import render_template
+        return render_template(['flasgger/oauth2-redirect.html', 'flasgger/o2c.html'])
+
+    blueprint.add_url_rule(SPEC_ROUTE, SPEC_ENDPOINT, apispec)
+    blueprint.add_url_rule(DOCS_ROUTE, 'apidocs', apidocs)
+    blueprint.add_url_rule(OAUTH_REDIRECT_ROUTE, 'oauth_redirect', oauth_redirect)
+    app.register_blueprint(blueprint)
+
+
+def write_prebuilt(app: Flask, path: str = SPEC_PATH) -> dict:
+    spec = dict(build_spec(app), **{HASH_FIELD: source_hash()})
+    with open(path, 'w', encoding='utf-8') as spec_file:
+        json.dump(spec, spec_file, ensure_ascii=False, indent=2, sort_keys=True)
+        spec_file.write('\n')
+    return spec
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Build the prebuilt swagger.json')
+    parser.add_argument('--check', action='store_true', help='exit 1 if swagger.json is out of date')
+    args = parser.parse_args(argv)
+    if args.check:
+        if load_prebuilt() is None:
+            print(f'{SPEC_PATH} is out of date, run: python openapi.py')
+            return 1
+        return 0
+    from routes import app
+    spec = write_prebuilt(app)
+    print(f"{SPEC_PATH}: {len(spec['paths'])} paths, {HASH_FIELD} {spec[HASH_FIELD][:12]}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
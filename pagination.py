@@ -0,0 +1,73 @@
+import base64
+import json
+from typing import Any, Callable, Dict, Mapping, Tuple
+from urllib.parse import urlencode
+
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+
+
+class PageArgsError(Exception):
+    pass
+
+
+def encode_cursor(value: Any, item_id: int) -> str:
+    raw = json.dumps([value, item_id], ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _is_sql_int(value: Any) -> bool:
+    # bool - тоже int, а числа вне 64 бит sqlite не принимает (OverflowError)
+    return isinstance(value, int) and not isinstance(value, bool) and -2 ** 63 <= value < 2 ** 63
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, item_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise PageArgsError(f'Неправильный курсор: {cursor}')
+    # в параметры sqlite попадает только то, что он умеет связать: иначе вместо 400 - 500
+    if not _is_sql_int(item_id) or not (value is None or isinstance(value, (str, float)) or _is_sql_int(value)):
+        raise PageArgsError(f'Неправильный курсор: {cursor}')
+    return value, item_id
+
+
+def parse_page_args(sort_fields: Dict[str, str], args: Mapping[str, str]) -> Dict[str, Any]:
+    """
+    Общие параметры постраничной выдачи: limit, after, sort (с '-' для убывания).
+    """
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_LIMIT))
+    except ValueError:
+        raise PageArgsError('limit должен быть целым числом')
+    if not 1 <= limit <= MAX_PAGE_LIMIT:
+        raise PageArgsError(f'limit должен быть от 1 до {MAX_PAGE_LIMIT}')
+    sort = args.get('sort', 'id')
+    desc = sort.startswith('-')
+    sort = sort.lstrip('-')
+    if sort not in sort_fields:
+        raise PageArgsError(f'Сортировка возможна по полям: {", ".join(sort_fields)}')
+    after = args.get('after')
+    return {
+        'limit': limit,
+        'after': decode_cursor(after) if after else None,
+        'sort': sort,
+        'desc': desc,
+    }
+
+
+def next_page_headers(items: list, limit: int, sort_value: Callable[[dict], Any], base_url: str,
+                      args: Dict[str, str]) -> Dict[str, str]:
+    """
+    Ссылка на следующую страницу строится по последнему элементу текущей.
+    """
+    if len(items) < limit:
+        return {}
+    last = items[-1]
+    cursor = encode_cursor(sort_value(last), last['id'])
+    args = dict(args, after=cursor)
+    return {
+        'X-Next-Cursor': cursor,
+        'Link': f'<{base_url}?{urlencode(args)}>; rel="next"',
+    }
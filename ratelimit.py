@@ -0,0 +1,293 @@
+"""
+Допуск запросов при перегрузке: лимит частоты на клиента (token bucket)
+и ограничение числа одновременно обрабатываемых запросов.
+
+- Лимит частоты: у каждого клиента (API-ключ или IP) свои корзины для чтения
+  и записи, например BOOKS_RATE_READ=50/100 - 50 запросов в секунду, всплеск до 100.
+  Сверх лимита - 429 и Retry-After (когда в корзине появится токен).
+- Одновременные запросы: BOOKS_MAX_CONCURRENCY на все запросы процесса,
+  BOOKS_MAX_WRITE_CONCURRENCY - отдельно на записи (они ждут блокировку записи sqlite).
+  Лишний запрос сразу получает 503 и Retry-After, а не ждёт в очереди:
+  очередь перед блокировкой только растягивает время ответа всех остальных.
+  Потоковый ответ (выгрузка книг) занимает место до закрытия ответа, а не до
+  выхода из представления.
+- Бесконечные потоки событий (SSE /api/changes) в общий лимит не входят: иначе
+  BOOKS_MAX_CONCURRENCY простаивающих подписчиков отдавали бы 503 всем остальным.
+  Для них свой лимит BOOKS_MAX_STREAMS; частота подключений - по корзине чтения.
+
+Корзины хранятся в памяти процесса; BOOKS_RATE_STORE=<файл sqlite> делает их
+общими для воркеров server.py (иначе у каждого воркера свой лимит).
+Ограничение одновременных запросов - всегда на процесс.
+Без переменных окружения всё выключено.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+RATE_READ = os.environ.get('BOOKS_RATE_READ', '')
+RATE_WRITE = os.environ.get('BOOKS_RATE_WRITE', '')
+RATE_STORE = os.environ.get('BOOKS_RATE_STORE', '')
+MAX_CONCURRENCY = int(os.environ.get('BOOKS_MAX_CONCURRENCY', '0'))
+MAX_WRITE_CONCURRENCY = int(os.environ.get('BOOKS_MAX_WRITE_CONCURRENCY', '0'))
+MAX_STREAMS = int(os.environ.get('BOOKS_MAX_STREAMS', '0'))
+
+# сколько клиентов помнит хранилище в памяти; давно не приходившие вытесняются (их корзины и так полны)
+MAX_CLIENTS = 100000
+# через сколько секунд ответ 503 стоит повторить
+SHED_RETRY_AFTER = 1.0
+
+READ = 'read'
+WRITE = 'write'
+# подписка на поток событий: лимит частоты как у чтения, одновременных - свой
+STREAM = 'stream'
+
+BUCKETS_TABLE_NAME = 'rate_buckets'
+
+
+def parse_rate(value: str) -> Optional[Tuple[float, float]]:
+    """
+    "50/100" -> (50.0, 100.0): скорость пополнения в секунду и ёмкость корзины;
+    "50" - ёмкость равна скорости. Пустая строка - без лимита.
+    """
+    if not value:
+        return None
+    rate, _, burst = value.partition('/')
+    try:
+        rate, burst = float(rate), float(burst) if burst else max(float(rate), 1.0)
+    except ValueError:
+        raise ValueError(f'Неправильный лимит частоты: {value}') from None
+    if rate <= 0 or burst < 1:
+        raise ValueError(f'Неправильный лимит частоты: {value}')
+    return rate, burst
+
+
+def _take(tokens: float, updated: float, now: float, rate: float, burst: float) -> Tuple[float, float]:
+    """
+    Пополняет корзину на прошедшее время и берёт один токен.
+    Возвращает новое число токенов и через сколько секунд повторить (0 - запрос допущен).
+    """
+    tokens = min(burst, tokens + max(now - updated, 0.0) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+class MemoryBucketStore:
+    """
+    Корзины в памяти процесса: LRU на MAX_CLIENTS клиентов.
+    """
+
+    def __init__(self, max_clients: int = MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        # ключ -> [токены, время последнего обращения]
+        self._buckets: 'OrderedDict[str, List[float]]' = OrderedDict()
+
+    def take(self, key: str, rate: float, burst: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [burst, now]
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            bucket[0], retry_after = _take(bucket[0], bucket[1], now, rate, burst)
+            bucket[1] = now
+            return retry_after
+
+    def reset_after_fork(self) -> None:
+        self._lock = threading.Lock()
+
+    def stats(self) -> Dict[str, int]:
+        return {'clients': len(self._buckets)}
+
+
+class SqliteBucketStore:
+    """
+    Корзины в отдельном файле sqlite, общем для процессов-воркеров.
+    Не основная база: её блокировку записи лимитер как раз и бережёт.
+    Каждое обращение - короткая транзакция BEGIN IMMEDIATE; synchronous=OFF,
+    потому что потерять корзины при сбое не страшно. Если файл занят дольше timeout,
+    запрос допускается: лимитер не должен сам становиться причиной отказов.
+    """
+    # раз в столько обращений удаляются корзины, не тронутые IDLE секунд
+    PRUNE_EVERY = 10000
+    IDLE = 3600.0
+
+    def __init__(self, path: str, timeout: float = 0.5):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._takes = 0
+        self.errors = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute(f'CREATE TABLE IF NOT EXISTS "{BUCKETS_TABLE_NAME}" '
+                               f'(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL) WITHOUT ROWID')
+            self._local.connection = connection
+        return connection
+
+    def _prune_due(self) -> bool:
+        with self._lock:
+            self._takes += 1
+            return self._takes % self.PRUNE_EVERY == 0
+
+    def take(self, key: str, rate: float, burst: float) -> float:
+        # время общее для процессов - только по часам системы
+        now = time.time()
+        try:
+            connection = self._connection()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = connection.execute(f'SELECT tokens, updated FROM "{BUCKETS_TABLE_NAME}" WHERE key = ?',
+                                         (key,)).fetchone()
+                tokens, retry_after = _take(*(row or (burst, now)), now, rate, burst)
+                connection.execute(f'INSERT OR REPLACE INTO "{BUCKETS_TABLE_NAME}" (key, tokens, updated) '
+                                   f'VALUES (?, ?, ?)', (key, tokens, now))
+                if self._prune_due():
+                    connection.execute(f'DELETE FROM "{BUCKETS_TABLE_NAME}" WHERE updated < ?', (now - self.IDLE,))
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        except sqlite3.OperationalError:
+            with self._lock:
+                self.errors += 1
+            return 0.0
+        return retry_after
+
+    def reset_after_fork(self) -> None:
+        # соединения родителя в дочернем процессе не используются
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def stats(self) -> Dict[str, int]:
+        return {'errors': self.errors}
+
+
+class ConcurrencyLimiter:
+    """
+    Не больше limit одновременных запросов; лишний не ждёт, а сразу получает отказ.
+    limit 0 - без ограничения.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak = 0
+        self.rejected = 0
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.limit and self.in_flight >= self.limit:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def reset_after_fork(self) -> None:
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+
+class AdmissionRejected(Exception):
+
+    def __init__(self, status: int, retry_after: float, message: str):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class Admission:
+    """
+    Лимиты частоты по видам запросов (READ / WRITE) и ограничения одновременных
+    запросов: общее, для записей и для потоков событий (STREAM).
+    """
+
+    def __init__(self, store, rates: Dict[str, Optional[Tuple[float, float]]],
+                 max_concurrency: int = 0, max_write_concurrency: int = 0, max_streams: int = 0):
+        self.store = store
+        self.rates = rates
+        self.total = ConcurrencyLimiter(max_concurrency)
+        self.writes = ConcurrencyLimiter(max_write_concurrency)
+        self.streams = ConcurrencyLimiter(max_streams)
+        self._lock = threading.Lock()
+        self.rate_limited = {READ: 0, WRITE: 0}
+        self.enabled = any(rates.values()) or bool(max_concurrency or max_write_concurrency or max_streams)
+
+    def _limiters(self, kind: str) -> List[ConcurrencyLimiter]:
+        if kind == STREAM:
+            return [self.streams]
+        return [self.total, self.writes] if kind == WRITE else [self.total]
+
+    @contextmanager
+    def admit(self, client: str, kind: str) -> Iterator[None]:
+        """
+        Допускает запрос клиента или бросает AdmissionRejected
+        (429 - превышен лимит частоты, 503 - сервер занят).
+        """
+        rate_kind = READ if kind == STREAM else kind
+        rate = self.rates.get(rate_kind)
+        if rate is not None:
+            retry_after = self.store.take(f'{rate_kind}:{client}', *rate)
+            if retry_after:
+                with self._lock:
+                    self.rate_limited[rate_kind] += 1
+                raise AdmissionRejected(429, retry_after, 'Слишком много запросов, повторите позже')
+        acquired = []
+        try:
+            for limiter in self._limiters(kind):
+                if not limiter.try_acquire():
+                    raise AdmissionRejected(503, SHED_RETRY_AFTER, 'Сервер перегружен, повторите позже')
+                acquired.append(limiter)
+            yield
+        finally:
+            for limiter in acquired:
+                limiter.release()
+
+    def reset_after_fork(self) -> None:
+        self._lock = threading.Lock()
+        self.store.reset_after_fork()
+        self.total.reset_after_fork()
+        self.writes.reset_after_fork()
+        self.streams.reset_after_fork()
+
+    def stats(self) -> Dict[str, int]:
+        return dict({
+            'rate_limited_read': self.rate_limited[READ],
+            'rate_limited_write': self.rate_limited[WRITE],
+            'shed': self.total.rejected + self.writes.rejected + self.streams.rejected,
+            'in_flight': self.total.in_flight,
+            'in_flight_write': self.writes.in_flight,
+            'in_flight_streams': self.streams.in_flight,
+            'peak_in_flight': self.total.peak,
+        }, **{f'store_{key}': value for key, value in self.store.stats().items()})
+
+
+admission = Admission(
+    SqliteBucketStore(RATE_STORE) if RATE_STORE else MemoryBucketStore(),
+    {READ: parse_rate(RATE_READ), WRITE: parse_rate(RATE_WRITE)},
+    MAX_CONCURRENCY,
+    MAX_WRITE_CONCURRENCY,
+    MAX_STREAMS,
+)
+
+os.register_at_fork(after_in_child=admission.reset_after_fork)
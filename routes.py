@@ -1,48 +1,568 @@
-from typing import List, Dict, Tuple
+from typing import Any, Callable, FrozenSet, Hashable, Iterable, Iterator, List, Dict, Optional, Set, Tuple
+import hashlib
+import json
+import math
 import os
-from apispec.ext.marshmallow import MarshmallowPlugin
-from flask import Flask, request
+import time
+from contextlib import ExitStack
+from functools import wraps
+from urllib.parse import urlencode
+from werkzeug.datastructures import ETags
+from werkzeug.http import http_date, quote_etag, unquote_etag
+
+from flask import Flask, Response, g, make_response, request, stream_with_context
 from flask_restful import Api, Resource
 from marshmallow import ValidationError
-from flasgger import APISpec, Swagger
-from apispec_webframeworks.flask import FlaskPlugin
-from models import get_all_books, get_all_authors, init_db, add_book, add_author, get_book_by_id, Book, \
-    update_book_by_id, delete_book_by_id, get_author_by_id, Author, delete_author_by_id, update_author_by_id
-from schemas import BookSchema, AuthorSchema, BookListSchema
+from models import get_all_books, get_all_authors, add_book, add_author, get_book_by_id, Book, \
+    update_book_by_id, delete_book_by_id, get_author_by_id, Author, delete_author_by_id, update_author_by_id, \
+    get_books_page, get_authors_page, BOOK_SORT_FIELDS, AUTHOR_SORT_FIELDS, iter_book_rows, get_existing_author_ids, \
+    get_existing_book_ids, get_existing_author_names, add_books, add_authors, update_books, update_authors, \
+    delete_books, delete_authors, get_book_version, get_author_version, get_tables_version, BOOKS_TABLE_NAME, \
+    AUTHORS_TABLE_NAME, search_books, search_authors, get_author_books_page, get_books_by_authors, BOOK_ROW_COLUMNS, \
+    Change, get_changes, get_changes_horizon, wait_for_changes, AUTHOR_STATS_SORT_FIELDS, get_author_stats_page
+from schemas import BookSchema, AuthorSchema, BookListSchema, BookBulkSchema, AuthorBulkSchema, BookRefSchema, \
+    AuthorBooksSchema, AuthorStatsSchema
+from db import pool, router, writer, write_transaction, read_your_writes, required_version, \
+    run_write, REPLICA_REFRESH
+from migrations import migrate
+from pagination import PageArgsError, parse_page_args, next_page_headers, encode_cursor, MAX_PAGE_LIMIT
+from serializers import compile_dumpers, get_dumper, get_row_dumper, dump, dump_many
+from cache import get_cache, MISS, book_tag, author_tag, BOOK_LISTS_TAG, AUTHOR_LISTS_TAG
+from metrics import REQUEST_SECONDS, GaugeFunc, RequestProfile, register, render, timed_method
+import openapi
+from ratelimit import READ, STREAM, WRITE, AdmissionRejected, admission
+from idempotency import IdempotencyError, MAX_KEY_LENGTH, idempotency, request_fingerprint
+from encoders import JSON_MIMETYPE, MSGPACK_MIMETYPE, COMPRESS_MIN_SIZE, choose_encoding, compress, \
+    compress_stream, encode_json, encode_msgpack, is_compressible, msgpack
 
 
 app = Flask(__name__)
 api = Api(app)
+# необязательный быстрый JSON-кодировщик (orjson); по умолчанию - стандартный json без \uXXXX
+app.config.setdefault('FAST_JSON', os.environ.get('BOOKS_FAST_JSON') == '1')
+# gzip / brotli по Accept-Encoding для ответов от COMPRESS_MIN_SIZE байт
+app.config.setdefault('COMPRESS', os.environ.get('BOOKS_COMPRESS', '1') == '1')
+# автор в книгах по умолчанию: вложенный объект (1) или только id (0); ?expand= переопределяет
+app.config.setdefault('EXPAND_AUTHOR', os.environ.get('BOOKS_EXPAND_AUTHOR', '1') == '1')
+# ?profile=1 / X-Profile: 1 отдают отчёт cProfile вместо ответа; только если включено
+app.config.setdefault('PROFILING', os.environ.get('BOOKS_PROFILING') == '1')
+
+compile_dumpers(BookListSchema, AuthorSchema, BookSchema, BookRefSchema, AuthorBooksSchema, AuthorStatsSchema)
+get_row_dumper(BookListSchema, BOOK_ROW_COLUMNS)
+
+register(GaugeFunc('books_db_pool', 'Connection pool state', pool.stats, 'stat'))
+register(GaugeFunc('books_response_cache', 'Response cache counters', lambda: get_cache().stats(), 'stat'))
+if writer is not None:
+    register(GaugeFunc('books_group_commit', 'Group commit batches', writer.stats, 'stat'))
+register(GaugeFunc('books_idempotency', 'Idempotency-Key replays and coalesced retries', idempotency.stats, 'stat'))
+if admission.enabled:
+    register(GaugeFunc('books_admission', 'Rate limiting and load shedding', admission.stats, 'stat'))
+
+
+@app.before_request
+def _start_request_timer() -> None:
+    g.request_start = time.perf_counter()
+    if app.config['PROFILING'] and (request.args.get('profile') == '1' or request.headers.get('X-Profile') == '1'):
+        g.profile = RequestProfile()
+        g.profile.start()
+
+
+@app.after_request
+def _observe_request(response: Response) -> Response:
+    profile = g.pop('profile', None)
+    if profile is not None:
+        response = Response(profile.report(), mimetype='text/plain',
+                            headers={'X-Profiled-Status': str(response.status_code)})
+    start = g.pop('request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe((route, request.method, str(response.status_code)), time.perf_counter() - start)
+    return response
+
+
+WRITE_VERSION_HEADER = 'X-Write-Version'
+MIN_VERSION_HEADER = 'X-Min-Version'
+WRITE_VERSION_COOKIE = 'books_write_version'
+
+
+@app.after_request
+def _write_version(response: Response) -> Response:
+    """
+    С репликами ответ на запись несёт версию данных после неё: клиент, вернувший её
+    в X-Min-Version (или cookie), читает не из отстающей реплики (read-your-writes).
+    """
+    if router.replicas and request.method in ('POST', 'PUT', 'DELETE') and response.status_code < 400:
+        version = router.write_version()
+        response.headers[WRITE_VERSION_HEADER] = str(version)
+        response.set_cookie(WRITE_VERSION_COOKIE, str(version), httponly=True, samesite='Lax')
+    return response
+
+
+def _client_min_version() -> Optional[int]:
+    value = request.headers.get(MIN_VERSION_HEADER) or request.cookies.get(WRITE_VERSION_COOKIE)
+    return int(value) if value and value.isdigit() else None
+
+
+def with_client_version(method: Callable) -> Callable:
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        with read_your_writes(_client_min_version()):
+            return method(*args, **kwargs)
+    return wrapper
+
+
+# обновлённые реплики: ответы, прочитанные из старой копии, больше не нужны
+router.on_refresh(lambda: get_cache().clear())
+
+
+class BaseResource(Resource):
+    # время каждого метода ресурса - в /metrics; версия для read-your-writes
+    method_decorators = [timed_method, with_client_version]
+
+
+API_KEY_HEADER = 'X-API-Key'
+
+
+def _client_key() -> str:
+    api_key = request.headers.get(API_KEY_HEADER)
+    if api_key:
+        # сам ключ не хранится ни в памяти, ни в общем файле корзин
+        return 'key:' + hashlib.sha256(api_key.encode()).hexdigest()[:32]
+    return 'ip:' + (request.remote_addr or '')
+
+
+def _admit(kind: str, call: Callable[[], Any]) -> Any:
+    with ExitStack() as stack:
+        try:
+            stack.enter_context(admission.admit(_client_key(), kind))
+        except AdmissionRejected as exc:
+            return [{"error": str(exc)}], exc.status, {'Retry-After': str(math.ceil(exc.retry_after))}
+        result = call()
+        if isinstance(result, Response) and result.is_streamed:
+            # тело отдаётся уже после выхода из представления и всё это время занимает поток
+            result.call_on_close(stack.pop_all().close)
+        return result
+
+
+def admitted(method: Callable) -> Callable:
+    """
+    Лимит частоты на клиента и ограничение одновременных запросов (ratelimit.py):
+    отказ - сразу 429 / 503 с Retry-After, до обращения к базе.
+    Потоковый ответ (выгрузка) держит слот, пока сервер его не закроет.
+    """
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        if not admission.enabled:
+            return method(*args, **kwargs)
+        kind = READ if request.method in ('GET', 'HEAD') else WRITE
+        return _admit(kind, lambda: method(*args, **kwargs))
+    return wrapper
+
+
+class LimitedResource(BaseResource):
+    # admitted - последним, то есть снаружи: отказ не тратит время на остальное
+    method_decorators = BaseResource.method_decorators + [admitted]
+
+
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+IDEMPOTENT_REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def idempotent(method: Callable) -> Callable:
+    """
+    POST с заголовком Idempotency-Key выполняется один раз (idempotency.py):
+    повтор получает сохранённый ответ без обращения к книгам и авторам.
+    Ключи хранятся отдельно для каждого клиента (API-ключ или адрес, как в ratelimit).
+    Ответ первого выполнения сохраняется в транзакции записи (см. _write).
+    """
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+        if key is None:
+            return method(*args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return [{"error": f"{IDEMPOTENCY_KEY_HEADER}: от 1 до {MAX_KEY_LENGTH} символов"}], 400
+        fingerprint = request_fingerprint(request.method, request.path, request.get_data())
+        try:
+            # ключ выбирает клиент: у разных клиентов одинаковые ключи не должны встречаться
+            store_key = f'{_client_key()} {request.method} {request.path} {key}'
+            with idempotency.begin(store_key, fingerprint) as (stored, attempt):
+                if stored is not None:
+                    return json.loads(stored.body), stored.status, dict(stored.headers,
+                                                                        **{IDEMPOTENT_REPLAYED_HEADER: 'true'})
+                g.idempotency = attempt
+                result = method(*args, **kwargs)
+                # ответ, не прошедший через _write, сохраняется отдельно
+                attempt.save(result)
+                return result
+        except IdempotencyError as exc:
+            headers = {'Retry-After': str(math.ceil(exc.retry_after))} if exc.retry_after else {}
+            return [{"error": str(exc)}], exc.status, headers
+    return wrapper
+
+
+def _page_args(sort_fields: Dict[str, str]) -> Dict[str, Any]:
+    return parse_page_args(sort_fields, request.args)
+
+
+def _page_headers(items: list, limit: int, sort_value: Callable[[dict], Any]) -> Dict[str, str]:
+    return next_page_headers(items, limit, sort_value, request.base_url, request.args.to_dict())
+
+
+def _cached(key: Hashable, load: Callable[[], Any], tags: Callable[[Any], Iterable[str]]) -> Any:
+    """
+    Read-through: ответ берётся из кэша, иначе строится load() и сохраняется
+    с тегами, по которым его сбросят записи в models.py.
+
+    Ключ включает версию данных (ETag), прочитанную из базы перед вызовом:
+    кэш у каждого процесса server.py свой, и запись в другом воркере,
+    не сбросившая теги здесь, всё равно меняет ключ.
+    """
+    if required_version() is not None:
+        # клиенту нужна свежая версия: кэш мог быть заполнен из отстающей реплики
+        return load()
+    cache = get_cache()
+    since = cache.generation()
+    value = cache.get(key)
+    if value is MISS:
+        value = load()
+        if value is not None:
+            cache.set(key, value, tags(value), since=since)
+    # по этим данным представление может взять из кэша уже закодированное и сжатое тело
+    g.cached = (key, value, tags, since)
+    return value
+
+
+def _cached_body_key(data: Any, mimetype: str, encoding: Optional[str]) -> Optional[tuple]:
+    """
+    Ключ готового тела ответа, если data - ровно то, что вернул _cached
+    (сам ответ или первый элемент пары (данные, заголовки)).
+    """
+    cached = g.get('cached')
+    if cached is None or data is None:
+        return None
+    key, value, _, _ = cached
+    if data is value or (isinstance(value, tuple) and value and data is value[0]):
+        return 'body', key, mimetype, encoding
+    return None
+
+
+def _encode_body(data: Any, mimetype: str, encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    body = encode_msgpack(data) if mimetype == MSGPACK_MIMETYPE else encode_json(data, app.config['FAST_JSON'])
+    if encoding is None or len(body) < COMPRESS_MIN_SIZE:
+        return body, None
+    return compress(body, encoding), encoding
+
+
+def _encoded_response(data: Any, code: int, headers: Optional[Dict], mimetype: str) -> Response:
+    """
+    Тело в выбранном формате и сжатии. Для закэшированных списков готовые байты
+    (уже сжатые) лежат в том же кэше с теми же тегами, и повторный запрос
+    не сериализует и не сжимает ничего.
+    """
+    encoding = choose_encoding(request.accept_encodings) if app.config['COMPRESS'] else None
+    if code == 304:
+        body, content_encoding = b'', None
+    else:
+        body_key = _cached_body_key(data, mimetype, encoding)
+        cache = get_cache()
+        cached_body = cache.get(body_key) if body_key else MISS
+        if cached_body is not MISS:
+            body, content_encoding = cached_body
+        else:
+            body, content_encoding = _encode_body(data, mimetype, encoding)
+            if body_key:
+                _, value, tags, since = g.cached
+                cache.set(body_key, (body, content_encoding), tags(value), since=since)
+    resp = make_response(body, code)
+    resp.headers.extend(headers or {})
+    if 'ETag' in resp.headers:
+        tag, _ = unquote_etag(resp.headers['ETag'])
+        if code == 304:
+            # тот тег, что уже есть у клиента; по If-Modified-Since - тег выбранного представления
+            tag = _matched_etag(tag, request.if_none_match) or _representation_etag(tag, mimetype, encoding)
+        else:
+            tag = _representation_etag(tag, mimetype, content_encoding)
+        resp.headers['ETag'] = quote_etag(tag)
+    resp.mimetype = mimetype
+    if content_encoding:
+        resp.headers['Content-Encoding'] = content_encoding
+    resp.vary.update(('Accept', 'Accept-Encoding'))
+    return resp
+
+
+@api.representation(JSON_MIMETYPE)
+def output_json(data, code, headers=None):
+    return _encoded_response(data, code, headers, JSON_MIMETYPE)
+
+
+if msgpack is not None:
+    @api.representation(MSGPACK_MIMETYPE)
+    def output_msgpack(data, code, headers=None):
+        return _encoded_response(data, code, headers, MSGPACK_MIMETYPE)
+
+
+@app.after_request
+def _compress_response(response: Response) -> Response:
+    # ответы мимо представлений flask_restful (swagger, /metrics, html); потоковые сжимаются сами
+    if (not app.config['COMPRESS'] or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or not is_compressible(response.mimetype)):
+        return response
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None or response.status_code != 200 or (response.content_length or 0) < COMPRESS_MIN_SIZE:
+        return response
+    response.set_data(compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def _embedded_author_tags(books_data: Iterable[Dict]) -> Set[str]:
+    # только вложенные авторы: ссылка по id не меняется при переименовании автора
+    return {author_tag(item['author']['id']) for item in books_data if isinstance(item.get('author'), dict)}
+
+
+def _book_list_tags(value: Tuple[List[Dict], Dict]) -> List[str]:
+    books_data, _ = value
+    return [BOOK_LISTS_TAG, *_embedded_author_tags(books_data)]
+
+
+BOOK_FIELDS = ('id', 'title', 'author')
+
+
+class BookViewArgsError(ValueError):
+    pass
+
+
+def _book_view_args() -> Tuple[Optional[FrozenSet[str]], bool]:
+    """
+    ?fields=id,title - sparse fieldset, ?expand=author - вложенный автор
+    (?expand= без значения - автор-ссылка). Возвращает (поля или None, expand).
+    """
+    fields = None
+    if 'fields' in request.args:
+        fields = frozenset(name.strip() for name in request.args['fields'].split(',') if name.strip())
+        unknown = fields - set(BOOK_FIELDS)
+        if not fields or unknown:
+            raise BookViewArgsError(f"fields: допустимы {', '.join(BOOK_FIELDS)}")
+    expand = request.args.get('expand')
+    if expand is None:
+        return fields, app.config['EXPAND_AUTHOR']
+    if expand not in ('', 'author'):
+        raise BookViewArgsError('expand: допустимо только author')
+    return fields, expand == 'author'
+
+
+def _dump_books(books: List[Book], fields: Optional[FrozenSet[str]], expand: bool) -> List[Dict]:
+    return dump_many(BookListSchema if expand else BookRefSchema, books, fields)
+
+
+def _book_sort_value(sort: str) -> Callable[[Book], Any]:
+    # курсор строится по объектам книг: колонка сортировки есть в них, даже если её нет в fields
+    if sort == 'author':
+        return lambda book: book.author.id if isinstance(book.author, Author) else book.author
+    return lambda book: book[sort]
+
+
+def _representation_etag(tag: str, mimetype: str, encoding: Optional[str]) -> str:
+    """
+    Сильный ETag у каждого представления свой (RFC 9110, 8.8.1): к версии данных
+    добавляются формат и сжатие тела, например b3.5-json-gzip.
+    """
+    tag = f"{tag}-{'msgpack' if mimetype == MSGPACK_MIMETYPE else 'json'}"
+    return f'{tag}-{encoding}' if encoding else tag
+
+
+def _etag_version(tag: str) -> str:
+    # версия данных из ETag представления; в самой версии '-' не бывает
+    return tag.split('-', 1)[0]
+
+
+def _matched_etag(tag: str, etags: ETags, weak: bool = True) -> Optional[str]:
+    """
+    Тег из If-None-Match (weak=False - для If-Match) любого представления этой версии.
+    """
+    return next((value for value in etags.as_set(include_weak=weak) if _etag_version(value) == tag), None)
+
+
+def _etag_headers(version: Tuple[str, float]) -> Dict[str, str]:
+    tag, modified = version
+    return {'ETag': quote_etag(tag), 'Last-Modified': http_date(modified)}
+
+
+def _not_modified(version: Tuple[str, float]) -> bool:
+    """
+    Условный GET: проверяется до чтения данных, по счётчику версий из базы.
+    """
+    tag, modified = version
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(tag) or _matched_etag(tag, request.if_none_match) is not None
+    if request.if_modified_since:
+        return int(modified) <= request.if_modified_since.timestamp()
+    return False
+
+
+def _if_match() -> Optional[ETags]:
+    # читается до _write: при групповом коммите запись выполняется вне контекста запроса
+    return request.if_match if 'If-Match' in request.headers else None
+
+
+def _precondition_failed(version: Tuple[str, float], if_match: Optional[ETags]) -> bool:
+    # If-Match для оптимистичной блокировки PUT/DELETE: подходит ETag любого представления версии
+    return (if_match is not None and not if_match.contains(version[0])
+            and _matched_etag(version[0], if_match, weak=False) is None)
+
+
+def _write(fn: Callable[[], Any]) -> Any:
+    """
+    Проверка и запись одного объекта - одна транзакция BEGIN IMMEDIATE (db.run_write):
+    автор, найденный при проверке, не удалят до вставки книги. При групповом
+    коммите fn выполняется в потоке-писателе, где нет ни request, ни g: всё нужное
+    из запроса (тело, If-Match) fn получает через замыкание.
+    Под Idempotency-Key ответ сохраняется в той же транзакции.
+    """
+    attempt = g.get('idempotency')
+    if attempt is not None:
+        fn = attempt.recording(fn)
+    return run_write(fn)
+
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def _export_ndjson() -> Iterator[str]:
+    # строки курсора сериализуются напрямую, без объектов Book / Author на каждую
+    dump_book = get_row_dumper(BookListSchema, BOOK_ROW_COLUMNS)
+    for row in iter_book_rows():
+        yield json.dumps(dump_book(row), ensure_ascii=False) + '\n'
+
+
+def _export_json() -> Iterator[str]:
+    dump_book = get_row_dumper(BookListSchema, BOOK_ROW_COLUMNS)
+    yield '['
+    separator = ''
+    for row in iter_book_rows():
+        yield separator + json.dumps(dump_book(row), ensure_ascii=False)
+        separator = ','
+    yield ']\n'
 
-spec = APISpec(
-    title='BooksList',
-    version='1.0.0',
-    openapi_version='2.0',
-    plugins=[
-        FlaskPlugin(),
-        MarshmallowPlugin(),
-    ],
-)
 
-class BooksResource(Resource):
+def _books_export_response(export_format: str) -> Response:
+    """
+    Потоковая (chunked) выгрузка всех книг: сериализация по одной строке.
+    """
+    if export_format == 'ndjson':
+        body, mimetype = _export_ndjson(), NDJSON_MIMETYPE
+    else:
+        body, mimetype = _export_json(), JSON_MIMETYPE
+    encoding = choose_encoding(request.accept_encodings) if app.config['COMPRESS'] else None
+    if encoding is None:
+        return Response(stream_with_context(body), mimetype=mimetype)
+    response = Response(stream_with_context(compress_stream(body, encoding)), mimetype=mimetype)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
 
-    def get(self) -> tuple[list[dict], int]:
+
+AUTHOR_BOOKS_DEFAULT_LIMIT = 10
+AUTHOR_BOOKS_SORT_FIELDS = {'id': 'b.id'}
+
+
+def _author_books_url(author_id: int, limit: int, last_book: Book) -> str:
+    args = {'limit': limit, 'after': encode_cursor(last_book.id, last_book.id)}
+    return f"{api.url_for(AuthorBooks, author_id=author_id, _external=True)}?{urlencode(args)}"
+
+
+def _dump_authors_with_books(authors: List[Author], books_limit: int) -> List[Dict]:
+    """
+    ?include=books: книги всех авторов страницы - одним запросом. Берётся на одну
+    книгу больше, чтобы знать, нужна ли ссылка books_next на продолжение списка.
+    """
+    books = get_books_by_authors([author.id for author in authors], books_limit + 1)
+    authors_data = []
+    for author in authors:
+        author_books = books.get(author.id, [])
+        author.books = author_books[:books_limit]
+        books_next = None
+        if len(author_books) > books_limit:
+            books_next = _author_books_url(author.id, books_limit, author.books[-1])
+        authors_data.append(dict(dump(AuthorBooksSchema, author), books_next=books_next))
+    return authors_data
+
+
+class BooksResource(LimitedResource):
+
+    def get(self) -> tuple[list[dict], int, dict]:
         """
         This is endpoint for obtaining the books list.
         ---
         tags:
           - books
+        parameters:
+          - in: query
+            name: limit
+            type: integer
+            description: Page size (1-1000, default 100)
+          - in: query
+            name: after
+            type: string
+            description: Cursor from the X-Next-Cursor header of the previous page
+          - in: query
+            name: sort
+            type: string
+            description: id, title or author; prefix with '-' for descending order
+          - in: query
+            name: author
+            type: integer
+            description: Only books of this author
+          - in: query
+            name: title
+            type: string
+            description: Title prefix
+          - in: query
+            name: fields
+            type: string
+            description: Comma-separated subset of id, title, author (sparse fieldset)
+          - in: query
+            name: expand
+            type: string
+            enum: [author, '']
+            description: author - nested author object, empty - author id only (default from EXPAND_AUTHOR)
         responses:
           200:
-            description: Books data
+            description: Books data, next page link in the Link header
             schema:
               type: array
               items:
                 $ref: '#/definitions/BookList'
+          304:
+            description: Not modified (If-None-Match / If-Modified-Since)
+          400:
+            description: Wrong pagination, fields or expand params
         """
-        schema = BookListSchema()
-        return schema.dump(get_all_books(), many=True), 200
+        if request.accept_mimetypes.best == NDJSON_MIMETYPE:
+            return _books_export_response('ndjson')
+        try:
+            page = _page_args(BOOK_SORT_FIELDS)
+            author_id = request.args.get('author', type=int)
+            fields, expand = _book_view_args()
+        except (PageArgsError, BookViewArgsError) as exc:
+            return [{"error": str(exc)}], 400
+
+        def load_page() -> Tuple[List[Dict], Dict]:
+            books = get_books_page(author_id=author_id, title_prefix=request.args.get('title'),
+                                   fields=fields, expand=expand, **page)
+            # курсор по колонке books.author, а не по вложенному автору
+            headers = _page_headers(books, page['limit'], _book_sort_value(page['sort']))
+            return _dump_books(books, fields, expand), headers
 
+        version = get_tables_version(BOOKS_TABLE_NAME, AUTHORS_TABLE_NAME)
+        if _not_modified(version):
+            return None, 304, _etag_headers(version)
+        books_data, headers = _cached(('books', request.query_string, version[0]), load_page, _book_list_tags)
+        return books_data, 200, dict(headers, **_etag_headers(version))
+
+    @idempotent
     def post(self) -> tuple[dict, int]:
         """
         This is endpoint for book creation.
@@ -54,6 +574,10 @@ class BooksResource(Resource):
             name: new book params
             schema:
               $ref: '#/definitions/Book'
+          - in: header
+            name: Idempotency-Key
+            type: string
+            description: Retries with the same key return the stored response instead of creating a duplicate
         responses:
           201:
             description: The book has been created
@@ -62,36 +586,125 @@ class BooksResource(Resource):
                 $ref: '#/definitions/BookList'
           400:
             description: Error validation
+          409:
+            description: A request with the same Idempotency-Key is still in progress
+          422:
+            description: The Idempotency-Key was used with a different request body
         """
         data = request.json
         schema_book = BookSchema()
-        try:
-            book = schema_book.load(data, many=False)
-        except ValidationError as exc:
-            return exc.messages, 400
-        book = add_book(book)
-        schema_book_info = BookListSchema()
-        return schema_book_info.dump(get_book_by_id(book.id)), 201
 
-class AuthorsResource(Resource):
+        # проверка автора и вставка - одна транзакция на одном соединении
+        def write():
+            try:
+                book = schema_book.load(data, many=False)
+            except ValidationError as exc:
+                return exc.messages, 400
+            return dump(BookListSchema, add_book(book)), 201
+
+        return _write(write)
+
+class BooksExport(LimitedResource):
+
+    def get(self) -> Response:
+        """
+        This is endpoint for streaming export of the whole books list.
+        ---
+        tags:
+          - books
+        parameters:
+          - in: query
+            name: format
+            type: string
+            enum: [ndjson, json]
+            description: One book per line (ndjson, default) or a single JSON array
+        produces:
+          - application/x-ndjson
+          - application/json
+        responses:
+          200:
+            description: Books data streamed row by row
+            schema:
+              type: array
+              items:
+                $ref: '#/definitions/BookList'
+          400:
+            description: Unknown format
+        """
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in ('ndjson', 'json'):
+            return [{"error": f"Неизвестный формат выгрузки: {export_format}"}], 400
+        return _books_export_response(export_format)
+
+class AuthorsResource(LimitedResource):
 
-    def get(self) -> Tuple[List[Dict], int]:
+    def get(self) -> Tuple[List[Dict], int, Dict]:
         """
         This is endpoint for obtaining the Authors list.
         ---
         tags:
           - authors
+        parameters:
+          - in: query
+            name: limit
+            type: integer
+            description: Page size (1-1000, default 100)
+          - in: query
+            name: after
+            type: string
+            description: Cursor from the X-Next-Cursor header of the previous page
+          - in: query
+            name: sort
+            type: string
+            description: id, first_name or last_name; prefix with '-' for descending order
+          - in: query
+            name: include
+            type: string
+            enum: [books]
+            description: Embed the first books of every author (books) and a books_next link to the rest
+          - in: query
+            name: books_limit
+            type: integer
+            description: Books per author with include=books (1-1000, default 10)
         responses:
           200:
-            description: Author data
+            description: Author data, next page link in the Link header
             schema:
               type: array
               items:
                 $ref: '#/definitions/Author'
+          304:
+            description: Not modified (If-None-Match / If-Modified-Since)
+          400:
+            description: Wrong pagination or include params
         """
-        schema_author = AuthorSchema()
-        return schema_author.dump(get_all_authors(), many=True), 200
+        try:
+            page = _page_args(AUTHOR_SORT_FIELDS)
+        except PageArgsError as exc:
+            return [{"error": str(exc)}], 400
+        include = request.args.get('include')
+        books_limit = request.args.get('books_limit', AUTHOR_BOOKS_DEFAULT_LIMIT, type=int)
+        if include not in (None, 'books'):
+            return [{"error": "include: допустимо только books"}], 400
+        if not 1 <= books_limit <= MAX_PAGE_LIMIT:
+            return [{"error": f"books_limit должен быть от 1 до {MAX_PAGE_LIMIT}"}], 400
+
+        def load_page() -> Tuple[List[Dict], Dict]:
+            authors = get_authors_page(**page)
+            headers = _page_headers(authors, page['limit'], lambda author: author[page['sort']])
+            if include:
+                return _dump_authors_with_books(authors, books_limit), headers
+            return dump_many(AuthorSchema, authors), headers
 
+        tables = (AUTHORS_TABLE_NAME, BOOKS_TABLE_NAME) if include else (AUTHORS_TABLE_NAME,)
+        version = get_tables_version(*tables)
+        if _not_modified(version):
+            return None, 304, _etag_headers(version)
+        authors_data, headers = _cached(('authors', request.query_string, version[0]), load_page,
+                                        lambda value: [AUTHOR_LISTS_TAG, *([BOOK_LISTS_TAG] if include else [])])
+        return authors_data, 200, dict(headers, **_etag_headers(version))
+
+    @idempotent
     def post(self) -> Tuple[Dict, int]:
         """
         This is endpoint for author creation.
@@ -103,6 +716,10 @@ class AuthorsResource(Resource):
             name: new Author params
             schema:
               $ref: '#/definitions/Author'
+          - in: header
+            name: Idempotency-Key
+            type: string
+            description: Retries with the same key return the stored response instead of creating a duplicate
         responses:
           201:
             description: The Author has been created
@@ -111,17 +728,80 @@ class AuthorsResource(Resource):
                 $ref: '#/definitions/Author'
           400:
             description: Error validation
+          409:
+            description: A request with the same Idempotency-Key is still in progress
+          422:
+            description: The Idempotency-Key was used with a different request body
         """
         data = request.json
         schema_author = AuthorSchema()
+
+        def write():
+            try:
+                author = schema_author.load(data)
+            except ValidationError as exc:
+                return exc.messages, 400
+            return schema_author.dump(add_author(author)), 201
+
+        return _write(write)
+
+class AuthorBooks(BaseResource):
+
+    def get(self, author_id: int) -> Tuple[Dict, int, Dict]:
+        """
+        This is endpoint for obtaining the author with a page of their books.
+        ---
+        tags:
+          - authors
+        parameters:
+          - in: path
+            name: author_id
+            type: int
+          - in: query
+            name: limit
+            type: integer
+            description: Books page size (1-1000, default 100)
+          - in: query
+            name: after
+            type: string
+            description: Cursor from the X-Next-Cursor header of the previous page
+          - in: query
+            name: sort
+            type: string
+            description: id; '-id' for descending order
+        responses:
+          200:
+            description: Author data with the books list, next books page link in the Link header
+          304:
+            description: Not modified (If-None-Match / If-Modified-Since)
+          400:
+            description: Wrong pagination params
+          404:
+            description: No such author
+        """
         try:
-            author = schema_author.load(data)
-        except ValidationError as exc:
-            return exc.messages, 400
-        author = add_author(author)
-        return schema_author.dump(author), 201
+            page = _page_args(AUTHOR_BOOKS_SORT_FIELDS)
+        except PageArgsError as exc:
+            return [{"error": str(exc)}], 400
 
-class BooksEdit(Resource):
+        def load_author() -> Optional[Tuple[Dict, Dict]]:
+            author = get_author_by_id(author_id)
+            if not author:
+                return None
+            author.books = get_author_books_page(author_id, page['limit'], page['after'], page['desc'])
+            return dump(AuthorBooksSchema, author), _page_headers(author.books, page['limit'], lambda book: book.id)
+
+        version = get_tables_version(AUTHORS_TABLE_NAME, BOOKS_TABLE_NAME)
+        if _not_modified(version):
+            return None, 304, _etag_headers(version)
+        res = _cached(('author_books', author_id, request.query_string, version[0]), load_author,
+                      lambda value: [author_tag(author_id), BOOK_LISTS_TAG])
+        if not res:
+            return [{"error": f"Автора с таким ID({author_id}) нет"}], 404
+        author_data, headers = res
+        return author_data, 200, dict(headers, **_etag_headers(version))
+
+class BooksEdit(LimitedResource):
 
     def get(self, book_id: int) -> tuple[list[dict], int]:
         """
@@ -133,20 +813,45 @@ class BooksEdit(Resource):
           - in: path
             name: book_id
             type: int
+          - in: query
+            name: fields
+            type: string
+            description: Comma-separated subset of id, title, author (sparse fieldset)
+          - in: query
+            name: expand
+            type: string
+            enum: [author, '']
+            description: author - nested author object, empty - author id only (default from EXPAND_AUTHOR)
         responses:
           200:
             description: Book data
             schema:
               items:
                 $ref: '#/definitions/BookList'
+          304:
+            description: Not modified (If-None-Match / If-Modified-Since)
+          400:
+            description: Wrong fields or expand params
           404:
             description: No such book
         """
+        try:
+            fields, expand = _book_view_args()
+        except BookViewArgsError as exc:
+            return [{"error": str(exc)}], 400
+
+        def load_book() -> Optional[Dict]:
+            res = get_book_by_id(book_id, fields, expand)
+            if res:
+                return dump(BookListSchema if expand else BookRefSchema, res, fields)
 
-        schema = BookListSchema()
-        res = get_book_by_id(book_id)
+        version = get_book_version(book_id)
+        if version and _not_modified(version):
+            return None, 304, _etag_headers(version)
+        res = version and _cached(('book', book_id, fields, expand, version[0]), load_book,
+                                  lambda value: [book_tag(book_id), *_embedded_author_tags([value])])
         if res:
-            return schema.dump(res), 200
+            return res, 200, _etag_headers(version)
         else:
             return [{"error": f"Книги с таким ID({book_id}) нет"}], 404
 
@@ -185,27 +890,36 @@ class BooksEdit(Resource):
                 $ref: '#/definitions/Book'
           400:
             description: Error validation
+          404:
+            description: No such book
+          412:
+            description: If-Match does not match the current ETag
         """
 
         data = request.json
         schema_book = BookSchema()
-        try:
-            schema_book.load(data, many=False)
-        except ValidationError as exc:
-            return exc.messages, 400
+        if_match = _if_match()
 
+        def write():
+            try:
+                book = schema_book.load(data, many=False)
+            except ValidationError as exc:
+                return exc.messages, 400
 
-        book = get_book_by_id(book_id)
-        book_new = Book(
-            title = data['title'],
-            author = data['author'],
-            id = book['id']
-        )
+            if if_match is not None:
+                version = get_book_version(book_id)
+                if version is None:
+                    return [{"error": f"Книги с таким ID({book_id}) нет"}], 404
+                if _precondition_failed(version, if_match):
+                    return [{"error": "Книга была изменена (ETag не совпадает)"}], 412
 
-        update_book_by_id(book_new)
+            book.id = book_id
+            book = update_book_by_id(book)
+            if book is None:
+                return [{"error": f"Книги с таким ID({book_id}) нет"}], 404
+            return dump(BookListSchema, book), 200, _etag_headers(get_book_version(book_id))
 
-        schema_book_info = BookListSchema()
-        return schema_book_info.dump(get_book_by_id(book_id)), 200
+        return _write(write)
 
     def delete(self, book_id: int):
         """
@@ -222,14 +936,23 @@ class BooksEdit(Resource):
             description: Good result
           404:
             description: No such book
+          412:
+            description: If-Match does not match the current ETag
         """
-        if get_book_by_id(book_id):
+        if_match = _if_match()
+
+        def write():
+            version = get_book_version(book_id)
+            if version is None:
+                return [{"error": "Книги с таким ID нет"}], 404
+            if _precondition_failed(version, if_match):
+                return [{"error": "Книга была изменена (ETag не совпадает)"}], 412
             delete_book_by_id(book_id)
             return [{"info": "Удаление прошло успешно"}], 200
-        else:
-            return [{"error": "Книги с таким ID нет"}], 404
 
-class AuthorsEdit(Resource):
+        return _write(write)
+
+class AuthorsEdit(LimitedResource):
 
     def get(self, author_id: int) -> tuple[list[dict], int]:
         """
@@ -247,14 +970,24 @@ class AuthorsEdit(Resource):
             schema:
               items:
                 $ref: '#/definitions/Author'
+          304:
+            description: Not modified (If-None-Match / If-Modified-Since)
           404:
             description: No such author
         """
 
-        schema = AuthorSchema()
-        res = get_author_by_id(author_id)
+        def load_author() -> Optional[Dict]:
+            res = get_author_by_id(author_id)
+            if res:
+                return dump(AuthorSchema, res)
+
+        version = get_author_version(author_id)
+        if version and _not_modified(version):
+            return None, 304, _etag_headers(version)
+        res = version and _cached(('author', author_id, version[0]), load_author,
+                                  lambda value: [author_tag(author_id)])
         if res:
-            return schema.dump(res), 200
+            return res, 200, _etag_headers(version)
         else:
             return [{"error": f"Автора с таким ID({author_id}) нет"}], 404
 
@@ -281,25 +1014,40 @@ class AuthorsEdit(Resource):
                 $ref: '#/definitions/Author'
           400:
             description: Error validation
+          404:
+            description: No such author
+          412:
+            description: If-Match does not match the current ETag
         """
 
         data = request.json
         schema = AuthorSchema()
-        try:
-            schema.load(data, many=False)
-        except ValidationError as exc:
-            return exc.messages, 400
+        if_match = _if_match()
+
+        def write():
+            try:
+                schema.load(data, many=False)
+            except ValidationError as exc:
+                return exc.messages, 400
 
-        auth = get_author_by_id(author_id)
-        author_new = Author(
-            first_name = data['first_name'],
-            last_name = data['last_name'],
-            middle_name = data['middle_name'],
-            id = auth['id']
-        )
+            version = get_author_version(author_id)
+            if version is None:
+                return [{"error": f"Автора с таким ID({author_id}) нет"}], 404
+            if _precondition_failed(version, if_match):
+                return [{"error": "Автор был изменён (ETag не совпадает)"}], 412
 
-        update_author_by_id(author_new)
-        return schema.dump(get_author_by_id(author_id)), 200
+            auth = get_author_by_id(author_id)
+            author_new = Author(
+                first_name = data['first_name'],
+                last_name = data['last_name'],
+                middle_name = data['middle_name'],
+                id = auth['id']
+            )
+
+            update_author_by_id(author_new)
+            return schema.dump(get_author_by_id(author_id)), 200, _etag_headers(get_author_version(author_id))
+
+        return _write(write)
 
     def delete(self, author_id: int):
         """
@@ -316,29 +1064,623 @@ class AuthorsEdit(Resource):
             description: Good result
           404:
             description: No such author
+          412:
+            description: If-Match does not match the current ETag
         """
-        if get_author_by_id(author_id):
+        if_match = _if_match()
+
+        def write():
+            version = get_author_version(author_id)
+            if version is None:
+                return [{"error": "Автора с таким ID нет"}], 404
+            if _precondition_failed(version, if_match):
+                return [{"error": "Автор был изменён (ETag не совпадает)"}], 412
             delete_author_by_id(author_id)
             return [{"info": "Удаление прошло успешно"}], 200
+
+        return _write(write)
+
+MAX_BULK_ITEMS = 100000
+
+
+class BulkPayloadError(Exception):
+    pass
+
+
+def _bulk_payload() -> list:
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        raise BulkPayloadError('Ожидается массив элементов')
+    if len(data) > MAX_BULK_ITEMS:
+        raise BulkPayloadError(f'Не больше {MAX_BULK_ITEMS} элементов за запрос')
+    return data
+
+
+def _bulk_load(schema, items: list, require_id: bool) -> Tuple[Dict[int, dict], List[Tuple[int, Any]]]:
+    """
+    Проверка типов каждого элемента пакета. Возвращает ошибки по индексам
+    и список (индекс, объект) прошедших проверку элементов.
+    """
+    results, valid = {}, []
+    for index, item in enumerate(items):
+        try:
+            obj = schema.load(item)
+        except ValidationError as exc:
+            results[index] = {"index": index, "status": 400, "errors": exc.messages}
+            continue
+        if require_id and obj.id is None:
+            results[index] = {"index": index, "status": 400, "errors": {"id": ["Не указан id"]}}
+        elif not require_id and obj.id is not None:
+            results[index] = {"index": index, "status": 400, "errors": {"id": ["id назначается базой"]}}
         else:
-            return [{"error": "Автора с таким ID нет"}], 404
+            valid.append((index, obj))
+    return results, valid
+
 
+def _bulk_ids(items: list) -> Tuple[Dict[int, dict], List[Tuple[int, int]]]:
+    results, valid = {}, []
+    for index, item in enumerate(items):
+        if isinstance(item, int) and not isinstance(item, bool):
+            valid.append((index, item))
+        else:
+            results[index] = {"index": index, "status": 400, "errors": {"id": ["Ожидается целый id"]}}
+    return results, valid
+
+
+def _bulk_response(results: Dict[int, dict], count: int) -> Tuple[Dict, int]:
+    return {"results": [results[index] for index in range(count)]}, 200
+
+
+class BooksBulk(LimitedResource):
+
+    def _check_authors(self, results: Dict[int, dict], valid: List[Tuple[int, Book]]) -> List[Tuple[int, Book]]:
+        existing = get_existing_author_ids({book.author for _, book in valid})
+        checked = []
+        for index, book in valid:
+            if book.author in existing:
+                checked.append((index, book))
+            else:
+                results[index] = {"index": index, "status": 400,
+                                  "errors": {"author": [f'Автора с таким id={book.author} не существует']}}
+        return checked
+
+    def post(self) -> Tuple[Dict, int]:
+        """
+        This is endpoint for batch book creation in a single transaction.
+        ---
+        tags:
+          - books
+        parameters:
+          - in: body
+            name: new books params
+            schema:
+              type: array
+              items:
+                $ref: '#/definitions/Book'
+        responses:
+          200:
+            description: Per-item results (status 201 with data or 400 with errors)
+          400:
+            description: Body is not an array
+        """
+        try:
+            items = _bulk_payload()
+        except BulkPayloadError as exc:
+            return [{"error": str(exc)}], 400
+        results, valid = _bulk_load(BookBulkSchema(), items, require_id=False)
+        # проверка существования и запись - одна транзакция: параллельное удаление
+        # не превратит отсутствующего автора в IntegrityError на весь пакет
+        with write_transaction():
+            valid = self._check_authors(results, valid)
+            add_books([book for _, book in valid])
+        schema = BookSchema()
+        for index, book in valid:
+            results[index] = {"index": index, "status": 201, "data": schema.dump(book)}
+        return _bulk_response(results, len(items))
+
+    def put(self) -> Tuple[Dict, int]:
+        """
+        This is endpoint for batch book update in a single transaction.
+        ---
+        tags:
+          - books
+        parameters:
+          - in: body
+            name: books params with id
+            schema:
+              type: array
+              items:
+                $ref: '#/definitions/Book'
+        responses:
+          200:
+            description: Per-item results (status 200, 400 or 404)
+          400:
+            description: Body is not an array
+        """
+        try:
+            items = _bulk_payload()
+        except BulkPayloadError as exc:
+            return [{"error": str(exc)}], 400
+        results, valid = _bulk_load(BookBulkSchema(), items, require_id=True)
+        with write_transaction():
+            existing = get_existing_book_ids({book.id for _, book in valid})
+            for index, book in valid:
+                if book.id not in existing:
+                    results[index] = {"index": index, "status": 404,
+                                      "errors": {"id": [f"Книги с таким ID({book.id}) нет"]}}
+            valid = self._check_authors(results, [(i, book) for i, book in valid if book.id in existing])
+            update_books([book for _, book in valid])
+        schema = BookBulkSchema()
+        for index, book in valid:
+            results[index] = {"index": index, "status": 200, "data": schema.dump(book)}
+        return _bulk_response(results, len(items))
+
+    def delete(self) -> Tuple[Dict, int]:
+        """
+        This is endpoint for batch book deletion in a single transaction.
+        ---
+        tags:
+          - books
+        parameters:
+          - in: body
+            name: book ids
+            schema:
+              type: array
+              items:
+                type: integer
+        responses:
+          200:
+            description: Per-item results (status 200, 400 or 404)
+          400:
+            description: Body is not an array
+        """
+        try:
+            items = _bulk_payload()
+        except BulkPayloadError as exc:
+            return [{"error": str(exc)}], 400
+        results, valid = _bulk_ids(items)
+        with write_transaction():
+            existing = get_existing_book_ids({book_id for _, book_id in valid})
+            delete_books(list(existing))
+        for index, book_id in valid:
+            if book_id in existing:
+                results[index] = {"index": index, "status": 200, "data": {"id": book_id}}
+            else:
+                results[index] = {"index": index, "status": 404, "errors": {"id": [f"Книги с таким ID({book_id}) нет"]}}
+        return _bulk_response(results, len(items))
+
+class AuthorsBulk(LimitedResource):
+
+    def post(self) -> Tuple[Dict, int]:
+        """
+        This is endpoint for batch author creation in a single transaction.
+        ---
+        tags:
+          - authors
+        parameters:
+          - in: body
+            name: new authors params
+            schema:
+              type: array
+              items:
+                $ref: '#/definitions/Author'
+        responses:
+          200:
+            description: Per-item results (status 201 with data or 400 with errors)
+          400:
+            description: Body is not an array
+        """
+        try:
+            items = _bulk_payload()
+        except BulkPayloadError as exc:
+            return [{"error": str(exc)}], 400
+        results, valid = _bulk_load(AuthorBulkSchema(), items, require_id=False)
+        checked = []
+        with write_transaction():
+            seen = get_existing_author_names({(author.first_name, author.last_name) for _, author in valid})
+            for index, author in valid:
+                name = (author.first_name, author.last_name)
+                if name in seen:
+                    results[index] = {"index": index, "status": 400, "errors": {"_schema": ['Такой автор уже есть в базе']}}
+                else:
+                    seen.add(name)
+                    checked.append((index, author))
+            add_authors([author for _, author in checked])
+        schema = AuthorBulkSchema()
+        for index, author in checked:
+            results[index] = {"index": index, "status": 201, "data": schema.dump(author)}
+        return _bulk_response(results, len(items))
+
+    def put(self) -> Tuple[Dict, int]:
+        """
+        This is endpoint for batch author update in a single transaction.
+        ---
+        tags:
+          - authors
+        parameters:
+          - in: body
+            name: authors params with id
+            schema:
+              type: array
+              items:
+                $ref: '#/definitions/Author'
+        responses:
+          200:
+            description: Per-item results (status 200, 400 or 404)
+          400:
+            description: Body is not an array
+        """
+        try:
+            items = _bulk_payload()
+        except BulkPayloadError as exc:
+            return [{"error": str(exc)}], 400
+        results, valid = _bulk_load(AuthorBulkSchema(), items, require_id=True)
+        with write_transaction():
+            existing = get_existing_author_ids({author.id for _, author in valid})
+            for index, author in valid:
+                if author.id not in existing:
+                    results[index] = {"index": index, "status": 404,
+                                      "errors": {"id": [f"Автора с таким ID({author.id}) нет"]}}
+            valid = [(index, author) for index, author in valid if author.id in existing]
+            update_authors([author for _, author in valid])
+        schema = AuthorBulkSchema()
+        for index, author in valid:
+            results[index] = {"index": index, "status": 200, "data": schema.dump(author)}
+        return _bulk_response(results, len(items))
+
+    def delete(self) -> Tuple[Dict, int]:
+        """
+        This is endpoint for batch author deletion (with their books) in a single transaction.
+        ---
+        tags:
+          - authors
+        parameters:
+          - in: body
+            name: author ids
+            schema:
+              type: array
+              items:
+                type: integer
+        responses:
+          200:
+            description: Per-item results (status 200, 400 or 404)
+          400:
+            description: Body is not an array
+        """
+        try:
+            items = _bulk_payload()
+        except BulkPayloadError as exc:
+            return [{"error": str(exc)}], 400
+        results, valid = _bulk_ids(items)
+        with write_transaction():
+            existing = get_existing_author_ids({author_id for _, author_id in valid})
+            delete_authors(list(existing))
+        for index, author_id in valid:
+            if author_id in existing:
+                results[index] = {"index": index, "status": 200, "data": {"id": author_id}}
+            else:
+                results[index] = {"index": index, "status": 404,
+                                  "errors": {"id": [f"Автора с таким ID({author_id}) нет"]}}
+        return _bulk_response(results, len(items))
+
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+SEARCH_TYPES = ('all', 'books', 'authors')
+
+
+class SearchResource(BaseResource):
+
+    def get(self) -> Tuple[Dict, int, Dict]:
+        """
+        This is endpoint for full-text search of books and authors.
+        ---
+        tags:
+          - search
+        parameters:
+          - in: query
+            name: q
+            type: string
+            required: true
+            description: Words to find (title or author name); each word matches by prefix
+          - in: query
+            name: type
+            type: string
+            enum: [all, books, authors]
+            description: What to search (default all)
+          - in: query
+            name: limit
+            type: integer
+            description: Max results of each type (1-100, default 20)
+        responses:
+          200:
+            description: Books and authors ranked by relevance, with highlighted snippets
+          304:
+            description: Not modified (If-None-Match / If-Modified-Since)
+          400:
+            description: Empty query or wrong params
+        """
+        query = request.args.get('q', '').strip()
+        search_type = request.args.get('type', 'all')
+        limit = request.args.get('limit', SEARCH_DEFAULT_LIMIT, type=int)
+        if not query:
+            return [{"error": "Введите строку поиска (q)"}], 400
+        if search_type not in SEARCH_TYPES:
+            return [{"error": f"Неизвестный тип поиска: {search_type}"}], 400
+        if not 1 <= limit <= SEARCH_MAX_LIMIT:
+            return [{"error": f"limit должен быть от 1 до {SEARCH_MAX_LIMIT}"}], 400
+
+        def load_results() -> Dict[str, List[Dict]]:
+            results = {}
+            if search_type in ('all', 'books'):
+                dump_book = get_dumper(BookListSchema)
+                results['books'] = [dict(dump_book(book), snippet=snippet)
+                                    for book, snippet in search_books(query, limit)]
+            if search_type in ('all', 'authors'):
+                dump_author = get_dumper(AuthorSchema)
+                results['authors'] = [dict(dump_author(author), snippet=snippet)
+                                      for author, snippet in search_authors(query, limit)]
+            return results
+
+        version = get_tables_version(BOOKS_TABLE_NAME, AUTHORS_TABLE_NAME)
+        if _not_modified(version):
+            return None, 304, _etag_headers(version)
+        # имя автора есть и в результатах по книгам, поэтому сбрасывается любыми записями
+        results = _cached(('search', request.query_string, version[0]), load_results,
+                          lambda value: [BOOK_LISTS_TAG, AUTHOR_LISTS_TAG])
+        return results, 200, _etag_headers(version)
+
+CHANGES_DEFAULT_LIMIT = 100
+# дольше долгий опрос не держит поток сервера
+CHANGES_MAX_WAIT = 30
+# комментарий в потоке SSE, чтобы прокси не закрывали простаивающее соединение
+SSE_HEARTBEAT = 15
+EVENT_STREAM_MIMETYPE = 'text/event-stream'
+CHANGE_ITEM_TYPES = {BOOKS_TABLE_NAME: 'book', AUTHORS_TABLE_NAME: 'author'}
+
+
+class ChangesArgsError(ValueError):
+    pass
+
+
+def _change_args() -> Tuple[int, int, float]:
+    # в SSE клиент после переподключения сам присылает номер последнего события
+    since = request.headers.get('Last-Event-ID') or request.args.get('since', '0')
+    limit = request.args.get('limit', str(CHANGES_DEFAULT_LIMIT))
+    wait = request.args.get('wait', '0')
+    try:
+        since, limit, wait = int(since), int(limit), float(wait)
+    except ValueError:
+        raise ChangesArgsError('since и limit - целые числа, wait - число секунд')
+    if since < 0:
+        raise ChangesArgsError('since не может быть отрицательным')
+    if not 1 <= limit <= MAX_PAGE_LIMIT:
+        raise ChangesArgsError(f'limit должен быть от 1 до {MAX_PAGE_LIMIT}')
+    if not 0 <= wait <= CHANGES_MAX_WAIT:
+        raise ChangesArgsError(f'wait должен быть от 0 до {CHANGES_MAX_WAIT} секунд')
+    return since, limit, wait
+
+
+def _dump_change(change: Change) -> Dict:
+    item = None
+    if isinstance(change.item, Book):
+        item = dump(BookListSchema, change.item)
+    elif isinstance(change.item, Author):
+        item = dump(AuthorSchema, change.item)
+    return {'seq': change.seq, 'type': CHANGE_ITEM_TYPES[change.table], 'id': change.id, 'op': change.op,
+            'item': item}
+
+
+def _change_events(since: int, limit: int) -> Iterator[str]:
+    while True:
+        changes = get_changes(since, limit)
+        for change in changes:
+            data = json.dumps(_dump_change(change), ensure_ascii=False)
+            yield f'id: {change.seq}\nevent: change\ndata: {data}\n\n'
+        if changes:
+            since = changes[-1].seq
+        elif not wait_for_changes(since, SSE_HEARTBEAT):
+            yield ': keep-alive\n\n'
+
+
+def _wants_event_stream() -> bool:
+    return request.accept_mimetypes.best == EVENT_STREAM_MIMETYPE
+
+
+def stream_admitted(method: Callable) -> Callable:
+    """
+    Как admitted, но бесконечный поток SSE занимает место в своём лимите
+    (BOOKS_MAX_STREAMS), а не в общем: подписчики не вытесняют остальные запросы.
+    """
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        if not admission.enabled:
+            return method(*args, **kwargs)
+        return _admit(STREAM if _wants_event_stream() else READ, lambda: method(*args, **kwargs))
+    return wrapper
+
+
+class ChangesResource(BaseResource):
+    method_decorators = BaseResource.method_decorators + [stream_admitted]
+
+    def get(self) -> Tuple[List[Dict], int, Dict]:
+        """
+        This is endpoint for incremental sync: changes of books and authors after a sequence number.
+        ---
+        tags:
+          - changes
+        parameters:
+          - in: query
+            name: since
+            type: integer
+            description: Last seq the client has applied (default 0 - the whole catalog as inserts)
+          - in: query
+            name: limit
+            type: integer
+            description: Page size (1-1000, default 100)
+          - in: query
+            name: wait
+            type: number
+            description: Long polling - seconds to wait for changes when there are none yet (0-30, default 0)
+          - in: header
+            name: Last-Event-ID
+            type: integer
+            description: Replaces since (Server-Sent Events reconnect)
+        produces:
+          - application/json
+          - text/event-stream
+        responses:
+          200:
+            description: >
+              Changes in seq order - type (book / author), id, op (insert / update / delete) and the
+              current item (null once deleted). X-Last-Seq is the seq to pass next time, the Link header
+              points to the next page. With Accept text/event-stream - an endless stream of change events.
+          400:
+            description: Wrong since, limit or wait
+          410:
+            description: Deletes after since have been pruned from the log - sync again from since=0
+        """
+        try:
+            since, limit, wait = _change_args()
+        except ChangesArgsError as exc:
+            return [{"error": str(exc)}], 400
+        # журнал хранит удаления BOOKS_CHANGES_RETENTION секунд (models.prune_changes)
+        horizon = get_changes_horizon()
+        if 0 < since < horizon:
+            return [{"error": f"Изменения до seq {horizon} очищены, нужна полная синхронизация с since=0"}], 410
+        if _wants_event_stream():
+            return Response(stream_with_context(_change_events(since, limit)), mimetype=EVENT_STREAM_MIMETYPE,
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+        changes = get_changes(since, limit)
+        if not changes and wait and wait_for_changes(since, wait):
+            changes = get_changes(since, limit)
+        last_seq = changes[-1].seq if changes else since
+        headers = {'X-Last-Seq': str(last_seq), 'Cache-Control': 'no-cache'}
+        if len(changes) == limit:
+            args = dict(request.args.to_dict(), since=last_seq)
+            headers['Link'] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+        return [_dump_change(change) for change in changes], 200, headers
+
+
+class AuthorStatsResource(BaseResource):
+
+    def get(self) -> Tuple[List[Dict], int, Dict]:
+        """
+        This is endpoint for obtaining book counts per author, top authors first.
+        ---
+        tags:
+          - stats
+        parameters:
+          - in: query
+            name: limit
+            type: integer
+            description: Page size (1-1000, default 100)
+          - in: query
+            name: after
+            type: string
+            description: Cursor from the X-Next-Cursor header of the previous page
+          - in: query
+            name: sort
+            type: string
+            description: books_count or id; prefix with '-' for descending order (default -books_count)
+        responses:
+          200:
+            description: Authors with books_count, next page link in the Link header
+          304:
+            description: Not modified (If-None-Match / If-Modified-Since)
+          400:
+            description: Wrong pagination params
+        """
+        # счётчики ведут триггеры (migrations._author_stats_schema_sql): чтение - O(страницы), а не каталога
+        args = dict(request.args.items())
+        args.setdefault('sort', '-books_count')
+        try:
+            page = parse_page_args(AUTHOR_STATS_SORT_FIELDS, args)
+        except PageArgsError as exc:
+            return [{"error": str(exc)}], 400
+
+        def load_page() -> Tuple[List[Dict], Dict]:
+            stats = get_author_stats_page(**page)
+            return dump_many(AuthorStatsSchema, stats), _page_headers(stats, page['limit'],
+                                                                      lambda item: item[page['sort']])
+
+        version = get_tables_version(AUTHORS_TABLE_NAME, BOOKS_TABLE_NAME)
+        if _not_modified(version):
+            return None, 304, _etag_headers(version)
+        stats_data, headers = _cached(('author_stats', request.query_string, version[0]), load_page,
+                                      lambda value: [AUTHOR_LISTS_TAG, BOOK_LISTS_TAG])
+        return stats_data, 200, dict(headers, **_etag_headers(version))
+
+
+class PoolStats(BaseResource):
+
+    def get(self) -> Tuple[Dict, int]:
+        """
+        This is endpoint for obtaining the database connection pool stats.
+        ---
+        tags:
+          - stats
+        responses:
+          200:
+            description: Pool size and wait-time counters, read replica pools and their data versions,
+              group commit batch counters (null when BOOKS_GROUP_COMMIT is off)
+        """
+        return dict(pool.stats(), replicas=router.stats(), group_commit=writer.stats() if writer else None), 200
+
+class CacheStats(BaseResource):
+
+    def get(self) -> Tuple[Dict, int]:
+        """
+        This is endpoint for obtaining the response cache counters.
+        ---
+        tags:
+          - stats
+        responses:
+          200:
+            description: Hit/miss/eviction counters and cache size
+        """
+        return get_cache().stats(), 200
+
+
+class Metrics(BaseResource):
+
+    def get(self) -> Response:
+        """
+        This is endpoint for Prometheus metrics.
+        ---
+        tags:
+          - stats
+        produces:
+          - text/plain
+        responses:
+          200:
+            description: Request, resource, SQL query and schema duration histograms; pool and cache state
+        """
+        return Response(render(), mimetype='text/plain; version=0.0.4')
 
-template = spec.to_flasgger(
-    app,
-    definitions=[AuthorSchema, BookListSchema, BookSchema],
-)
 
-swagger = Swagger(app, template=template)
+# /apispec_1.json и /apidocs/; flasgger и apispec импортируются при первом обращении
+openapi.register(app)
 
 api.add_resource(BooksResource, '/api/books')
+api.add_resource(BooksExport, '/api/books/export')
+api.add_resource(BooksBulk, '/api/books/bulk')
+api.add_resource(AuthorsBulk, '/api/authors/bulk')
 api.add_resource(AuthorsResource, '/api/authors')
 api.add_resource(BooksEdit, '/api/books/<int:book_id>')
 api.add_resource(AuthorsEdit, '/api/authors/<int:author_id>')
+api.add_resource(AuthorBooks, '/api/authors/<int:author_id>/books')
+api.add_resource(SearchResource, '/api/search')
+api.add_resource(ChangesResource, '/api/changes')
+api.add_resource(AuthorStatsResource, '/api/stats/authors')
+api.add_resource(PoolStats, '/api/stats/pool')
+api.add_resource(CacheStats, '/api/stats/cache')
+api.add_resource(Metrics, '/metrics')
 
 
 if __name__ == "__main__":
-    if os.path.exists('table_books.db'):
-        os.remove('table_books.db')
-    init_db()
+    # сервер разработки (debugger, reloader); боевой запуск - python server.py
+    migrate()
+    if REPLICA_REFRESH > 0:
+        router.start_refresh(REPLICA_REFRESH)
     app.run(debug=True)
@@ -1,10 +1,24 @@
-from typing import Optional
-from marshmallow import validates, post_load, pre_load
+from typing import Dict, Optional
+from marshmallow import Schema, ValidationError, fields, validate, validates, post_load, pre_load
 from models import get_book_by_title, Book, Author, get_author_by_id, get_author_by_name, get_book_by_id
-from flasgger import Schema, ValidationError, fields
+from metrics import SCHEMA_SECONDS, timer
 
 
-class AuthorSchema(Schema):
+class TimedSchema(Schema):
+    """
+    Схема с замером load / dump (включая pre_load и validates-хуки) для /metrics.
+    """
+
+    def load(self, *args, **kwargs):
+        with timer(SCHEMA_SECONDS, type(self).__name__, 'load'):
+            return super().load(*args, **kwargs)
+
+    def dump(self, *args, **kwargs):
+        with timer(SCHEMA_SECONDS, type(self).__name__, 'dump'):
+            return super().dump(*args, **kwargs)
+
+
+class AuthorSchema(TimedSchema):
     id = fields.Int(dump_only=True)
     first_name = fields.Str(required=True)
     last_name = fields.Str(required=True)
@@ -36,13 +50,30 @@ class AuthorSchema(Schema):
         else:
             return data
 
-class BookSchema(Schema):
+class AuthorBulkSchema(AuthorSchema):
+    """
+    Автор в пакетном запросе: проверка дубликатов делается одним запросом
+    на весь пакет, поэтому pre_load отключён (переопределён без декоратора).
+    """
+    id = fields.Int()
+    middle_name = fields.Str(load_default='')
+
+    def pre_create_author(self, data, **kwargs):
+        return data
+
+class BookSchema(TimedSchema):
 
     id = fields.Int(dump_only=True)
     title = fields.Str(required=True)
     author = fields.Int(required=True)
     # author = fields.Nested(AuthorSchema(), required=True)
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # авторы, найденные в pre_load: схема создаётся на запрос,
+        # поэтому повторная проверка в validate_author не ходит в базу
+        self.resolved_authors: Dict[int, Author] = {}
+
     # @validates('title')
     # def validate_title(self, title: str) -> None:
     #     if get_book_by_title(title):
@@ -51,7 +82,7 @@ class BookSchema(Schema):
     @validates('author')
     def validate_author(self, author: Optional[int]) -> None:
         if isinstance(author, int):
-            if not get_author_by_id(author):
+            if author not in self.resolved_authors and not get_author_by_id(author):
                 raise ValidationError(f'Автора с таким id={author} не существует')
         elif isinstance(author, dict):
             if not author.get('first_name'):
@@ -62,16 +93,19 @@ class BookSchema(Schema):
 
     @pre_load
     def pre_create_book(self, data, **kwargs) -> Book:
-        if isinstance(data['author'], int):
-            auth = get_author_by_id(data['author'])
+        author = data.get('author')
+        if isinstance(author, int):
+            auth = get_author_by_id(author)
             if not auth:
-                raise ValidationError(f'Нет автора с таким id={data['author']}!')
-        elif isinstance(data['author'], dict):
-            if not data['author'].get('first_name') or not data['author'].get('last_name'):
+                raise ValidationError(f'Нет автора с таким id={author}!')
+            self.resolved_authors[auth.id] = auth
+        elif isinstance(author, dict):
+            if not author.get('first_name') or not author.get('last_name'):
                 raise ValidationError(f'Введите в запросе имя и фамилию автора (first_name, last_name)')
             else:
-                auth = get_author_by_name(data['author'])
+                auth = get_author_by_name(author)
                 if auth:
+                    self.resolved_authors[auth.id] = auth
                     data['author'] = auth.id
                 else:
                     raise ValidationError(f'Нет автора с таким именем и фамилией, '
@@ -84,7 +118,20 @@ class BookSchema(Schema):
     def post_create_book(self, data, **kwargs) -> Book:
         return Book(**data)
 
-class BookListSchema(Schema):
+class BookBulkSchema(TimedSchema):
+    """
+    Книга в пакетном запросе: существование авторов проверяется
+    одним запросом на весь пакет, поэтому здесь только типы полей.
+    """
+    id = fields.Int()
+    title = fields.Str(required=True, validate=validate.Length(min=1, error='! Проверьте название книги'))
+    author = fields.Int(required=True, strict=True)
+
+    @post_load
+    def post_create_book(self, data, **kwargs) -> Book:
+        return Book(**data)
+
+class BookListSchema(TimedSchema):
     id = fields.Int(dump_only=True)
     title = fields.Str(required=True)
     author = fields.Nested(AuthorSchema(), required=True)
@@ -96,6 +143,25 @@ class BookListSchema(Schema):
     #     if not get_book_by_id(book_id):
     #         raise ValidationError(f'Нет книги с таким id={book_id}')
 
+class BookRefSchema(TimedSchema):
+    """
+    Книга с автором-ссылкой (без ?expand=author): вместо вложенного автора - его id.
+    """
+    id = fields.Int(dump_only=True)
+    title = fields.Str(required=True)
+    author = fields.Int(required=True)
+
+class AuthorBookSchema(TimedSchema):
+    # книга во вложенном списке автора: автор уже известен
+    id = fields.Int(dump_only=True)
+    title = fields.Str(required=True)
+
+class AuthorBooksSchema(AuthorSchema):
+    books = fields.Nested(AuthorBookSchema, many=True, dump_only=True)
+
+class AuthorStatsSchema(AuthorSchema):
+    books_count = fields.Int(dump_only=True)
+
 # class BookEditSchema(Schema):
 #     id = fields.Int(required=True)
 #
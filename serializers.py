@@ -0,0 +1,140 @@
+"""
+Быстрая сериализация для путей чтения.
+
+По описанию полей marshmallow-схемы один раз генерируется специализированная
+функция dump (обычный python-код без обхода полей и хуков в рантайме).
+Результат совпадает с Schema().dump(), поэтому JSON ответа не меняется.
+Поля неизвестных типов сериализуются самим marshmallow-полем.
+
+Для потоковых выгрузок есть вариант, который берёт значения прямо из строки
+курсора (get_row_dumper) и не создаёт объектов моделей.
+"""
+import keyword
+from typing import AbstractSet, Any, Callable, Dict, Iterable, List, Optional, Tuple, Type
+
+from marshmallow import Schema, fields
+from marshmallow.utils import ensure_text_type
+
+from metrics import SCHEMA_SECONDS, timer
+
+# (схема, набор полей only) -> функция; набор None - все поля
+_dumpers: Dict[Tuple[Type[Schema], Optional[frozenset]], Callable[[Any], dict]] = {}
+# (схема, колонки строки) -> функция от кортежа
+_row_dumpers: Dict[Tuple[Type[Schema], Tuple[str, ...]], Callable[[tuple], dict]] = {}
+
+# типы полей, для которых код генерируется напрямую
+_SIMPLE_FIELDS = (
+    (fields.Integer, 'int'),
+    (fields.String, 'ensure_text_type'),
+)
+
+
+def _is_plain_attribute(name: str) -> bool:
+    return name.isidentifier() and not keyword.iskeyword(name)
+
+
+def _field_expression(field: fields.Field, value: str, namespace: Dict[str, Any], index: int) -> str:
+    """
+    Выражение, сериализующее значение value так же, как field._serialize.
+    """
+    if isinstance(field, fields.Nested) and not field.only and not field.exclude and isinstance(field.schema, Schema):
+        nested = f'_nested_{index}'
+        namespace[nested] = get_dumper(type(field.schema))
+        if field.many or field.schema.many:
+            return f'None if {value} is None else [{nested}(item) for item in {value}]'
+        return f'None if {value} is None else {nested}({value})'
+    for field_type, function in _SIMPLE_FIELDS:
+        # as_string / strict / подклассы с другим поведением сериализуем полем
+        if type(field) is field_type and not getattr(field, 'as_string', False):
+            return f'None if {value} is None else {function}({value})'
+    name = f'_field_{index}'
+    namespace[name] = field
+    return f'{name}._serialize({value}, None, obj)'
+
+
+def _compile(schema_cls: Type[Schema], only: Optional[frozenset] = None) -> Callable[[Any], dict]:
+    schema = schema_cls(only=only)
+    namespace: Dict[str, Any] = {'ensure_text_type': ensure_text_type}
+    lines, items = [], []
+    # порядок ключей - как в объявлении схемы, независимо от порядка в only
+    dump_fields = sorted(schema.dump_fields.items(), key=lambda item: list(schema.declared_fields).index(item[0]))
+    for index, (name, field) in enumerate(dump_fields):
+        attribute = field.attribute or name
+        key = field.data_key or name
+        value = f'_v{index}'
+        if _is_plain_attribute(attribute):
+            lines.append(f'    {value} = obj.{attribute}')
+            items.append(f'{key!r}: {_field_expression(field, value, namespace, index)}')
+        else:
+            field_name = f'_serialize_{index}'
+            namespace[field_name] = field
+            lines.append(f'    {value} = {field_name}.serialize({attribute!r}, obj)')
+            items.append(f'{key!r}: {value}')
+    function_name = f'dump_{schema_cls.__name__}'
+    source = f'def {function_name}(obj):\n' + '\n'.join(lines) + '\n    return {' + ', '.join(items) + '}\n'
+    exec(compile(source, f'<serializer {schema_cls.__name__}>', 'exec'), namespace)
+    return namespace[function_name]
+
+
+def _row_items(schema: Schema, columns: Tuple[str, ...], prefix: str, namespace: Dict[str, Any]) -> str:
+    items = []
+    for name, field in schema.dump_fields.items():
+        attribute = prefix + (field.attribute or name)
+        key = field.data_key or name
+        if isinstance(field, fields.Nested) and not field.many and isinstance(field.schema, Schema):
+            items.append(f'{key!r}: ' + _row_items(field.schema, columns, attribute + '.', namespace))
+            continue
+        if attribute not in columns:
+            raise ValueError(f'Нет колонки {attribute} для поля {key}')
+        value = f'obj[{columns.index(attribute)}]'
+        index = len(namespace)
+        items.append(f'{key!r}: {_field_expression(field, value, namespace, index)}')
+    return '{' + ', '.join(items) + '}'
+
+
+def _compile_row(schema_cls: Type[Schema], columns: Tuple[str, ...]) -> Callable[[tuple], dict]:
+    namespace: Dict[str, Any] = {'ensure_text_type': ensure_text_type}
+    function_name = f'dump_row_{schema_cls.__name__}'
+    source = f'def {function_name}(obj):\n    return {_row_items(schema_cls(), columns, "", namespace)}\n'
+    exec(compile(source, f'<row serializer {schema_cls.__name__}>', 'exec'), namespace)
+    return namespace[function_name]
+
+
+def get_row_dumper(schema_cls: Type[Schema], columns: Tuple[str, ...]) -> Callable[[tuple], dict]:
+    """
+    Сериализатор строки курсора: columns - путь атрибута для каждой колонки
+    ('id', 'author.first_name', ...), вложенные схемы собираются из тех же колонок.
+    """
+    key = (schema_cls, tuple(columns))
+    dumper = _row_dumpers.get(key)
+    if dumper is None:
+        dumper = _row_dumpers[key] = _compile_row(*key)
+    return dumper
+
+
+def get_dumper(schema_cls: Type[Schema], only: Optional[AbstractSet[str]] = None) -> Callable[[Any], dict]:
+    """
+    only - sparse fieldset (?fields=): для каждого набора полей генерируется своя функция.
+    """
+    key = (schema_cls, None if only is None else frozenset(only))
+    dumper = _dumpers.get(key)
+    if dumper is None:
+        dumper = _dumpers[key] = _compile(*key)
+    return dumper
+
+
+def compile_dumpers(*schema_classes: Type[Schema]) -> None:
+    # вызывается при старте приложения, чтобы не генерировать код в запросе
+    for schema_cls in schema_classes:
+        get_dumper(schema_cls)
+
+
+def dump(schema_cls: Type[Schema], obj: Any, only: Optional[AbstractSet[str]] = None) -> dict:
+    with timer(SCHEMA_SECONDS, schema_cls.__name__, 'dump'):
+        return get_dumper(schema_cls, only)(obj)
+
+
+def dump_many(schema_cls: Type[Schema], objs: Iterable[Any], only: Optional[AbstractSet[str]] = None) -> List[dict]:
+    dumper = get_dumper(schema_cls, only)
+    with timer(SCHEMA_SECONDS, schema_cls.__name__, 'dump'):
+        return [dumper(obj) for obj in objs]
@@ -0,0 +1,216 @@
+"""
+Боевой запуск API: заранее форкнутые процессы-воркеры без общего состояния.
+
+    python server.py [--bind 0.0.0.0:5000] [--workers N]
+
+Родитель один раз применяет миграции и строит спецификацию Swagger (воркеры
+получают её готовой через fork), открывает слушающий сокет и запускает
+N воркеров (по умолчанию - число CPU). Каждый воркер - многопоточный WSGI-сервер
+werkzeug на общем сокете со своими соединениями sqlite (db.py сбрасывает пулы
+после fork), своим кэшем ответов и своими метриками /metrics.
+С репликами (BOOKS_REPLICA_REFRESH) их обновляет один отдельный процесс.
+
+Сигналы родителю:
+- SIGTERM / SIGINT - мягкая остановка: воркеры перестают принимать соединения
+  и дорабатывают текущие запросы (не дольше GRACEFUL_TIMEOUT);
+- SIGHUP - мягкая перезагрузка: старые воркеры заменяются новыми по очереди,
+  сокет не закрывается, и запросы не теряются.
+Упавший воркер перезапускается.
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from werkzeug.serving import make_server
+
+WORKERS = int(os.environ.get('BOOKS_WORKERS', '0')) or os.cpu_count() or 1
+# столько секунд воркер дорабатывает запросы после SIGTERM, потом получает SIGKILL
+GRACEFUL_TIMEOUT = float(os.environ.get('BOOKS_GRACEFUL_TIMEOUT', '30'))
+LISTEN_BACKLOG = 2048
+
+
+def _parse_bind(bind: str) -> tuple:
+    host, _, port = bind.rpartition(':')
+    return host or '0.0.0.0', int(port)
+
+
+def _listen(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(LISTEN_BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _prepare() -> None:
+    """
+    Всё, что делается один раз до fork: схема, спецификация Swagger, сериализаторы
+    (компилируются при импорте routes). Соединения закрываются, чтобы ни одно
+    не попало в дочерние процессы.
+    """
+    import openapi
+    from db import close_connections
+    from migrations import migrate
+    from routes import app
+
+    migrate()
+    # готовый swagger.json или сборка из docstring-ов - один раз, а не в каждом воркере
+    openapi.get_spec(app)
+    close_connections()
+
+
+def _serve(sock: socket.socket, host: str, port: int) -> None:
+    from routes import app
+
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    # сокет общий: соединение мог принять другой воркер, accept не должен блокировать
+    server.socket.setblocking(False)
+    # при остановке дождаться потоков с текущими запросами
+    server.daemon_threads = False
+    server.block_on_close = True
+
+    def stop(signum, frame):
+        # shutdown() ждёт выхода из serve_forever, поэтому - из другого потока
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    server.serve_forever()
+    server.server_close()
+
+
+def _refresh_replicas(interval: float) -> None:
+    from db import router
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    while True:
+        router.refresh_replicas()
+        time.sleep(interval)
+
+
+class Arbiter:
+    """
+    Родительский процесс: держит сокет, следит за числом воркеров, принимает сигналы.
+    Сам запросы не обслуживает и потоков не запускает (fork из многопоточного
+    процесса мог бы унести в дочерний захваченные блокировки).
+    """
+
+    def __init__(self, sock: socket.socket, host: str, port: int, workers: int, replica_refresh: float):
+        self.sock = sock
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.replica_refresh = replica_refresh
+        self.children: Dict[int, str] = {}
+        self._signals: List[int] = []
+
+    def _fork(self, role: str) -> int:
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            code = 0
+            try:
+                if role == 'worker':
+                    _serve(self.sock, self.host, self.port)
+                else:
+                    _refresh_replicas(self.replica_refresh)
+            except SystemExit as exc:
+                code = exc.code or 0
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = role
+        return pid
+
+    def _workers(self) -> List[int]:
+        return [pid for pid, role in self.children.items() if role == 'worker']
+
+    def _stop(self, pids: List[int]) -> None:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT
+        while any(pid in self.children for pid in pids):
+            if time.monotonic() > deadline:
+                for pid in pids:
+                    if pid in self.children:
+                        os.kill(pid, signal.SIGKILL)
+                deadline = float('inf')
+            self._reap(respawn=False)
+            time.sleep(0.05)
+
+    def _reap(self, respawn: bool = True) -> None:
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            role = self.children.pop(pid, None)
+            if role is not None and respawn:
+                print(f'[server] {role} {pid} exited ({status}), restarting', file=sys.stderr)
+                self._fork(role)
+
+    def _reload(self) -> None:
+        # новые воркеры стартуют до остановки старых: сокет всё время кто-то слушает
+        old = self._workers()
+        for _ in range(self.workers):
+            self._fork('worker')
+        self._stop(old)
+        print(f'[server] reloaded {len(old)} -> {self.workers} workers', file=sys.stderr)
+
+    def run(self) -> None:
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(signum, lambda signum, frame: self._signals.append(signum))
+        for _ in range(self.workers):
+            self._fork('worker')
+        if self.replica_refresh > 0:
+            self._fork('replicas')
+        print(f'[server] {self.workers} workers on {self.host}:{self.port}', file=sys.stderr)
+        while True:
+            # сигнал только кладётся в очередь; sleep короткий, чтобы не ждать следующего
+            time.sleep(0.5)
+            while self._signals:
+                signum = self._signals.pop(0)
+                if signum in (signal.SIGTERM, signal.SIGINT):
+                    self._stop(list(self.children))
+                    return
+                if signum == signal.SIGHUP:
+                    self._reload()
+            self._reap()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Pre-fork production server')
+    parser.add_argument('--bind', default=os.environ.get('BOOKS_BIND', '127.0.0.1:5000'))
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    args = parser.parse_args(argv)
+
+    from db import REPLICA_REFRESH
+
+    host, port = _parse_bind(args.bind)
+    _prepare()
+    sock = _listen(host, port)
+    try:
+        Arbiter(sock, host, port, max(1, args.workers), REPLICA_REFRESH).run()
+    finally:
+        sock.close()
+
+
+if __name__ == '__main__':
+    main()
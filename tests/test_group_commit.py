@@ -0,0 +1,33 @@
+import sqlite3
+
+import pytest
+
+from db import ConnectionPool, GroupCommitWriter, PoolTimeout
+
+
+class LockedConnection(sqlite3.Connection):
+    # как будто другой процесс держит блокировку записи дольше busy_timeout
+    def execute(self, sql, *args):
+        if sql == 'BEGIN IMMEDIATE':
+            raise sqlite3.OperationalError('database is locked')
+        return super().execute(sql, *args)
+
+
+def test_failed_begin_fails_every_write_in_batch(tmp_path):
+    writer = GroupCommitWriter(ConnectionPool(str(tmp_path / 'books.db'), factory=LockedConnection))
+    try:
+        futures = [writer.submit(lambda: 1) for _ in range(3)]
+        for future in futures:
+            with pytest.raises(sqlite3.OperationalError):
+                future.result(timeout=5)
+    finally:
+        writer.stop()
+
+
+def test_run_gives_up_on_write_left_in_queue(tmp_path):
+    writer = GroupCommitWriter(ConnectionPool(str(tmp_path / 'books.db')))
+    # писатель не запущен: запись так и остаётся в очереди
+    writer.start = lambda: None
+    with pytest.raises(PoolTimeout):
+        writer.run(lambda: 1, timeout=0.1)
+    assert writer.stats()['queued'] == 1
@@ -0,0 +1,17 @@
+import pytest
+
+from ratelimit import READ, STREAM, Admission, AdmissionRejected, MemoryBucketStore
+
+
+def test_streams_do_not_take_total_slots():
+    admission = Admission(MemoryBucketStore(), {READ: None}, max_concurrency=1, max_streams=1)
+    with admission.admit('ip:1', STREAM):
+        # подписчик не мешает обычным запросам
+        with admission.admit('ip:2', READ):
+            pass
+        # но второй поток сверх BOOKS_MAX_STREAMS - 503
+        with pytest.raises(AdmissionRejected) as rejected:
+            with admission.admit('ip:2', STREAM):
+                pass
+    assert rejected.value.status == 503
+    assert admission.stats()['in_flight_streams'] == 0